@@ -1,19 +1,33 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Blueprint, Response, current_app, render_template, stream_template, stream_with_context, request, jsonify, redirect, url_for, flash, send_file
 from config import Config
-from database import db, init_db, User, Tool, Request
+from database import db, init_app, init_db, add_initial_data, User, Tool, Request, InventoryCounter, ScanEvent, Kit
+from bulk_import import parse_price, parse_date, read_rows, import_tools
+from roster_sync import sync_users, USER_HEADER_TO_FIELD
+from history_export import export_filters, iter_export_rows, iter_csv, iter_xlsx
+from qr_images import QR_FORMATS, QR_ERROR_LEVELS, qr_cache_key, get_qr_image
+from label_sheets import find_font, tool_label, render_labels_pdf, start_label_job, get_label_job, label_job_pdf_path
+from tool_search import search_condition, search_tools
+from user_directory import user_directory
+from overdue_sweeper import sweep_overdue, start_overdue_sweeper
+from live_events import broker, watcher, event_stream
+from delta_sync import SYNC_TABLES, decode_cursor, table_etag, changed_rows
+from qr_lookup import qr_lookup
+from scan_sync import BatchRetry, apply_scan_events
+from kits import KitConflict, checkout_kit, return_kit, unavailable_tools, kit_availability
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 import pytz  # Нужно установить: pip install pytz
+import click
 import os
-import sys
 
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 
 
-app = Flask(__name__)
-app.config.from_object(Config)
+# Страницы и команды приложения; само приложение собирает create_app()
+bp = Blueprint('main', __name__, cli_group=None)
 
 # Контекстный процессор - делает функции доступными во всех шаблонах
-@app.context_processor
+@bp.app_context_processor
 def utility_processor():
     return dict(
         format_moscow_time=format_moscow_time,
@@ -37,6 +51,10 @@ def convert_to_moscow(utc_dt):
     utc_tz = pytz.utc
     return utc_tz.localize(utc_dt).astimezone(MOSCOW_TZ)
 
+def moscow_now_naive():
+    """Московское время без таймзоны - в таком виде хранятся даты заявок"""
+    return get_moscow_time().replace(tzinfo=None)
+
 def format_time(dt, format_str='%d.%m.%Y %H:%M'):
     """Простое форматирование времени без конвертации"""
     if not dt:
@@ -52,48 +70,64 @@ def format_moscow_time(dt, format_str='%d.%m.%Y %H:%M'):
     """Устаревшая функция, используйте format_time"""
     return format_time(dt, format_str)
 
-# ====== СОЗДАЁМ ПАПКИ ======
-base_dir = os.path.abspath(os.path.dirname(__file__))
-instance_dir = os.path.join(base_dir, 'instance')
-templates_dir = os.path.join(base_dir, 'templates')
-
-if not os.path.exists(instance_dir):
-    os.makedirs(instance_dir, exist_ok=True)
-    print(f"✅ Создана папка: {instance_dir}")
-
-if not os.path.exists(templates_dir):
-    os.makedirs(templates_dir, exist_ok=True)
-    print(f"✅ Создана папка: {templates_dir}")
-# ===========================
-
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Инициализируем базу данных
-try:
-    init_db(app)
-    print("✅ База данных инициализирована")
-except Exception as e:
-    print(f"❌ Ошибка при инициализации БД: {e}")
-    print("Проверьте права доступа к папке instance")
-    sys.exit(1)
-
-@app.route('/')
+# ====== ПОСТРАНИЧНЫЙ ВЫВОД ======
+def get_page_size(default=None):
+    """Размер страницы из параметра ?per_page=, ограниченный сверху"""
+    per_page = request.args.get('per_page', type=int) or default or current_app.config['ADMIN_PAGE_SIZE']
+    return max(1, min(per_page, current_app.config['ADMIN_MAX_PAGE_SIZE']))
+
+def fetch_page(query, per_page):
+    """Берём на одну строку больше, чтобы понять, есть ли следующая страница"""
+    items = query.limit(per_page + 1).all()
+    return items[:per_page], len(items) > per_page
+
+def page_url(**changes):
+    """URL текущей страницы с изменёнными параметрами (фильтры сохраняются)"""
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {key: value for key, value in args.items() if value not in (None, '')}
+    return url_for(request.endpoint, **args)
+
+def encode_request_cursor(req, field='request_time'):
+    """Курсор для заявок: время (по умолчанию создания) + id (на случай одинакового времени)"""
+    return f'{getattr(req, field).isoformat()}_{req.id}'
+
+def decode_request_cursor(cursor):
+    """Разбираем курсор заявок, некорректный курсор игнорируем"""
+    try:
+        request_time, request_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(request_time), int(request_id)
+    except (AttributeError, ValueError):
+        return None
+# ================================
+
+@bp.before_app_request
+def ensure_overdue_sweeper():
+    """
+    Фоновая пометка просрочек запускается с первым запросом в каждом процессе
+    сервера, если OVERDUE_SWEEP_SECONDS > 0 (по умолчанию выключена - cron)
+    """
+    start_overdue_sweeper(current_app._get_current_object(), current_app.config['OVERDUE_SWEEP_SECONDS'],
+                          moscow_now_naive)
+
+@bp.route('/')
 def home():
     """Главная страница"""
     # Статистика для главной страницы (внутри контекста запроса)
+    counters = InventoryCounter.totals()
     stats = {
-        'total_tools': Tool.query.count(),
-        'available_tools': Tool.query.filter_by(is_available=True).count(),
-        'total_users': User.query.filter_by(is_active=True).count(),
-        'active_requests': Request.query.filter_by(status=Request.STATUS_APPROVED).count(),
+        'total_tools': counters['total_tools'],
+        'available_tools': counters['available_tools'],
+        'total_users': counters['active_users'],
+        'active_requests': counters['active_requests'],
     }
     
     return render_template('index.html', stats=stats)
 
-@app.route('/test')
+@bp.route('/test')
 def test():
     """Тестовая страница"""
+    counters = InventoryCounter.totals()
     return """
     <!DOCTYPE html>
     <html>
@@ -121,37 +155,30 @@ def test():
         
         <div style="margin-top: 30px; padding: 20px; background: #f5f5f5; border-radius: 10px;">
             <h3>📊 Статистика:</h3>
-            <p>Пользователей: """ + str(User.query.count()) + """</p>
-            <p>Инструментов: """ + str(Tool.query.count()) + """</p>
-            <p>Заявок: """ + str(Request.query.count()) + """</p>
+            <p>Пользователей: """ + str(counters['total_users']) + """</p>
+            <p>Инструментов: """ + str(counters['total_tools']) + """</p>
+            <p>Заявок: """ + str(counters['total_requests']) + """</p>
         </div>
     </body>
     </html>
     """
 
-@app.route('/tool/<qr_code>')
+@bp.route('/tool/<qr_code>')
 def take_tool(qr_code):
     """Страница для взятия и возврата инструмента"""
-    tool = Tool.query.filter_by(qr_code_identifier=qr_code).first()
+    # Инструмент и активная заявка (с тем, кто взял) - из кэша сканирований
+    tool, active_request = qr_lookup.get(qr_code)
     
     if not tool:
         return render_template('error.html', 
                              error_message=f"Инструмент с QR-кодом '{qr_code}' не найден"), 404
     
-    # Находим активную заявку для этого инструмента
-    active_request = None
-    if not tool.is_available:
-        active_request = Request.query.filter_by(
-            tool_id=tool.id, 
-            status=Request.STATUS_APPROVED
-        ).first()
-    
     return render_template('take_tool.html', 
                          tool=tool,
                          active_request=active_request,
                          format_moscow_time=format_moscow_time)
 
-@app.route('/api/check-user', methods=['POST'])
+@bp.route('/api/check-user', methods=['POST'])
 def check_user():
     """Проверяем, есть ли пользователь в базе"""
     data = request.json
@@ -166,16 +193,9 @@ def check_user():
     if not (first_name and last_name):
         return jsonify({'success': False, 'message': 'Заполните имя и фамилию'}), 400
     
-    # Ищем пользователя
-    query = User.query.filter(
-        User.first_name.ilike(first_name),
-        User.last_name.ilike(last_name)
-    )
-    
-    if employee_id:
-        query = query.filter(User.employee_id.ilike(employee_id))
-    
-    user = query.first()
+    # Выбранный из подсказки, найденный по индексированным ключам (без учёта
+    # регистра и ё/е) или тот же сотрудник без табельного номера в базе
+    user = User.resolve_identity(first_name, last_name, employee_id, data.get('user_id'))
     
     if not user:
         # В тестовом режиме создаём пользователя
@@ -214,7 +234,19 @@ def check_user():
         }
     })
 
-@app.route('/api/create-request', methods=['POST'])
+@bp.route('/api/users/suggest')
+def suggest_users():
+    """Подсказки сотрудников для формы киоска: ?q=начало фамилии, имени или табельного номера"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    
+    # Меньше двух букв - слишком много совпадений, подсказка бесполезна
+    if len(query.replace(' ', '')) < 2:
+        return jsonify({'success': True, 'users': []})
+    
+    return jsonify({'success': True, 'users': user_directory.search(query, limit=limit)})
+
+@bp.route('/api/create-request', methods=['POST'])
 def create_request():
     """Создаём заявку на инструмент"""
     data = request.json
@@ -236,25 +268,28 @@ def create_request():
         return jsonify({'success': False, 'message': 'Инструмент не найден'}), 404
     
     if not tool.is_available:
-        return jsonify({'success': False, 'message': 'Инструмент уже занят'}), 400
+        return jsonify({'success': False, 'conflict': True, 'message': 'Инструмент уже занят'}), 409
     
     # Используем Московское время
     moscow_now = get_moscow_time()
     
-    # Создаём заявку
-    new_request = Request(
-        user_id=user.id,
-        tool_id=tool.id,
-        purpose=purpose,
-        status=Request.STATUS_APPROVED,
-        approval_time=moscow_now,
-        expected_return_time=moscow_now + timedelta(days=7)
-    )
-    
-    # Меняем статус инструмента
-    tool.is_available = False
-    
     try:
+        # Меняем статус инструмента условным UPDATE: если кто-то успел взять
+        # инструмент между проверкой выше и этой строкой, UPDATE не изменит ни одной строки
+        if not Tool.try_issue(tool.id):
+            db.session.rollback()
+            return jsonify({'success': False, 'conflict': True, 'message': 'Инструмент уже занят'}), 409
+        
+        # Создаём заявку в той же транзакции
+        new_request = Request(
+            user_id=user.id,
+            tool_id=tool.id,
+            purpose=purpose,
+            status=Request.STATUS_APPROVED,
+            approval_time=moscow_now,
+            expected_return_time=moscow_now + Request.LOAN_PERIOD
+        )
+        
         db.session.add(new_request)
         db.session.commit()
         
@@ -272,225 +307,172 @@ def create_request():
             'message': f'Ошибка при создании заявки: {str(e)}'
         }), 500
 
-@app.route('/admin/')
+@bp.route('/api/scans/batch', methods=['POST'])
+def scan_batch():
+    """
+    Пачка событий офлайн-сканера: {"device_id": ..., "events": [{"key", "type": "checkout"|"return",
+    "qr_code" или "tool_id", "user": {"user_id" или "first_name", "last_name", "employee_id"},
+    "client_time", "purpose", "condition_after", "notes"}, ...]}
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('events'), list):
+        return jsonify({'success': False, 'message': 'Нужен список событий events'}), 400
+    
+    events = data['events']
+    if len(events) > current_app.config['SCAN_BATCH_MAX_EVENTS']:
+        return jsonify({
+            'success': False,
+            'message': f"Не больше {current_app.config['SCAN_BATCH_MAX_EVENTS']} событий за раз, разбейте пачку"
+        }), 413
+    
+    device_id = str(data.get('device_id') or '')[:64] or None
+    try:
+        results = apply_scan_events(events, device_id, moscow_now_naive(), MOSCOW_TZ)
+    except (IntegrityError, BatchRetry):
+        # Те же события или те же инструменты одновременно обработал другой запрос -
+        # пачка откатилась, повтор вернёт актуальные результаты
+        return jsonify({
+            'success': False,
+            'retry': True,
+            'message': 'События уже обрабатываются другим запросом, повторите отправку'
+        }), 409
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Ошибка при обработке событий: {str(e)}'}), 500
+    
+    new_results = [result for result in results if not result['duplicate']]
+    return jsonify({
+        'success': True,
+        'applied': sum(result['status'] == ScanEvent.STATUS_APPLIED for result in new_results),
+        'conflicts': sum(result['status'] == ScanEvent.STATUS_CONFLICT for result in new_results),
+        'invalid': sum(result['status'] == ScanEvent.STATUS_INVALID for result in new_results),
+        'duplicates': len(results) - len(new_results),
+        'results': results
+    })
+
+@bp.route('/admin/')
 def admin_dashboard():
     """Страница статистики и управления"""
-    # Получаем все заявки
-    requests = Request.query.order_by(Request.request_time.desc()).limit(50).all()
+    # Фильтры из строки запроса
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'status': request.args.get('status', '').strip(),
+        'department': request.args.get('department', '').strip(),
+    }
+    cursor = decode_request_cursor(request.args.get('before'))
+    per_page = get_page_size(current_app.config['ADMIN_DASHBOARD_PAGE_SIZE'])
+    
+    # Пользователь и инструмент подгружаются тем же запросом (JOIN), а не по одному на строку
+    query = Request.query.options(*Request.load_options())
+    
+    if filters['status']:
+        query = query.filter(Request.status == filters['status'])
+    if filters['q'] or filters['department']:
+        query = query.join(User, User.id == Request.user_id)
+        if filters['q']:
+            pattern = f"%{filters['q']}%"
+            query = query.filter(db.or_(User.first_name.ilike(pattern), User.last_name.ilike(pattern)))
+        if filters['department']:
+            query = query.filter(User.department == filters['department'])
+    
+    # Keyset-пагинация по (request_time, id)
+    if cursor:
+        cursor_time, cursor_id = cursor
+        query = query.filter(db.or_(
+            Request.request_time < cursor_time,
+            db.and_(Request.request_time == cursor_time, Request.id < cursor_id)
+        ))
+    
+    requests, has_more = fetch_page(
+        query.order_by(Request.request_time.desc(), Request.id.desc()), per_page
+    )
+    next_url = page_url(before=encode_request_cursor(requests[-1])) if has_more else None
+    first_url = page_url(before=None) if cursor else None
     
     # Статистика
+    counters = InventoryCounter.totals()
     stats = {
-        'total_requests': Request.query.count(),
-        'active_requests': Request.query.filter_by(status=Request.STATUS_APPROVED).count(),
-        'total_tools': Tool.query.count(),
-        'available_tools': Tool.query.filter_by(is_available=True).count(),
-        'total_users': User.query.filter_by(is_active=True).count(),
-        'inactive_users': User.query.filter_by(is_active=False).count(),
+        'total_requests': counters['total_requests'],
+        'active_requests': counters['active_requests'],
+        'total_tools': counters['total_tools'],
+        'available_tools': counters['available_tools'],
+        'total_users': counters['active_users'],
+        'inactive_users': counters['total_users'] - counters['active_users'],
     }
     
-    # Простой HTML для админки
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>📊 Статистика системы</title>
-        <style>
-            body {{ font-family: Arial; margin: 20px; }}
-            h1 {{ color: #333; }}
-            .header-links {{ margin-bottom: 20px; }}
-            .header-links a {{ 
-                display: inline-block; margin-right: 10px; padding: 8px 15px;
-                background: #4CAF50; color: white; text-decoration: none;
-                border-radius: 5px; font-weight: bold;
-            }}
-            .dashboard-menu {{ 
-                display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 15px; margin: 30px 0;
-            }}
-            .dashboard-menu a {{ 
-                display: block; padding: 25px; background: #4CAF50; 
-                color: white; text-decoration: none; border-radius: 8px;
-                text-align: center; font-weight: bold; font-size: 16px;
-                transition: all 0.3s;
-            }}
-            .dashboard-menu a:hover {{ 
-                background: #45a049; transform: translateY(-2px);
-                box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            }}
-            .stats {{ display: flex; gap: 20px; margin-bottom: 30px; flex-wrap: wrap; }}
-            .stat-card {{ 
-                background: white; padding: 20px; border-radius: 8px; 
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1); min-width: 150px;
-            }}
-            .stat-value {{ font-size: 2em; font-weight: bold; color: #4CAF50; margin: 10px 0; }}
-            table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
-            th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-            th {{ background-color: #4CAF50; color: white; }}
-            .btn {{ 
-                padding: 5px 10px; background-color: #4CAF50; color: white; 
-                border: none; border-radius: 4px; cursor: pointer;
-            }}
-            .time-cell {{ font-family: monospace; font-size: 0.9em; }}
-            .section {{ 
-                background: white; padding: 20px; border-radius: 8px;
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1); margin-bottom: 30px;
-            }}
-            .section h2 {{ margin-top: 0; color: #333; border-bottom: 2px solid #4CAF50; padding-bottom: 10px; }}
-        </style>
-    </head>
-    <body>
-        <h1>📊 Статистика системы</h1>
-        
-        <div class="header-links">
-            <a href="/">🏠 Главная</a>
-        </div>
-        
-        <div class="dashboard-menu">
-            <a href="/admin/tools">🛠️ Управление инструментами</a>
-            <a href="/admin/users">👥 Управление пользователями</a>
-            <a href="/admin/qr-codes">🔗 Все QR-коды</a>
-        </div>
-        
-        <div class="section">
-            <h2>📈 Общая статистика</h2>
-            <div class="stats">
-    """
-    
-    for key, value in stats.items():
-        # Преобразуем название для отображения
-        display_name = key.replace('_', ' ').title()
-        if 'requests' in key:
-            display_name = display_name.replace('Requests', 'Заявок')
-        elif 'tools' in key:
-            display_name = display_name.replace('Tools', 'Инструментов')
-        elif 'users' in key:
-            display_name = display_name.replace('Users', 'Пользователей')
-        elif 'active' in key:
-            display_name = display_name.replace('Active', 'Активных')
-        elif 'inactive' in key:
-            display_name = display_name.replace('Inactive', 'Неактивных')
-        elif 'available' in key:
-            display_name = display_name.replace('Available', 'Доступно')
-        elif 'total' in key:
-            display_name = display_name.replace('Total', 'Всего')
-        
-        html += f"""
-                <div class="stat-card">
-                    <h3>{display_name}</h3>
-                    <div class="stat-value">{value}</div>
-                </div>
-        """
-    
-    html += """
-            </div>
-        </div>
-        
-        <div class="section">
-            <h2>📋 Последние заявки</h2>
-            <table>
-                <tr>
-                    <th>ID</th>
-                    <th>Пользователь</th>
-                    <th>Инструмент</th>
-                    <th>Время получения</th>
-                    <th>Время возврата</th>
-                    <th>Статус</th>
-                    <th>Действия</th>
-                </tr>
-    """
-    
-    for req in requests:
-        user = User.query.get(req.user_id)
-        tool = Tool.query.get(req.tool_id)
-        
-        if user and tool:
-            # Форматируем время в Московском часовом поясе
-            approval_time_formatted = format_time(req.approval_time)
-            actual_return_time_formatted = format_time(req.actual_return_time)
-            
-            html += f"""
-            <tr>
-                <td>{req.id}</td>
-                <td>{user.full_name()}</td>
-                <td>{tool.name}</td>
-                <td class="time-cell">{approval_time_formatted}</td>
-                <td class="time-cell">{actual_return_time_formatted}</td>
-                <td>{req.status}</td>
-                <td>
-                    { '<button class="btn" onclick="returnTool(' + str(req.id) + ')">Вернуть</button>' if req.status == Request.STATUS_APPROVED else '-' }
-                </td>
-            </tr>
-            """
-    
-    html += """
-            </table>
-        </div>
-        
-        <div class="section">
-            <h2>🛠️ Последние добавленные инструменты</h2>
-            <table>
-                <tr>
-                    <th>Название</th>
-                    <th>QR-код</th>
-                    <th>Статус</th>
-                    <th>Ссылка</th>
-                </tr>
-    """
-    
-    tools = Tool.query.order_by(Tool.id.desc()).limit(10).all()
-    for tool in tools:
-        html += f"""
-            <tr>
-                <td>{tool.name}</td>
-                <td>{tool.qr_code_identifier}</td>
-                <td>{'✅ Доступен' if tool.is_available else '❌ Занят'}</td>
-                <td><a href="/tool/{tool.qr_code_identifier}">Взять</a></td>
-            </tr>
-        """
-    
-    html += """
-            </table>
-        </div>
-        
-        <script>
-            async function returnTool(requestId) {
-                if (!confirm('Отметить как возвращённый?')) return;
-                
-                const response = await fetch('/admin/return/' + requestId, {
-                    method: 'POST'
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    alert(data.message);
-                    location.reload();
-                } else {
-                    alert('Ошибка: ' + data.message);
-                }
-            }
-        </script>
-    </body>
-    </html>
-    """
+    # Последние добавленные инструменты
+    recent_tools = Tool.query.order_by(Tool.id.desc()).limit(10).all()
+    
+    # Просроченные заявки уже помечены сборщиком - читаем по индексу (status, expected_return_time)
+    overdue_requests = Request.query.options(*Request.load_options()).filter(
+        Request.status == Request.STATUS_OVERDUE
+    ).order_by(Request.expected_return_time, Request.id).limit(current_app.config['OVERDUE_LIST_LIMIT']).all()
+    
+    # Шаблон отдаётся потоком: первые байты уходят клиенту до того,
+    # как отрендерены все строки таблицы
+    return stream_template('admin.html',
+                           requests=requests,
+                           recent_tools=recent_tools,
+                           overdue_requests=overdue_requests,
+                           stats=stats,
+                           filters=filters,
+                           next_url=next_url,
+                           first_url=first_url)
+
+@bp.route('/admin/events')
+def admin_events():
+    """Поток живых обновлений дашборда (Server-Sent Events)"""
+    subscriber = broker.subscribe(request.headers.get('Last-Event-ID'))
+    watcher.start(current_app._get_current_object())
+    watcher.wake()
+    return Response(
+        event_stream(subscriber, broker, current_app.config['LIVE_EVENTS_HEARTBEAT_SECONDS']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/admin/requests/rows')
+def admin_request_rows():
+    """HTML строк таблицы заявок по списку id - для живых обновлений дашборда"""
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value]
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Некорректный список id'}), 400
+    ids = ids[:current_app.config['ADMIN_MAX_PAGE_SIZE']]
     
-    return html
+    requests = Request.query.options(*Request.load_options()).filter(Request.id.in_(ids)).all() if ids else []
+    return jsonify({
+        'success': True,
+        'rows': {req.id: render_template('admin_request_row.html', req=req) for req in requests}
+    })
 
-@app.route('/admin/return/<int:request_id>', methods=['POST'])
+@bp.route('/admin/return/<int:request_id>', methods=['POST'])
 def return_tool(request_id):
     """Отметить инструмент как возвращённый"""
-    request_obj = Request.query.get_or_404(request_id)
+    # FOR UPDATE: в PostgreSQL второй одновременный возврат дождётся первого
+    # и увидит уже изменённый статус (SQLite эту блокировку игнорирует)
+    request_obj = Request.query.with_for_update().get_or_404(request_id)
     
-    if request_obj.status != Request.STATUS_APPROVED:
+    if not request_obj.is_active:
         return jsonify({
             'success': False,
             'message': f'Заявка #{request_id} уже не активна'
         }), 400
     
+    # Состояние и заметки из модального окна дашборда (необязательны)
+    data = request.get_json(silent=True) or {}
+    condition_after = (data.get('condition_after') or '').strip()
+    notes = (data.get('notes') or '').strip()
+    
     # Используем Московское время для возврата
     request_obj.return_tool()
     request_obj.actual_return_time = get_moscow_time()
     
+    if condition_after:
+        request_obj.condition_after = condition_after
+    
+    if notes:
+        request_obj.admin_notes = notes
+    
     try:
         db.session.commit()
         return jsonify({
@@ -505,16 +487,48 @@ def return_tool(request_id):
         }), 500
 
 def get_stats():
-    """Получаем статистику внутри контекста приложения"""
-    with app.app_context():
-        return {
-            'users': User.query.count(),
-            'tools': Tool.query.count(),
-            'requests': Request.query.count()
-        }
-    
+    """Получаем статистику (в контексте приложения)"""
+    counters = InventoryCounter.totals()
+    return {
+        'users': counters['total_users'],
+        'tools': counters['total_tools'],
+        'requests': counters['total_requests']
+    }
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Создать таблицы и применить миграции: flask --app app init-db"""
+    init_db()
+    print(f"✅ База данных готова: {db.engine.url.render_as_string(hide_password=True)}")
+
+@bp.cli.command('seed')
+def seed_command():
+    """Добавить демонстрационные данные (только в пустую базу): flask --app app seed"""
+    add_initial_data()
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Пересчитать счётчики статистики с нуля: flask --app app reconcile-counters"""
+    InventoryCounter.reconcile()
+    counters = InventoryCounter.totals()
+    print("✅ Счётчики пересчитаны")
+    for name, value in counters.items():
+        print(f"   {name}: {value}")
+
+@bp.cli.command('mark-overdue')
+def mark_overdue_command():
+    """Пометить просроченные заявки (для cron): flask --app app mark-overdue"""
+    count = sweep_overdue(moscow_now_naive())
+    print(f"✅ Помечено просроченных заявок: {count}")
 
-@app.route('/admin/qr-codes')
+@bp.cli.command('migrate')
+def migrate_command():
+    """Применить миграции схемы: flask --app app migrate"""
+    from migrations import run_migrations, current_version
+    run_migrations()
+    print(f"✅ Версия схемы: {current_version()}")
+
+@bp.route('/admin/qr-codes')
 def qr_codes():
     print("📋 Запрос к /admin/qr-codes")
     print(f"📁 Шаблон существует: {os.path.exists('templates/qr_codes.html')}")
@@ -522,8 +536,15 @@ def qr_codes():
     # Группируем инструменты по категориям
     all_tools = Tool.query.all()
     
+    # Активные заявки всех выданных инструментов - одним запросом вместе с пользователями
+    active_requests = Request.query.options(*Request.load_options()).filter(
+        Request.status.in_(Request.ACTIVE_STATUSES)
+    ).all()
+    active_by_tool = {req.tool_id: req for req in active_requests}
+    
     tools_by_category = {}
     for tool in all_tools:
+        tool.active_request = active_by_tool.get(tool.id)
         category = tool.category or "Без категории"
         if category not in tools_by_category:
             tools_by_category[category] = []
@@ -533,66 +554,523 @@ def qr_codes():
                          tools_by_category=tools_by_category,
                          Tool=Tool,
                          format_moscow_time=format_moscow_time,  # Передаем явно
-                         get_moscow_time=get_moscow_time)  # Передаем явно
+                         get_moscow_time=get_moscow_time,  # Передаем явно
+                         qr_image_url=qr_image_url)
+
+
+
+
+# ====== ПЕЧАТЬ НАКЛЕЕК ======
+def label_filters(source):
+    """Фильтры набора инструментов для печати из параметров запроса, формы или JSON"""
+    filters = {name: str(source.get(name) or '').strip()
+               for name in ('q', 'category', 'location', 'storage_place')}
+    ids = source.getlist('ids') if hasattr(source, 'getlist') else source.get('ids') or []
+    filters['ids'] = [int(tool_id) for tool_id in ids if str(tool_id).isdigit()]
+    return filters
+
+def label_tools_query(filters):
+    """Инструменты для наклеек в порядке раскладки по складу"""
+    query = Tool.query
+    if filters['q']:
+        query = query.filter(Tool.name.ilike(f"%{filters['q']}%"))
+    if filters['category']:
+        query = query.filter(Tool.category == filters['category'])
+    if filters['location']:
+        query = query.filter(Tool.location == filters['location'])
+    if filters['storage_place']:
+        query = query.filter(Tool.storage_place == filters['storage_place'])
+    if filters['ids']:
+        query = query.filter(Tool.id.in_(filters['ids']))
+    return query.order_by(Tool.location, Tool.storage_place, Tool.category, Tool.name, Tool.id)
+
+def label_layout(name=None):
+    """Раскладка листа наклеек по имени из конфига (ValueError, если такой нет)"""
+    name = name or current_app.config['LABEL_LAYOUT']
+    if name not in current_app.config['LABEL_LAYOUTS']:
+        raise ValueError(f'Неизвестная раскладка листа: {name}')
+    return current_app.config['LABEL_LAYOUTS'][name]
+
+@bp.route('/admin/qr-codes/print')
+def qr_codes_print():
+    """Страница QR-кодов для печати из браузера (с теми же фильтрами, что и PDF)"""
+    filters = label_filters(request.args)
+    
+    tools_by_category = {}
+    for tool in label_tools_query(filters):
+        tools_by_category.setdefault(tool.category or "Без категории", []).append(tool)
+    
+    return render_template('qr_codes_print.html',
+                         tools_by_category=tools_by_category,
+                         filters=filters,
+                         layouts=current_app.config['LABEL_LAYOUTS'],
+                         default_layout=current_app.config['LABEL_LAYOUT'],
+                         datetime=datetime,
+                         qr_image_url=qr_image_url)
+
+@bp.route('/admin/labels', methods=['POST'])
+def create_label_job():
+    """Запустить печать наклеек в PDF для отфильтрованных инструментов"""
+    data = request.get_json(silent=True) or request.form
+    
+    try:
+        layout = label_layout(data.get('layout'))
+        font_path = find_font(current_app.config['LABEL_FONT_PATH'])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    labels = [tool_label(tool) for tool in label_tools_query(label_filters(data))]
+    if not labels:
+        return jsonify({'success': False, 'message': 'Нет инструментов для печати'}), 400
+    
+    job_id = start_label_job(labels, layout, font_path, current_app.config['LABEL_OUTPUT_DIR'],
+                             workers=current_app.config['LABEL_WORKERS'],
+                             keep_seconds=current_app.config['LABEL_JOB_KEEP_SECONDS'])
+    return jsonify({
+        'success': True,
+        'message': f'Печать {len(labels)} наклеек запущена',
+        'job_id': job_id,
+        'total': len(labels),
+        'status_url': url_for('.label_job_status', job_id=job_id),
+    }), 202
+
+@bp.route('/admin/labels/<job_id>')
+def label_job_status(job_id):
+    """Прогресс задания на печать"""
+    job = get_label_job(current_app.config['LABEL_OUTPUT_DIR'], job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Задание не найдено'}), 404
+    
+    result = {
+        'success': job['status'] != 'failed',
+        'status': job['status'],
+        'done': job['done'],
+        'total': job['total'],
+        'message': job['error'] or f"Готово {job['done']} из {job['total']}",
+    }
+    if job['status'] == 'done':
+        result['pdf_url'] = url_for('.label_job_pdf', job_id=job_id)
+    return jsonify(result)
+
+@bp.route('/admin/labels/<job_id>/pdf')
+def label_job_pdf(job_id):
+    """Готовый PDF с наклейками"""
+    output_dir = current_app.config['LABEL_OUTPUT_DIR']
+    job = get_label_job(output_dir, job_id)
+    if not job or job['status'] != 'done':
+        return jsonify({'success': False, 'message': 'PDF ещё не готов'}), 404
+    return send_file(label_job_pdf_path(output_dir, job_id), mimetype='application/pdf', as_attachment=True,
+                     download_name=f"labels_{datetime.now().strftime('%Y-%m-%d')}.pdf")
+
+@bp.cli.command('print-labels')
+@click.argument('output')
+@click.option('--category', default='', help='Только эта категория')
+@click.option('--location', default='', help='Только это местоположение')
+@click.option('--layout', default=None, help='Раскладка листа из Config.LABEL_LAYOUTS')
+@click.option('--workers', default=None, type=int, help='Процессов для отрисовки')
+def print_labels_command(output, category, location, layout, workers):
+    """Наклейки с QR-кодами в PDF: flask --app app print-labels labels.pdf --location 'Склад №2'"""
+    filters = label_filters({'category': category, 'location': location})
+    labels = [tool_label(tool) for tool in label_tools_query(filters)]
+    if not labels:
+        print("⚠️  Нет инструментов для печати")
+        return
+    
+    def progress(done, total):
+        print(f"\r🖨️  Наклеек готово: {done} из {total}", end='', flush=True)
+    
+    content = render_labels_pdf(labels, label_layout(layout), find_font(current_app.config['LABEL_FONT_PATH']),
+                                workers=workers or current_app.config['LABEL_WORKERS'], progress=progress)
+    with open(output, 'wb') as file:
+        file.write(content)
+    print(f"\n✅ Сохранено в {output}")
+
+# ====== КАРТИНКИ QR-КОДОВ ======
+def qr_image_settings(size=None, level=None):
+    """
+    Размер и уровень коррекции картинки со значениями из конфига. Размер
+    округляется вверх до ближайшего из QR_IMAGE_SIZES (больше самого большого -
+    до него), так что в дисковом кэше лежит несколько вариантов картинки
+    инструмента, а не файл на каждое запрошенное число пикселей.
+    """
+    sizes = current_app.config['QR_IMAGE_SIZES']
+    size = size or current_app.config['QR_IMAGE_SIZE']
+    size = next((step for step in sizes if step >= size), sizes[-1])
+    level = (level or current_app.config['QR_ERROR_CORRECTION']).upper()
+    return size, level
+
+def qr_image_url(tool, image_format='png', size=None, level=None):
+    """
+    Ссылка на картинку QR-кода. Параметр v - начало ключа кэша: при смене
+    SITE_URL или идентификатора меняется и ссылка, поэтому браузер может
+    кэшировать картинку бессрочно.
+    """
+    size, level = qr_image_settings(size, level)
+    key = qr_cache_key(tool.qr_code_url, image_format, size, level)
+    return url_for('.tool_qr_image', qr_code=tool.qr_code_identifier, image_format=image_format,
+                   size=size, level=level, v=key[:16])
+
+@bp.route('/tool/<qr_code>/qr.<image_format>')
+def tool_qr_image(qr_code, image_format):
+    """Картинка QR-кода инструмента: PNG или SVG, ?size=пикселей&level=L|M|Q|H"""
+    if image_format not in QR_FORMATS:
+        return jsonify({'success': False, 'message': 'Поддерживаются форматы png и svg'}), 404
+    
+    size, level = qr_image_settings(request.args.get('size', type=int), request.args.get('level'))
+    if level not in QR_ERROR_LEVELS:
+        return jsonify({'success': False, 'message': 'Уровень коррекции: L, M, Q или H'}), 400
+    
+    tool, _ = qr_lookup.get(qr_code)
+    if not tool:
+        return jsonify({'success': False, 'message': 'Инструмент не найден'}), 404
+    
+    data = tool.qr_code_url
+    key = qr_cache_key(data, image_format, size, level)
+    # Ссылка с актуальной версией не устареет никогда, без версии - кэшируем на сутки
+    versioned = request.args.get('v') == key[:16]
+    max_age = 31536000 if versioned else 86400
+    
+    if key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(key)
+    else:
+        try:
+            path, key = get_qr_image(current_app.config['QR_CACHE_DIR'], data, image_format, size, level)
+        except RuntimeError as e:
+            return jsonify({'success': False, 'message': str(e)}), 500
+        response = send_file(path, mimetype=QR_FORMATS[image_format], etag=key,
+                             conditional=True, max_age=max_age)
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if versioned:
+        response.cache_control.immutable = True
+    return response
 
+@bp.route('/admin/qr-cache')
+def qr_cache_stats():
+    """Статистика кэша сканирований QR-кодов (попадания, промахи, сбросы)"""
+    return jsonify({'success': True, 'stats': qr_lookup.stats()})
 
+@bp.route('/admin/history')
+def return_history():
+    """История возвратов: длительность пользования и итоги считаются в SQL"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'date_from': request.args.get('date_from', '').strip(),
+        'date_to': request.args.get('date_to', '').strip(),
+    }
+    cursor = decode_request_cursor(request.args.get('before'))
+    per_page = get_page_size()
+    
+    # По умолчанию - последние 30 дней; пустой период в форме - вся история
+    if 'date_from' not in request.args and 'date_to' not in request.args:
+        filters['date_from'] = (get_moscow_time().date() - timedelta(days=30)).isoformat()
+    
+    # Некорректную дату в фильтре просто не применяем
+    try:
+        date_from = parse_date(filters['date_from'], 'date_from')
+    except ValueError:
+        date_from = filters['date_from'] = None
+    try:
+        date_to = parse_date(filters['date_to'], 'date_to')
+    except ValueError:
+        date_to = filters['date_to'] = None
+    
+    conditions = [Request.status == Request.STATUS_RETURNED, Request.actual_return_time.isnot(None)]
+    if date_from:
+        conditions.append(Request.actual_return_time >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        conditions.append(Request.actual_return_time < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if filters['q']:
+        pattern = f"%{filters['q']}%"
+        conditions.append(db.or_(
+            Tool.name.ilike(pattern), User.first_name.ilike(pattern), User.last_name.ilike(pattern)
+        ))
+    
+    def filtered(*columns):
+        """Запрос по возвращённым заявкам с фильтрами страницы"""
+        query = db.session.query(*columns).select_from(Request)
+        if filters['q']:
+            query = query.join(Tool, Tool.id == Request.tool_id).join(User, User.id == Request.user_id)
+        return query.filter(*conditions)
+    
+    usage_days = Request.usage_days()
+    
+    # Страница истории: keyset-пагинация по (дата возврата, id), новые сначала
+    query = filtered(Request, db.func.round(usage_days, 1)).options(*Request.load_options())
+    if cursor:
+        cursor_time, cursor_id = cursor
+        query = query.filter(db.or_(
+            Request.actual_return_time < cursor_time,
+            db.and_(Request.actual_return_time == cursor_time, Request.id < cursor_id)
+        ))
+    rows, has_more = fetch_page(
+        query.order_by(Request.actual_return_time.desc(), Request.id.desc()), per_page
+    )
+    
+    requests = []
+    for req, days in rows:
+        req.usage_duration = days
+        requests.append(req)
+    
+    next_url = page_url(before=encode_request_cursor(requests[-1], 'actual_return_time')) if has_more else None
+    first_url = page_url(before=None) if cursor else None
+    
+    # Итоги по всем возвратам с теми же фильтрами - одним запросом
+    total_returned, total_usage_days, avg_usage_days = filtered(
+        db.func.count(Request.id), db.func.sum(usage_days), db.func.avg(usage_days)
+    ).one()
+    
+    # Самые популярные инструменты и самые активные пользователи: группируем
+    # по внешнему ключу без JOIN, имена подтягиваем только для первых пяти
+    top_tools = filtered(Request.tool_id, db.func.count(Request.id).label('uses')).group_by(
+        Request.tool_id
+    ).order_by(db.desc('uses')).limit(5).subquery()
+    tool_stats = db.session.query(Tool.name, top_tools.c.uses).join(
+        top_tools, top_tools.c.tool_id == Tool.id
+    ).order_by(top_tools.c.uses.desc()).all()
+    
+    top_users = filtered(Request.user_id, db.func.count(Request.id).label('uses')).group_by(
+        Request.user_id
+    ).order_by(db.desc('uses')).limit(5).subquery()
+    user_stats = db.session.query(User.first_name, User.last_name, top_users.c.uses).join(
+        top_users, top_users.c.user_id == User.id
+    ).order_by(top_users.c.uses.desc()).all()
+    
+    return render_template('return_history.html',
+                         requests=requests,
+                         total_returned=total_returned,
+                         total_usage_days=round(total_usage_days or 0, 1),
+                         avg_usage_days=round(avg_usage_days or 0, 1),
+                         tool_stats=tool_stats,
+                         user_stats=user_stats,
+                         filters=filters,
+                         next_url=next_url,
+                         first_url=first_url)
+
+@bp.route('/admin/export/requests')
+def export_requests():
+    """
+    Выгрузка всей истории заявок в CSV (по умолчанию) или XLSX (?format=xlsx).
+    Фильтры: date_from, date_to (ГГГГ-ММ-ДД), status, department, category, q.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'xlsx'):
+        return jsonify({'success': False, 'message': 'Поддерживаются форматы csv и xlsx'}), 400
+    
+    try:
+        filters = export_filters(request.args)
+        rows = iter_export_rows(filters, format_time)
+        if export_format == 'xlsx':
+            body = iter_xlsx(rows)
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        else:
+            body = iter_csv(rows)
+            mimetype = 'text/csv; charset=utf-8'
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    filename = f"requests_{get_moscow_time().strftime('%Y-%m-%d')}.{export_format}"
+    # stream_with_context: генератор читает базу уже после выхода из функции
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
 
+@bp.route('/api/sync/<table>')
+def api_sync(table):
+    """
+    Изменения списка с прошлой синхронизации: /api/sync/tools?since=<next из прошлого ответа>.
+    Таблицы: tools, users, requests. Без изменений - 304 по If-None-Match / If-Modified-Since.
+    """
+    if table not in SYNC_TABLES:
+        return jsonify({'success': False, 'message': f'Неизвестный список: {table}'}), 404
+    
+    since = request.args.get('since', '').strip()
+    cursor = decode_cursor(since) if since else None
+    if since and cursor is None:
+        return jsonify({'success': False, 'message': 'Некорректный курсор since'}), 400
+    
+    # Версия таблицы - одна строка счётчиков; сама таблица пока не читается
+    changes, deletes, last_modified = InventoryCounter.versions(table)
+    etag = table_etag(table, changes, deletes)
+    
+    # Были удаления - по updated_at их не найти, клиент получает список заново
+    reset = cursor is not None and cursor[2] != deletes
+    if reset:
+        cursor = None
+    
+    # Клиент уже синхронизирован до текущей версии (или берёт весь список)
+    if cursor is None or cursor[3] == changes:
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(last_modified and request.if_modified_since and
+                                last_modified.replace(microsecond=0, tzinfo=pytz.utc) <= request.if_modified_since)
+        if not_modified and not reset:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+    
+    if cursor is not None and cursor[3] == changes:
+        rows, has_more, next_cursor = [], False, since
+    else:
+        rows, has_more, next_cursor = changed_rows(
+            table, cursor, get_page_size(current_app.config['ADMIN_MAX_PAGE_SIZE']), changes, deletes
+        )
+    
+    response = jsonify({
+        'success': True,
+        'table': table,
+        'version': changes,
+        'reset': reset,
+        'rows': rows,
+        'has_more': has_more,
+        'next': next_cursor,
+    })
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=pytz.utc)
+    # Кэшировать можно, но перед использованием - всегда проверять у сервера
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-@app.route('/admin/tools')
+@bp.route('/api/tools/search')
+def api_search_tools():
+    """Поиск инструментов: ?q=запрос&page=1&per_page=20, самые релевантные первыми"""
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = get_page_size(20)
+    
+    if not query:
+        return jsonify({'success': False, 'message': 'Пустой поисковый запрос'}), 400
+    
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    tools = search_tools(query, offset=(page - 1) * per_page, limit=per_page + 1)
+    
+    return jsonify({
+        'success': True,
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(tools) > per_page,
+        'tools': [{
+            'id': tool.id,
+            'name': tool.name,
+            'category': tool.category,
+            'manufacturer': tool.manufacturer,
+            'model': tool.model,
+            'serial_number': tool.serial_number,
+            'location': tool.location,
+            'storage_place': tool.storage_place,
+            'is_available': tool.is_available,
+            'qr_code': tool.qr_code_identifier,
+        } for tool in tools[:per_page]]
+    })
+
+@bp.route('/admin/tools')
 def admin_tools():
     print("📋 Запрос к /admin/tools")
     print(f"📁 Шаблон admin_tools.html существует: {os.path.exists('templates/admin_tools.html')}")
     """Страница управления инструментами"""
-    # Получаем все инструменты
-    tools = Tool.query.order_by(Tool.id.desc()).all()
-    
-    # Для каждого инструмента получаем активную заявку
-    for tool in tools:
-        # Находим активную заявку (статус approved)
-        active_request = Request.query.filter_by(
-            tool_id=tool.id, 
-            status=Request.STATUS_APPROVED
-        ).first()
+    # Фильтры из строки запроса
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'category': request.args.get('category', '').strip(),
+        'location': request.args.get('location', '').strip(),
+        'status': request.args.get('status', '').strip(),
+    }
+    after_id = request.args.get('after', type=int)
+    per_page = get_page_size()
+    
+    # Инструменты вместе с активной заявкой и тем, кто взял инструмент - одним запросом
+    query = db.session.query(Tool, Request, User).outerjoin(
+        Request,
+        db.and_(Request.tool_id == Tool.id, Request.status.in_(Request.ACTIVE_STATUSES))
+    ).outerjoin(
+        User, User.id == Request.user_id
+    )
+    
+    if filters['q']:
+        # Полнотекстовый поиск по названию, модели, производителю, серийному номеру и т.д.
+        query = query.filter(search_condition(filters['q']))
+    if filters['category']:
+        query = query.filter(Tool.category == filters['category'])
+    if filters['location']:
+        query = query.filter(Tool.location == filters['location'])
+    if filters['status'] == 'available':
+        query = query.filter(Tool.is_available == True)
+    elif filters['status'] == 'taken':
+        query = query.filter(Tool.is_available == False)
+    
+    # Keyset-пагинация: следующая страница начинается после последнего показанного id
+    if after_id:
+        query = query.filter(Tool.id < after_id)
+    
+    rows, has_more = fetch_page(query.order_by(Tool.id.desc()), per_page)
+    
+    tools = []
+    for tool, active_request, _borrower in rows:
+        # Если по ошибке активных заявок несколько, показываем инструмент один раз
+        if tools and tools[-1] is tool:
+            continue
         # Добавляем в объект инструмента для использования в шаблоне
         tool.active_request = active_request
+        tools.append(tool)
     
-    # Получаем уникальные категории
-    categories = sorted(set([tool.category for tool in tools if tool.category]))
-    
-    # Статистика
+    # Статистика из счётчиков, без COUNT(*) по таблице инструментов
+    counters = InventoryCounter.totals()
     stats = {
-        'total': Tool.query.count(),
-        'available': Tool.query.filter_by(is_available=True).count(),
-        'taken': Tool.query.filter_by(is_available=False).count(),
+        'total': counters['total_tools'],
+        'available': counters['available_tools'],
+        'taken': counters['total_tools'] - counters['available_tools'],
         'by_category': {}
     }
     
+    by_category = InventoryCounter.by_scope('category')
+    
+    # Получаем уникальные категории
+    categories = sorted(category for category, data in by_category.items() if data.get('total_tools'))
+    
     # Статистика по категориям
     for category in categories:
-        total_in_category = Tool.query.filter_by(category=category).count()
-        available_in_category = Tool.query.filter_by(category=category, is_available=True).count()
-        
         stats['by_category'][category] = {
-            'total': total_in_category,
-            'available': available_in_category
+            'total': by_category[category].get('total_tools', 0),
+            'available': by_category[category].get('available_tools', 0)
         }
     
+    # Места хранения для фильтра
+    locations = sorted(
+        location for location, data in InventoryCounter.by_scope('location').items()
+        if data.get('total_tools')
+    )
+    
+    next_url = page_url(after=tools[-1].id) if has_more and tools else None
+    first_url = page_url(after=None) if after_id else None
+    
     return render_template('admin_tools.html', 
                          tools=tools,
                          categories=categories,
+                         locations=locations,
+                         filters=filters,
+                         next_url=next_url,
+                         first_url=first_url,
                          stats=stats,
                          format_moscow_time=format_moscow_time,  # Передаем явно
                          get_moscow_time=get_moscow_time)  # Передаем явно
 
-@app.route('/admin/tools/delete/<int:tool_id>', methods=['POST'])
+@bp.route('/admin/tools/delete/<int:tool_id>', methods=['POST'])
 def delete_tool(tool_id):
     """Удаление инструмента"""
-    tool = Tool.query.get_or_404(tool_id)
+    # Блокируем строку инструмента, чтобы его не выдали, пока мы проверяем и удаляем
+    tool = Tool.query.with_for_update().get_or_404(tool_id)
     
     # Проверяем, не выдан ли инструмент
-    active_requests = Request.query.filter_by(
-        tool_id=tool_id, 
-        status=Request.STATUS_APPROVED
+    active_requests = Request.query.filter(
+        Request.tool_id == tool_id,
+        Request.status.in_(Request.ACTIVE_STATUSES)
     ).count()
     
     if active_requests > 0:
@@ -602,8 +1080,13 @@ def delete_tool(tool_id):
         }), 400
     
     try:
-        # Удаляем связанные заявки
-        Request.query.filter_by(tool_id=tool_id).delete()
+        # Удаляем связанные заявки (массовый DELETE, поэтому счётчик заявок правим сами)
+        deleted_requests = Request.query.filter_by(tool_id=tool_id).delete()
+        if deleted_requests:
+            InventoryCounter.apply({
+                ('global', '', 'total_requests'): -deleted_requests,
+                **InventoryCounter.version_deltas('requests', deleted=True),
+            })
         
         # Удаляем сам инструмент
         db.session.delete(tool)
@@ -621,7 +1104,7 @@ def delete_tool(tool_id):
             'message': f'Ошибка при удалении: {str(e)}'
         }), 500
     
-@app.route('/admin/tools/edit/<int:tool_id>', methods=['GET', 'POST'])
+@bp.route('/admin/tools/edit/<int:tool_id>', methods=['GET', 'POST'])
 def edit_tool(tool_id):
     """Редактирование инструмента"""
     tool = Tool.query.get_or_404(tool_id)
@@ -695,7 +1178,7 @@ def edit_tool(tool_id):
             'message': f'Ошибка при обновлении инструмента: {str(e)}'
         }), 500
 
-@app.route('/admin/add-tool', methods=['GET', 'POST'])
+@bp.route('/admin/add-tool', methods=['GET', 'POST'])
 def add_tool():
     """Добавление нового инструмента"""
     if request.method == 'GET':
@@ -732,37 +1215,16 @@ def add_tool():
                 'message': 'Название инструмента обязательно для заполнения'
             }), 400
         
-        # Преобразуем цену
-        price_float = None
-        if price:
-            try:
-                price_float = float(price)
-            except ValueError:
-                return jsonify({
-                    'success': False,
-                    'message': 'Некорректное значение цены'
-                }), 400
-        
-        # Преобразуем даты
-        purchase_date = None
-        if purchase_date_str:
-            try:
-                purchase_date = datetime.strptime(purchase_date_str, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({
-                    'success': False,
-                    'message': 'Некорректный формат даты приобретения'
-                }), 400
-        
-        warranty_until = None
-        if warranty_until_str:
-            try:
-                warranty_until = datetime.strptime(warranty_until_str, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({
-                    'success': False,
-                    'message': 'Некорректный формат даты гарантии'
-                }), 400
+        # Преобразуем цену и даты (те же правила, что и при массовом импорте)
+        try:
+            price_float = parse_price(price)
+            purchase_date = parse_date(purchase_date_str, 'Некорректный формат даты приобретения')
+            warranty_until = parse_date(warranty_until_str, 'Некорректный формат даты гарантии')
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         # Создаем новый инструмент
         new_tool = Tool(
@@ -803,29 +1265,178 @@ def add_tool():
             'message': f'Ошибка при добавлении инструмента: {str(e)}'
         }), 500
 
-@app.route('/admin/users')
+@bp.route('/admin/tools/import', methods=['POST'])
+def import_tools_file():
+    """Массовый импорт инструментов из CSV/XLSX"""
+    file = request.files.get('file')
+    
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'Файл не выбран'}), 400
+    
+    try:
+        result = import_tools(
+            read_rows(file.stream, file.filename),
+            batch_size=current_app.config['IMPORT_BATCH_SIZE']
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при импорте: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'message': f"Импортировано инструментов: {result['imported']}, ошибок: {len(result['errors'])}",
+        'imported': result['imported'],
+        'errors': result['errors'],
+        'tools': result['tools']
+    })
+
+@bp.cli.command('import-tools')
+@click.argument('path')
+@click.option('--batch-size', default=None, type=int, help='Строк в одной транзакции')
+def import_tools_command(path, batch_size):
+    """Импорт инструментов из CSV/XLSX: flask --app app import-tools tools.csv"""
+    with open(path, 'rb') as file:
+        result = import_tools(
+            read_rows(file, path),
+            batch_size=batch_size or current_app.config['IMPORT_BATCH_SIZE']
+        )
+    
+    print(f"✅ Импортировано инструментов: {result['imported']}")
+    for error in result['errors']:
+        print(f"⚠️  Строка {error['row']}: {error['message']}")
+
+@bp.route('/admin/users/sync', methods=['POST'])
+def sync_users_roster():
+    """
+    Синхронизация пользователей с кадровым списком.
+    Принимает файл CSV/XLSX (поле file) или JSON {"employees": [...]}.
+    Параметр dry_run=1 - только показать различия.
+    """
+    file = request.files.get('file')
+    
+    if file and file.filename:
+        rows = read_rows(file.stream, file.filename, header_map=USER_HEADER_TO_FIELD)
+        dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    else:
+        data = request.get_json(silent=True) or {}
+        employees = data.get('employees')
+        if not isinstance(employees, list):
+            return jsonify({'success': False, 'message': 'Не передан список сотрудников'}), 400
+        rows = enumerate(employees, start=1)
+        dry_run = bool(data.get('dry_run'))
+    
+    try:
+        report = sync_users(rows, dry_run=dry_run)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при синхронизации: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'message': (
+            f"Добавлено: {len(report['created'])}, обновлено: {len(report['updated'])}, "
+            f"восстановлено: {len(report['reactivated'])}, деактивировано: {len(report['deactivated'])}"
+        ),
+        **report
+    })
+
+@bp.cli.command('sync-users')
+@click.argument('path')
+@click.option('--dry-run', is_flag=True, help='Только показать различия')
+def sync_users_command(path, dry_run):
+    """Синхронизация пользователей с кадровым списком: flask --app app sync-users staff.xlsx"""
+    with open(path, 'rb') as file:
+        report = sync_users(read_rows(file, path, header_map=USER_HEADER_TO_FIELD), dry_run=dry_run)
+    
+    prefix = '🔍 (без изменений в базе) ' if dry_run else '✅ '
+    print(f"{prefix}Добавлено: {len(report['created'])}, обновлено: {len(report['updated'])}, "
+          f"восстановлено: {len(report['reactivated'])}, деактивировано: {len(report['deactivated'])}, "
+          f"без изменений: {report['unchanged']}")
+    for user in report['deactivated']:
+        print(f"   ⛔ {user['full_name']} (id {user['id']})")
+    for error in report['errors']:
+        where = f"Строка {error['row']}" if 'row' in error else f"Табельный номер {error['employee_id']}"
+        print(f"⚠️  {where}: {error['message']}")
+
+@bp.route('/admin/users')
 def admin_users():
     """Страница управления пользователями"""
-    # Получаем всех пользователей
-    users = User.query.order_by(User.id.desc()).all()
+    # Фильтры из строки запроса
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'department': request.args.get('department', '').strip(),
+        'status': request.args.get('status', '').strip(),
+    }
+    after_id = request.args.get('after', type=int)
+    per_page = get_page_size()
+    
+    query = User.query
+    
+    if filters['q']:
+        pattern = f"%{filters['q']}%"
+        query = query.filter(db.or_(
+            User.first_name.ilike(pattern),
+            User.last_name.ilike(pattern),
+            User.employee_id.ilike(pattern)
+        ))
+    if filters['department']:
+        query = query.filter(User.department == filters['department'])
+    if filters['status'] == 'active':
+        query = query.filter(User.is_active == True)
+    elif filters['status'] == 'inactive':
+        query = query.filter(User.is_active == False)
+    
+    # Keyset-пагинация по id
+    if after_id:
+        query = query.filter(User.id < after_id)
+    
+    users, has_more = fetch_page(query.order_by(User.id.desc()), per_page)
+    
+    # Количество заявок только для пользователей на странице - одним GROUP BY
+    request_counts = dict(db.session.query(Request.user_id, db.func.count(Request.id)).filter(
+        Request.user_id.in_([user.id for user in users])
+    ).group_by(Request.user_id).all()) if users else {}
+    
+    for user in users:
+        user.request_count = request_counts.get(user.id, 0)
     
     # Получаем уникальные отделы
-    departments = sorted(set([user.department for user in users if user.department]))
+    departments = sorted(
+        department for department, data in InventoryCounter.by_scope('department').items()
+        if data.get('total_users')
+    )
+    
+    next_url = page_url(after=users[-1].id) if has_more else None
+    first_url = page_url(after=None) if after_id else None
     
     # Статистика
+    counters = InventoryCounter.totals()
     stats = {
-        'total': User.query.count(),
-        'active': User.query.filter_by(is_active=True).count(),
-        'inactive': User.query.filter_by(is_active=False).count()
+        'total': counters['total_users'],
+        'active': counters['active_users'],
+        'inactive': counters['total_users'] - counters['active_users']
     }
     
     return render_template('admin_users.html', 
                          users=users,
                          departments=departments,
+                         filters=filters,
+                         next_url=next_url,
+                         first_url=first_url,
                          stats=stats)
 
 
-@app.route('/admin/users/toggle-status/<int:user_id>', methods=['POST'])
+@bp.route('/admin/users/toggle-status/<int:user_id>', methods=['POST'])
 def toggle_user_status(user_id):
     """Переключение статуса пользователя (активен/неактивен)"""
     user = User.query.get_or_404(user_id)
@@ -850,7 +1461,7 @@ def toggle_user_status(user_id):
             'message': f'Ошибка при изменении статуса: {str(e)}'
         }), 500
 
-@app.route('/admin/users/delete/<int:user_id>', methods=['POST'])
+@bp.route('/admin/users/delete/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
     """Удаление пользователя"""
     user = User.query.get_or_404(user_id)
@@ -873,7 +1484,7 @@ def delete_user(user_id):
             'message': f'Ошибка при удалении пользователя: {str(e)}'
         }), 500
 
-@app.route('/admin/add-user', methods=['GET', 'POST'])
+@bp.route('/admin/add-user', methods=['GET', 'POST'])
 def add_user():
     """Добавление нового пользователя"""
     if request.method == 'GET':
@@ -943,7 +1554,7 @@ def add_user():
         }), 500
 
 
-@app.route('/admin/users/edit/<int:user_id>', methods=['GET', 'POST'])
+@bp.route('/admin/users/edit/<int:user_id>', methods=['GET', 'POST'])
 def edit_user(user_id):
     """Редактирование пользователя"""
     user = User.query.get_or_404(user_id)
@@ -1013,7 +1624,7 @@ def edit_user(user_id):
             'message': f'Ошибка при обновлении пользователя: {str(e)}'
         }), 500
 
-@app.route('/api/verify-return', methods=['POST'])
+@bp.route('/api/verify-return', methods=['POST'])
 def verify_return():
     """Проверяем, может ли пользователь вернуть инструмент"""
     data = request.json
@@ -1029,35 +1640,33 @@ def verify_return():
     if not (first_name and last_name and tool_id):
         return jsonify({'success': False, 'message': 'Не все обязательные поля заполнены'}), 400
     
-    # Ищем активную заявку на этот инструмент
-    active_request = Request.query.filter_by(
-        tool_id=tool_id,
-        status=Request.STATUS_APPROVED
+    # Ищем активную заявку на этот инструмент (вместе с пользователем)
+    active_request = Request.query.options(*Request.load_options()).filter(
+        Request.tool_id == tool_id,
+        Request.status.in_(Request.ACTIVE_STATUSES)
     ).first()
     
     if not active_request:
         return jsonify({'success': False, 'message': 'Нет активной заявки на этот инструмент'}), 404
     
     # Получаем пользователя из заявки
-    user = User.query.get(active_request.user_id)
+    user = active_request.requester
     if not user:
         return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
     
-    # Проверяем совпадение данных
-    if (user.first_name.lower() != first_name.lower() or 
-        user.last_name.lower() != last_name.lower()):
+    # Проверяем совпадение данных (по тем же нормализованным ключам, что и /api/check-user)
+    if not user.matches_identity(first_name, last_name):
         return jsonify({
             'success': False, 
             'message': 'Данные не совпадают с пользователем, взявшим инструмент'
         }), 403
     
     # Проверяем табельный номер, если он был указан при взятии
-    if employee_id and user.employee_id:
-        if user.employee_id.lower() != employee_id.lower():
-            return jsonify({
-                'success': False, 
-                'message': 'Табельный номер не совпадает'
-            }), 403
+    if not user.matches_identity(first_name, last_name, employee_id):
+        return jsonify({
+            'success': False, 
+            'message': 'Табельный номер не совпадает'
+        }), 403
     
     return jsonify({
         'success': True,
@@ -1071,7 +1680,7 @@ def verify_return():
     })
 
 
-@app.route('/api/return-tool', methods=['POST'])
+@bp.route('/api/return-tool', methods=['POST'])
 def api_return_tool():
     """API для возврата инструмента пользователем"""
     data = request.json
@@ -1086,18 +1695,22 @@ def api_return_tool():
     if not request_id:
         return jsonify({'success': False, 'message': 'ID заявки не указан'}), 400
     
-    request_obj = Request.query.get(request_id)
-    if not request_obj:
-        return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
-    
-    if request_obj.status != Request.STATUS_APPROVED:
-        return jsonify({
-            'success': False,
-            'message': f'Заявка #{request_id} уже не активна'
-        }), 400
-    
-    # Возвращаем инструмент
     try:
+        # Блокируем только строку заявки: PostgreSQL не даёт FOR UPDATE для
+        # присоединённых через LEFT OUTER JOIN пользователя и инструмента
+        request_obj = Request.query.options(*Request.load_options()).filter_by(
+            id=request_id
+        ).with_for_update(of=Request).first()
+        if not request_obj:
+            return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
+        
+        if not request_obj.is_active:
+            return jsonify({
+                'success': False,
+                'message': f'Заявка #{request_id} уже не активна'
+            }), 400
+        
+        # Возвращаем инструмент
         request_obj.return_tool()
         request_obj.actual_return_time = get_moscow_time()
         
@@ -1122,19 +1735,232 @@ def api_return_tool():
             'message': f'Ошибка при возврате инструмента: {str(e)}'
         }), 500
 
+# ====== КОМПЛЕКТЫ ======
+def kit_conflict_response(conflict):
+    """Ответ 409 со списком инструментов, из-за которых операция с комплектом невозможна"""
+    return jsonify({
+        'success': False,
+        'conflict': True,
+        'message': conflict.message,
+        'tools': [dict(tool, expected_return_time=format_moscow_time(tool['expected_return_time']))
+                  for tool in conflict.tools]
+    }), 409
+
+@bp.route('/kit/<qr_code>')
+def take_kit(qr_code):
+    """Страница для взятия и возврата комплекта целиком"""
+    kit = Kit.query.options(db.selectinload(Kit.tools)).filter_by(qr_code_identifier=qr_code).first()
+    if not kit:
+        return render_template('error.html',
+                             error_message=f"Комплект с QR-кодом '{qr_code}' не найден"), 404
+    
+    # Занятые инструменты вместе с тем, у кого они, - одним запросом
+    taken = {tool['id']: tool for tool in unavailable_tools([tool.id for tool in kit.tools])}
+    
+    return render_template('take_kit.html',
+                         kit=kit,
+                         taken=taken,
+                         format_moscow_time=format_moscow_time)
+
+@bp.route('/api/kits/<int:kit_id>/checkout', methods=['POST'])
+def checkout_kit_api(kit_id):
+    """Выдать все инструменты комплекта одной транзакцией - или ни одного"""
+    data = request.json
+    
+    if not data:
+        return jsonify({'success': False, 'message': 'Нет данных'}), 400
+    
+    kit = Kit.query.options(db.selectinload(Kit.tools)).get(kit_id)
+    if not kit:
+        return jsonify({'success': False, 'message': 'Комплект не найден'}), 404
+    
+    user = db.session.get(User, data.get('user_id')) if data.get('user_id') else None
+    if not user:
+        return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+    
+    if not user.is_active:
+        return jsonify({'success': False, 'message': 'Пользователь не активен'}), 403
+    
+    kit_name = kit.name
+    full_name = user.full_name()
+    moscow_now = moscow_now_naive()
+    
+    try:
+        items = checkout_kit(kit, user, data.get('purpose', '').strip(), moscow_now)
+    except KitConflict as conflict:
+        return kit_conflict_response(conflict)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при выдаче комплекта: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'message': f'✅ Комплект "{kit_name}" ({len(items)} шт.) выдан {full_name}',
+        'items': items,
+        'timestamp': moscow_now.strftime('%d.%m.%Y %H:%M:%S')
+    })
+
+@bp.route('/api/kits/<int:kit_id>/return', methods=['POST'])
+def return_kit_api(kit_id):
+    """Вернуть все выданные инструменты комплекта одной транзакцией"""
+    data = request.json
+    
+    if not data:
+        return jsonify({'success': False, 'message': 'Нет данных'}), 400
+    
+    first_name = data.get('first_name', '').strip()
+    last_name = data.get('last_name', '').strip()
+    employee_id = data.get('employee_id', '').strip()
+    
+    if not (first_name and last_name):
+        return jsonify({'success': False, 'message': 'Заполните имя и фамилию'}), 400
+    
+    kit = Kit.query.options(db.selectinload(Kit.tools)).get(kit_id)
+    if not kit:
+        return jsonify({'success': False, 'message': 'Комплект не найден'}), 404
+    
+    kit_name = kit.name
+    moscow_now = moscow_now_naive()
+    
+    try:
+        items = return_kit(kit, first_name, last_name, employee_id, moscow_now,
+                           condition_after=data.get('condition_after', '').strip(),
+                           notes=data.get('notes', '').strip())
+    except KitConflict as conflict:
+        return kit_conflict_response(conflict)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при возврате комплекта: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'message': f'✅ Комплект "{kit_name}" возвращён ({len(items)} шт.)',
+        'items': items,
+        'timestamp': moscow_now.strftime('%d.%m.%Y %H:%M:%S')
+    })
+
+@bp.route('/admin/kits', methods=['GET', 'POST'])
+def admin_kits():
+    """Список комплектов и создание нового"""
+    if request.method == 'GET':
+        kits = Kit.query.options(db.selectinload(Kit.tools)).order_by(Kit.name).all()
+        return render_template('admin_kits.html',
+                             kits=kits,
+                             availability=kit_availability([kit.id for kit in kits]))
+    
+    name = request.form.get('name', '').strip()
+    description = request.form.get('description', '').strip()
+    # QR-коды инструментов через пробел, запятую или с новой строки
+    qr_codes = list(dict.fromkeys(request.form.get('tools', '').replace(',', ' ').upper().split()))
+    
+    if not name:
+        return jsonify({'success': False, 'message': 'Название комплекта обязательно для заполнения'}), 400
+    
+    if not qr_codes:
+        return jsonify({'success': False, 'message': 'Укажите QR-коды инструментов комплекта'}), 400
+    
+    if Kit.query.filter_by(name=name).first():
+        return jsonify({'success': False, 'message': f'Комплект "{name}" уже существует'}), 400
+    
+    tools = Tool.query.filter(Tool.qr_code_identifier.in_(qr_codes)).all()
+    missing = sorted(set(qr_codes) - {tool.qr_code_identifier for tool in tools})
+    if missing:
+        return jsonify({
+            'success': False,
+            'message': f'Инструменты не найдены: {", ".join(missing)}'
+        }), 400
+    
+    try:
+        kit = Kit(name=name, description=description or None, tools=tools)
+        db.session.add(kit)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Комплект "{name}" ({len(tools)} шт.) создан',
+            'kit_id': kit.id,
+            'qr_code': kit.qr_code_identifier,
+            'kit_url': f"{request.host_url}kit/{kit.qr_code_identifier}"
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при создании комплекта: {str(e)}'
+        }), 500
+
+@bp.route('/admin/kits/delete/<int:kit_id>', methods=['POST'])
+def delete_kit(kit_id):
+    """Удаление комплекта (инструменты и заявки остаются)"""
+    kit = Kit.query.get_or_404(kit_id)
+    
+    try:
+        db.session.delete(kit)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Комплект "{kit.name}" удалён'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка при удалении: {str(e)}'
+        }), 500
+# ========================
+
+# ====== ФАБРИКА ПРИЛОЖЕНИЯ ======
+def create_app(config=None):
+    """
+    Собрать приложение. Импорт модуля и create_app() не обращаются к базе и
+    ничего не создают на диске, поэтому воркеры сервера стартуют быстро;
+    таблицы, миграции и демо-данные - командами init-db и seed.
+    config - словарь или объект настроек поверх Config.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    
+    init_app(app)
+    
+    # Кэши общие для процесса - настраиваем их из конфигурации приложения
+    user_directory.refresh_seconds = app.config['USER_DIRECTORY_REFRESH_SECONDS']
+    qr_lookup.max_size = app.config['QR_LOOKUP_CACHE_SIZE']
+    qr_lookup.ttl_seconds = app.config['QR_LOOKUP_TTL_SECONDS']
+    qr_lookup.check_seconds = app.config['QR_LOOKUP_CHECK_SECONDS']
+    watcher.poll_seconds = app.config['LIVE_EVENTS_POLL_SECONDS']
+    
+    app.register_blueprint(bp)
+    return app
+# ================================
+
 if __name__ == '__main__':
-    print("\n" + "="*60)
-    print("🚀 СИСТЕМА УЧЁТА ИНСТРУМЕНТОВ")
-    print("="*60)
-    print(f"📍 URL: http://localhost:5001")
+    # Локально процесс один - просрочки помечает фоновый поток, cron не нужен
+    app = create_app({'OVERDUE_SWEEP_SECONDS': int(os.environ.get('OVERDUE_SWEEP_SECONDS', 300))})
     
-    # Получаем статистику внутри контекста
+    # Для локального запуска база готовится сразу; на сервере это делают init-db и seed
     with app.app_context():
+        init_db()
+        add_initial_data()
         stats = get_stats()
-        print(f"📊 Пользователей: {stats['users']}")
-        print(f"🛠️  Инструментов: {stats['tools']}")
-        print(f"📋 Заявок: {stats['requests']}")
     
+    print("\n" + "="*60)
+    print("🚀 СИСТЕМА УЧЁТА ИНСТРУМЕНТОВ")
+    print("="*60)
+    print(f"📍 URL: http://localhost:5001")
+    print(f"📊 Пользователей: {stats['users']}")
+    print(f"🛠️  Инструментов: {stats['tools']}")
+    print(f"📋 Заявок: {stats['requests']}")
     print("="*60)
     print("✅ Система готова к работе!")
     print("="*60)
@@ -0,0 +1,90 @@
+"""
+Замер параллельной выдачи инструментов на SQLite с разными профилями
+подключения (Config.SQLITE_PROFILES): 'default' - журнал отката,
+'production' - WAL, busy_timeout и т.д.
+
+    python bench_checkout.py [процессов] [выдач на процесс]
+
+Для каждого профиля создаётся временная база. Несколько процессов (как
+воркеры gunicorn) одновременно выдают и возвращают свои инструменты через
+/api/create-request и /api/return-tool и читают главную страницу.
+Считаются выдачи в секунду и ответы с ошибкой (например, "database is locked").
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SETUP = '''
+import os, sys
+from app import create_app
+from database import db, init_db, User, Tool
+app = create_app({'SQLITE_PROFILE': os.environ['BENCH_PROFILE'], 'OVERDUE_SWEEP_SECONDS': 0})
+with app.app_context():
+    init_db()
+    workers = int(sys.argv[1])
+    db.session.add_all(User(first_name=f'Сотрудник{i}', last_name='Замеров', employee_id=f'B{i}')
+                       for i in range(workers))
+    db.session.add_all(Tool(name=f'Инструмент {i}', qr_code_identifier=f'BENCH{i:03d}') for i in range(workers))
+    db.session.commit()
+'''
+
+WORKER = '''
+import os, sys
+from app import create_app
+app = create_app({'SQLITE_PROFILE': os.environ['BENCH_PROFILE'], 'OVERDUE_SWEEP_SECONDS': 0})
+client = app.test_client()
+worker, count = int(sys.argv[1]), int(sys.argv[2])
+client.get('/')  # прогрев: подключение и шаблоны
+print('ready', flush=True)
+sys.stdin.readline()
+errors = 0
+for _ in range(count):
+    response = client.post('/api/create-request', json={'user_id': worker + 1, 'tool_id': worker + 1})
+    if response.status_code != 200:
+        errors += 1
+        continue
+    response = client.post('/api/return-tool', json={'request_id': response.get_json()['request_id']})
+    errors += response.status_code != 200
+    errors += client.get('/').status_code != 200
+print(errors, flush=True)
+'''
+
+
+def run_profile(profile, workers, count):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, BENCH_PROFILE=profile,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'))
+        subprocess.run([sys.executable, '-c', SETUP, str(workers)], env=env, cwd=ROOT,
+                       check=True, capture_output=True)
+
+        processes = [subprocess.Popen([sys.executable, '-c', WORKER, str(worker), str(count)], env=env, cwd=ROOT,
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                     for worker in range(workers)]
+        for process in processes:
+            if process.stdout.readline().strip() != 'ready':
+                raise RuntimeError(f'Воркер профиля {profile} не запустился')
+
+        # Все воркеры запущены и прогреты - засекаем только выдачи
+        start = time.perf_counter()
+        for process in processes:
+            process.stdin.write('go\n')
+            process.stdin.flush()
+        errors = sum(int(process.communicate()[0].split()[-1]) for process in processes)
+        elapsed = time.perf_counter() - start
+
+    return workers * count / elapsed, errors
+
+
+def main(workers=6, count=150):
+    print(f"⏱️  {workers} процессов по {count} выдач (выдача + возврат + главная страница)")
+    for profile in ('default', 'production'):
+        rate, errors = run_profile(profile, workers, count)
+        print(f"   {profile}: {rate:.0f} выдач/с, ошибок: {errors}")
+
+
+if __name__ == '__main__':
+    main(*(int(value) for value in sys.argv[1:3]))
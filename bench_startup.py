@@ -0,0 +1,61 @@
+"""
+Замер старта приложения в новом процессе - так стартует каждый воркер
+сервера: импорт Flask и SQLAlchemy, импорт app, create_app() и первый запрос.
+
+    python bench_startup.py [повторов]
+
+База указывается как обычно (DATABASE_URL); её схема должна быть создана
+заранее (flask --app app init-db). Скрипт проверяет, что старт воркера
+не создаёт файл базы SQLite, то есть ничего не пишет.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+WORKER = '''
+import time
+marks = [time.perf_counter()]
+import flask, flask_sqlalchemy
+marks.append(time.perf_counter())
+from app import create_app
+marks.append(time.perf_counter())
+app = create_app()
+marks.append(time.perf_counter())
+app.test_client().get('/api/users/suggest?q=')
+marks.append(time.perf_counter())
+print(*[(end - start) * 1000 for start, end in zip(marks, marks[1:])])
+'''
+
+STAGES = ('Импорт Flask и SQLAlchemy', 'Импорт app', 'create_app()', 'Первый запрос')
+
+
+def run_worker(env):
+    result = subprocess.run([sys.executable, '-c', WORKER], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return [float(value) for value in result.stdout.split()[-len(STAGES):]]
+
+
+def main(repeat=7):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='')
+
+    # Старт без базы: файл SQLite не должен появиться
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'missing', 'tool_tracker.db')
+        boot_env = dict(env, DATABASE_URL=f'sqlite:///{path}')
+        subprocess.run([sys.executable, '-c', 'from app import create_app; create_app()'],
+                       env=boot_env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        print(f"{'✅' if not os.path.exists(path) else '❌'} Старт воркера не создаёт базу")
+
+    run_worker(env)  # прогрев кэша байткода и файловой системы
+    samples = [run_worker(env) for _ in range(repeat)]
+    print(f"⏱️  Медиана по {repeat} запускам, мс:")
+    for stage, values in zip(STAGES, zip(*samples)):
+        print(f"   {stage}: {statistics.median(values):.1f} (мин. {min(values):.1f}, макс. {max(values):.1f})")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
@@ -0,0 +1,237 @@
+"""
+Массовый импорт инструментов из CSV/XLSX.
+
+Файл читается построчно (потоком), каждая строка проверяется так же,
+как в форме добавления инструмента. Корректные строки вставляются
+пачками одним INSERT с набором параметров (executemany) и коммитятся
+по пачке; ошибки собираются по номерам строк и не прерывают импорт.
+"""
+import csv
+import io
+from datetime import datetime
+
+from database import db, Tool, InventoryCounter, generate_uuid
+
+# Заголовки колонок: поле модели и русские варианты названий
+COLUMN_ALIASES = {
+    'name': ('name', 'название', 'наименование'),
+    'description': ('description', 'описание'),
+    'category': ('category', 'категория'),
+    'location': ('location', 'место', 'расположение'),
+    'storage_place': ('storage_place', 'место хранения', 'полка'),
+    'serial_number': ('serial_number', 'серийный номер'),
+    'model': ('model', 'модель'),
+    'manufacturer': ('manufacturer', 'производитель'),
+    'price': ('price', 'цена'),
+    'purchase_date': ('purchase_date', 'дата приобретения', 'дата покупки'),
+    'warranty_until': ('warranty_until', 'гарантия до'),
+}
+
+HEADER_TO_FIELD = {
+    alias: field for field, aliases in COLUMN_ALIASES.items() for alias in aliases
+}
+
+
+def parse_price(value):
+    """Цена из строки формы/файла; пустое значение - None, ошибка - ValueError"""
+    if value is None or str(value).strip() == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().replace(',', '.').replace(' ', ''))
+    except ValueError:
+        raise ValueError('Некорректное значение цены')
+
+
+def parse_date(value, message):
+    """Дата в формате ГГГГ-ММ-ДД; пустое значение - None, ошибка - ValueError(message)"""
+    if value is None or str(value).strip() == '':
+        return None
+    # В XLSX даты приходят уже объектами datetime
+    if isinstance(value, datetime):
+        return value.date()
+    if hasattr(value, 'year'):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(message)
+
+
+def _clean(value):
+    """Строковое значение ячейки без пробелов по краям, пустое - None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def read_rows(file, filename, header_map=HEADER_TO_FIELD):
+    """
+    Генератор пар (номер строки в файле, {поле: значение}) из CSV или XLSX,
+    без чтения файла целиком. Пустые строки пропускаются.
+    header_map - соответствие заголовков колонок (в нижнем регистре) полям.
+    """
+    if filename.lower().endswith('.xlsx'):
+        yield from _read_xlsx(file, header_map)
+    else:
+        yield from _read_csv(file, header_map)
+
+
+def _map_header(header, header_map):
+    return [header_map.get((title or '').strip().lower()) for title in header]
+
+
+def _read_csv(file, header_map):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.readline()
+    # Excel в русской локали сохраняет CSV через точку с запятой
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    reader = csv.reader(_chain_line(sample, text), delimiter=delimiter)
+    
+    fields = _map_header(next(reader, []), header_map)
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        yield reader.line_num, {field: value for field, value in zip(fields, values) if field}
+
+
+def _chain_line(first_line, rest):
+    yield first_line
+    yield from rest
+
+
+def _read_xlsx(file, header_map):
+    try:
+        from openpyxl import load_workbook  # Нужно установить: pip install openpyxl
+    except ImportError:
+        raise ValueError('Для импорта XLSX установите openpyxl: pip install openpyxl')
+    
+    # read_only - строки читаются по мере обхода, а не весь лист в память
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    
+    fields = _map_header([str(title) if title is not None else '' for title in next(rows, [])], header_map)
+    for row_number, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield row_number, {field: value for field, value in zip(fields, values) if field}
+    workbook.close()
+
+
+def validate_row(data):
+    """Проверить строку и вернуть словарь для вставки в tools (или ValueError)"""
+    name = _clean(data.get('name'))
+    if not name:
+        raise ValueError('Название инструмента обязательно для заполнения')
+    
+    return {
+        'name': name,
+        'description': _clean(data.get('description')),
+        'category': _clean(data.get('category')),
+        'location': _clean(data.get('location')),
+        'storage_place': _clean(data.get('storage_place')),
+        'serial_number': _clean(data.get('serial_number')),
+        'model': _clean(data.get('model')),
+        'manufacturer': _clean(data.get('manufacturer')),
+        'price': parse_price(data.get('price')),
+        'purchase_date': parse_date(data.get('purchase_date'), 'Некорректный формат даты приобретения'),
+        'warranty_until': parse_date(data.get('warranty_until'), 'Некорректный формат даты гарантии'),
+        'is_available': True,
+    }
+
+
+def import_tools(rows, batch_size=1000):
+    """
+    Импорт инструментов из итератора (номер строки, данные) - см. read_rows.
+    Возвращает {'imported', 'errors': [{'row', 'message'}], 'tools': [{'row', 'name', 'qr_code'}]}.
+    """
+    result = {'imported': 0, 'errors': [], 'tools': []}
+    batch = []
+    
+    for row_number, data in rows:
+        try:
+            batch.append((row_number, validate_row(data)))
+        except ValueError as e:
+            result['errors'].append({'row': row_number, 'message': str(e)})
+            continue
+        
+        if len(batch) >= batch_size:
+            _insert_batch(batch, result)
+            batch = []
+    
+    if batch:
+        _insert_batch(batch, result)
+    
+    return result
+
+
+def _insert_batch(batch, result):
+    """Вставить пачку строк одной транзакцией"""
+    # Серийные номера должны быть уникальны: в пачке и в базе
+    serials = [values['serial_number'] for _, values in batch if values['serial_number']]
+    taken_serials = set()
+    if serials:
+        taken_serials = {serial for (serial,) in db.session.query(Tool.serial_number).filter(
+            Tool.serial_number.in_(serials)
+        )}
+    
+    rows = []
+    for row_number, values in batch:
+        serial = values['serial_number']
+        if serial and serial in taken_serials:
+            result['errors'].append({
+                'row': row_number,
+                'message': f'Инструмент с серийным номером {serial} уже существует'
+            })
+            continue
+        if serial:
+            taken_serials.add(serial)
+        rows.append((row_number, values))
+    
+    if not rows:
+        return
+    
+    # QR-коды выдаём заранее, чтобы вернуть их в отчёте; коллизии перегенерируем
+    codes = _allocate_qr_codes(len(rows))
+    for (row_number, values), code in zip(rows, codes):
+        values['qr_code_identifier'] = code
+    
+    try:
+        db.session.execute(db.insert(Tool), [values for _, values in rows])
+        # Массовая вставка идёт мимо flush, поэтому счётчики обновляем явно
+        InventoryCounter.apply(InventoryCounter.tool_deltas(
+            (values['category'], values['location'], True) for _, values in rows
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for row_number, _ in rows:
+            result['errors'].append({'row': row_number, 'message': f'Ошибка при сохранении: {e}'})
+        return
+    
+    result['imported'] += len(rows)
+    for row_number, values in rows:
+        result['tools'].append({
+            'row': row_number,
+            'name': values['name'],
+            'qr_code': values['qr_code_identifier'],
+        })
+
+
+def _allocate_qr_codes(count):
+    """Сгенерировать count уникальных QR-кодов, которых ещё нет в базе"""
+    codes = set()
+    while len(codes) < count:
+        candidates = set()
+        while len(candidates) < count - len(codes):
+            code = generate_uuid()
+            if code not in codes:
+                candidates.add(code)
+        
+        taken = {code for (code,) in db.session.query(Tool.qr_code_identifier).filter(
+            Tool.qr_code_identifier.in_(candidates)
+        )}
+        codes |= candidates - taken
+    return list(codes)
@@ -1,19 +1,57 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
 from datetime import datetime, timedelta
+import os
 import uuid
 
 # Создаём объект SQLAlchemy
 db = SQLAlchemy()
 
+class days_between(FunctionElement):
+    """SQL-выражение: сколько дней (дробное число) прошло от start до end"""
+    name = 'days_between'
+    inherit_cache = True
+    type = db.Float()
+
+@compiles(days_between)
+def _days_between_sqlite(element, compiler, **kw):
+    # SQLite хранит даты текстом - разницу считаем через julianday
+    start, end = element.clauses.clauses
+    return f'(julianday({compiler.process(end, **kw)}) - julianday({compiler.process(start, **kw)}))'
+
+@compiles(days_between, 'postgresql')
+def _days_between_postgresql(element, compiler, **kw):
+    start, end = element.clauses.clauses
+    return f'(EXTRACT(EPOCH FROM ({compiler.process(end, **kw)} - {compiler.process(start, **kw)})) / 86400.0)'
+
 def generate_uuid():
     """Генерация уникального ID для QR-кода"""
     return str(uuid.uuid4())[:8].upper()  # Короткий 8-символьный код
 
+def normalize_key(value):
+    """
+    Ключ для поиска без учёта регистра: casefold (работает и для кириллицы),
+    ё -> е и схлопывание лишних пробелов. 'Пётр ' и 'ПЕТР' дают одинаковый ключ.
+    """
+    if not value:
+        return None
+    return ' '.join(value.casefold().replace('ё', 'е').split()) or None
+
 class User(db.Model):
     """
     Модель пользователя (сотрудника)
     """
     __tablename__ = 'users'
+    __table_args__ = (
+        # Поиск сотрудника по имени и табельному номеру: /api/check-user, /api/verify-return
+        db.Index('ix_users_name_key', 'last_name_key', 'first_name_key'),
+        db.Index('ix_users_employee_id_key', 'employee_id_key', unique=True),
+        # Инкрементальное обновление справочника сотрудников (user_directory)
+        db.Index('ix_users_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
@@ -27,12 +65,61 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Нормализованные ключи для поиска (см. normalize_key), заполняются автоматически
+    first_name_key = db.Column(db.String(50), nullable=True)
+    last_name_key = db.Column(db.String(50), nullable=True)
+    employee_id_key = db.Column(db.String(20), nullable=True)
+    
     # Связь с заявками (один ко многим)
     requests = db.relationship('Request', backref='requester', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<User {self.first_name} {self.last_name}>'
     
+    @db.validates('first_name', 'last_name', 'employee_id')
+    def _update_lookup_key(self, field, value):
+        """При изменении имени или табельного номера обновляем ключ для поиска"""
+        setattr(self, f'{field}_key', normalize_key(value))
+        return value
+    
+    @classmethod
+    def find_by_identity(cls, first_name, last_name, employee_id=None):
+        """Поиск сотрудника по индексированным ключам без учёта регистра и ё/е"""
+        query = cls.query.filter_by(
+            last_name_key=normalize_key(last_name),
+            first_name_key=normalize_key(first_name)
+        )
+        if employee_id:
+            query = query.filter_by(employee_id_key=normalize_key(employee_id))
+        return query.first()
+    
+    @classmethod
+    def resolve_identity(cls, first_name, last_name, employee_id=None, user_id=None):
+        """
+        Сотрудник по данным из формы киоска или сканера: выбранный из подсказки
+        (user_id, если данные совпадают), найденный по ключам или однофамилец
+        без табельного номера в базе (чтобы не заводить дубликат). Иначе None.
+        """
+        user = db.session.get(cls, user_id) if isinstance(user_id, int) else None
+        if user and user.matches_identity(first_name, last_name, employee_id):
+            return user
+        
+        user = cls.find_by_identity(first_name, last_name, employee_id)
+        if not user and employee_id:
+            namesake = cls.find_by_identity(first_name, last_name)
+            if namesake and not namesake.employee_id:
+                user = namesake
+        return user
+    
+    def matches_identity(self, first_name, last_name, employee_id=None):
+        """Совпадают ли введённые данные с сотрудником (по тем же ключам)"""
+        if (self.first_name_key != normalize_key(first_name) or
+                self.last_name_key != normalize_key(last_name)):
+            return False
+        if employee_id and self.employee_id:
+            return self.employee_id_key == normalize_key(employee_id)
+        return True
+    
     def full_name(self):
         """Полное имя пользователя"""
         return f'{self.first_name} {self.last_name}'
@@ -42,6 +129,10 @@ class Tool(db.Model):
     Модель инструмента
     """
     __tablename__ = 'tools'
+    __table_args__ = (
+        # Дельта-синхронизация списка инструментов (/api/sync/tools)
+        db.Index('ix_tools_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -75,6 +166,39 @@ class Tool(db.Model):
     def __repr__(self):
         return f'<Tool {self.name} ({self.qr_code_identifier})>'
     
+    @classmethod
+    def try_issue(cls, tool_id):
+        """
+        Атомарно помечает инструмент выданным.
+        Условный UPDATE сработает только если инструмент ещё свободен,
+        поэтому из двух одновременных запросов выиграет ровно один.
+        """
+        return cls.try_issue_many([tool_id])
+    
+    @classmethod
+    def try_issue_many(cls, tool_ids):
+        """
+        Атомарно помечает выданными все инструменты списка одним условным UPDATE.
+        Если хоть один уже занят, возвращает False - остальные строки при этом
+        могли измениться, поэтому вызывающий должен откатить транзакцию.
+        """
+        tool_ids = set(tool_ids)
+        updated = cls.query.filter(cls.id.in_(tool_ids), cls.is_available == True).update(
+            {'is_available': False}
+        )
+        if updated != len(tool_ids):
+            return False
+        
+        # Массовый UPDATE не проходит через flush, поэтому счётчики правим сами;
+        # категории и места всех инструментов - одним запросом
+        deltas = InventoryCounter.version_deltas('tools')
+        rows = db.session.query(cls.category, cls.location).filter(cls.id.in_(tool_ids))
+        for category, location in rows:
+            for key in _tool_counter_keys(category, location, 'available_tools'):
+                deltas[key] = deltas.get(key, 0) - 1
+        InventoryCounter.apply(deltas)
+        return True
+    
     @property
     def qr_code_url(self):
         """Генерирует URL для QR-кода"""
@@ -86,6 +210,23 @@ class Request(db.Model):
     Модель заявки на взятие инструмента
     """
     __tablename__ = 'requests'
+    __table_args__ = (
+        # Поиск активной заявки инструмента: take_tool, verify_return, delete_tool, admin_tools
+        db.Index('ix_requests_tool_status', 'tool_id', 'status'),
+        # Дашборд: фильтр по статусу с сортировкой по времени
+        db.Index('ix_requests_status_request_time', 'status', 'request_time'),
+        db.Index('ix_requests_request_time', 'request_time'),
+        db.Index('ix_requests_user_id', 'user_id'),
+        # История возвратов: фильтр по дате возврата; длительность, итоги и топы
+        # считаются только по индексу, без чтения самих строк. id сразу после
+        # даты возврата - страница (дата возврата, id) читается в порядке индекса
+        db.Index('ix_requests_status_returned', 'status', 'actual_return_time', 'id',
+                 'approval_time', 'request_time', 'tool_id', 'user_id'),
+        # Поиск просроченных: сборщик просрочек и список на дашборде
+        db.Index('ix_requests_status_expected_return', 'status', 'expected_return_time'),
+        # Дельта-синхронизация заявок (/api/sync/requests)
+        db.Index('ix_requests_updated_at', 'updated_at'),
+    )
     
     # Статусы заявки
     STATUS_PENDING = 'pending'
@@ -94,6 +235,12 @@ class Request(db.Model):
     STATUS_RETURNED = 'returned'
     STATUS_OVERDUE = 'overdue'
     
+    # Инструмент на руках: просроченная заявка остаётся активной до возврата
+    ACTIVE_STATUSES = (STATUS_APPROVED, STATUS_OVERDUE)
+    
+    # Срок выдачи - один для киоска, офлайн-сканеров и комплектов
+    LOAN_PERIOD = timedelta(days=7)
+    
     id = db.Column(db.Integer, primary_key=True)
     
     # Внешние ключи
@@ -105,6 +252,7 @@ class Request(db.Model):
     approval_time = db.Column(db.DateTime, nullable=True)  # Когда одобрена
     expected_return_time = db.Column(db.DateTime, nullable=True)  # Когда должен вернуть
     actual_return_time = db.Column(db.DateTime, nullable=True)  # Когда фактически вернул
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Любое изменение заявки
     
     # Статус
     status = db.Column(db.String(20), default=STATUS_PENDING, nullable=False)
@@ -136,29 +284,499 @@ class Request(db.Model):
         """Отклонить заявку"""
         self.status = self.STATUS_REJECTED
     
+    @property
+    def is_active(self):
+        """Инструмент ещё не возвращён (выдан или просрочен)"""
+        return self.status in self.ACTIVE_STATUSES
+    
+    @classmethod
+    def mark_overdue(cls, now):
+        """
+        Пометить просроченными все выданные заявки с expected_return_time < now
+        одним UPDATE (по индексу ix_requests_status_expected_return).
+        Счётчики активных не меняются: просроченная заявка тоже активна.
+        Возвращает число помеченных заявок; коммит - на вызывающем.
+        """
+        result = db.session.execute(
+            db.update(cls)
+            .where(cls.status == cls.STATUS_APPROVED, cls.expected_return_time < now)
+            .values(status=cls.STATUS_OVERDUE)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            InventoryCounter.apply(InventoryCounter.version_deltas('requests'))
+        return result.rowcount
+    
     @property
     def user(self):
-        """Свойство для удобного доступа к пользователю"""
-        from database import User
-        return User.query.get(self.user_id)
+        """Свойство для удобного доступа к пользователю (через связь requester)"""
+        return self.requester
     
     @property
     def tool(self):
-        """Свойство для удобного доступа к инструменту"""
-        from database import Tool
-        return Tool.query.get(self.tool_id)
+        """Свойство для удобного доступа к инструменту (через связь requested_tool)"""
+        return self.requested_tool
+    
+    @classmethod
+    def usage_days(cls):
+        """SQL-выражение: дней пользования - от выдачи (или создания заявки) до возврата"""
+        return days_between(db.func.coalesce(cls.approval_time, cls.request_time), cls.actual_return_time)
+    
+    @classmethod
+    def load_options(cls, strategy=None):
+        """
+        Опции загрузки пользователя и инструмента вместе со списком заявок.
+        Стратегия берётся из Config.REQUEST_RELATIONS_LOADING:
+        'joined' - одним запросом через JOIN, 'selectin' - отдельным запросом IN (...).
+        """
+        if strategy is None:
+            from flask import current_app
+            strategy = current_app.config.get('REQUEST_RELATIONS_LOADING', 'joined')
+        
+        loader = db.selectinload if strategy == 'selectin' else db.joinedload
+        return (loader(cls.requester), loader(cls.requested_tool))
+
+# Состав комплектов: инструмент может входить в несколько комплектов
+kit_tools = db.Table(
+    'kit_tools',
+    db.Column('kit_id', db.Integer, db.ForeignKey('kits.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tool_id', db.Integer, db.ForeignKey('tools.id', ondelete='CASCADE'), primary_key=True),
+    # Удаление инструмента убирает его из комплектов
+    db.Index('ix_kit_tools_tool_id', 'tool_id'),
+)
+
+class Kit(db.Model):
+    """
+    Комплект - именованный набор инструментов, который выдаётся и
+    возвращается целиком одной операцией (см. kits.py)
+    """
+    __tablename__ = 'kits'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    
+    # QR-код комплекта ведёт на страницу /kit/<код>
+    qr_code_identifier = db.Column(db.String(20), unique=True, nullable=False, default=generate_uuid)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    tools = db.relationship('Tool', secondary=kit_tools, order_by='Tool.name', lazy=True,
+                            backref=db.backref('kits', lazy=True))
+    
+    def __repr__(self):
+        return f'<Kit {self.name} ({self.qr_code_identifier})>'
+    
+    @property
+    def qr_code_url(self):
+        """URL страницы комплекта для QR-кода"""
+        from config import Config
+        return f'{Config.SITE_URL}/kit/{self.qr_code_identifier}'
 
-def init_db(app):
-    """Инициализация базы данных в контексте приложения"""
+class ScanEvent(db.Model):
+    """
+    Событие офлайн-сканера (выдача или возврат), принятое через /api/scans/batch.
+    Хранит результат обработки, чтобы повторная отправка того же события
+    (тот же idempotency_key) не выдала инструмент дважды, а вернула прежний ответ.
+    """
+    __tablename__ = 'scan_events'
+    
+    STATUS_APPLIED = 'applied'
+    STATUS_CONFLICT = 'conflict'
+    STATUS_INVALID = 'invalid'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(64), unique=True, nullable=False)
+    device_id = db.Column(db.String(64), nullable=True)  # Какой сканер прислал событие
+    event_type = db.Column(db.String(20), nullable=True)  # checkout / return
+    tool_id = db.Column(db.Integer, nullable=True)
+    request_id = db.Column(db.Integer, nullable=True)  # Созданная или закрытая заявка
+    status = db.Column(db.String(20), nullable=False)
+    code = db.Column(db.String(30), nullable=True)  # Причина конфликта
+    message = db.Column(db.Text, nullable=True)
+    client_time = db.Column(db.DateTime, nullable=True)  # Время сканирования на устройстве
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<ScanEvent {self.idempotency_key}: {self.status}>'
+    
+    def result(self, duplicate=False):
+        """Результат события для ответа сканеру"""
+        return {
+            'key': self.idempotency_key,
+            'status': self.status,
+            'code': self.code,
+            'message': self.message,
+            'request_id': self.request_id,
+            'duplicate': duplicate,
+        }
+
+class InventoryCounter(db.Model):
+    """
+    Счётчики для статистики (инструменты, пользователи, заявки).
+    Обновляются в той же транзакции, что и изменения данных,
+    поэтому виджеты статистики читают готовые числа вместо COUNT(*).
+    """
+    __tablename__ = 'inventory_counters'
+    
+    # Область: global, category, location или department
+    scope = db.Column(db.String(20), primary_key=True)
+    # Значение области (название категории, места, отдела); для global - пустая строка
+    key = db.Column(db.String(100), primary_key=True)
+    # Имя счётчика: total_tools, available_tools, total_users, active_users, ...
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<InventoryCounter {self.scope}:{self.key}:{self.name}={self.value}>'
+    
+    @classmethod
+    def apply(cls, deltas, session=None):
+        """
+        Прибавить изменения {(scope, key, name): delta} к счётчикам.
+        Изменения копятся в session.info и записываются один раз перед
+        коммитом (см. _write_pending_counters).
+        """
+        session = session or db.session
+        pending = session.info.setdefault(PENDING_COUNTERS_KEY, {})
+        for key, delta in deltas.items():
+            pending[key] = pending.get(key, 0) + delta
+    
+    @classmethod
+    def write(cls, deltas, connection):
+        """
+        Записать изменения счётчиков сразу. Строки обновляются в порядке
+        ключей: в PostgreSQL каждая транзакция блокирует строки счётчиков в
+        одном и том же порядке, иначе выдачи и возвраты, идущие параллельно,
+        взаимно блокировались бы (deadlock).
+        """
+        table = cls.__table__
+        dialect = connection.dialect.name
+        
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        
+        for (scope, key, name), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            
+            if insert is not None:
+                # INSERT ... ON CONFLICT DO UPDATE: атомарно и без гонки между
+                # двумя транзакциями, создающими один и тот же счётчик
+                stmt = insert(table).values(scope=scope, key=key, name=name, value=delta,
+                                            updated_at=datetime.utcnow())
+                connection.execute(stmt.on_conflict_do_update(
+                    index_elements=[table.c.scope, table.c.key, table.c.name],
+                    set_={'value': table.c.value + stmt.excluded.value,
+                          'updated_at': stmt.excluded.updated_at}
+                ))
+                continue
+            
+            where = db.and_(table.c.scope == scope, table.c.key == key, table.c.name == name)
+            result = connection.execute(
+                table.update().where(where).values(value=table.c.value + delta)
+            )
+            if result.rowcount == 0:
+                connection.execute(
+                    table.insert().values(scope=scope, key=key, name=name, value=delta)
+                )
+    
+    @classmethod
+    def totals(cls, connection=None):
+        """Все глобальные счётчики одним запросом (через сессию или переданное соединение)"""
+        query = db.select(cls.name, cls.value).where(cls.scope == 'global', cls.key == '')
+        rows = (connection or db.session).execute(query).all()
+        values = dict(rows)
+        return {name: values.get(name, 0) for name in COUNTER_NAMES}
+    
+    @classmethod
+    def by_scope(cls, scope):
+        """Счётчики в разрезе категорий, мест или отделов: {key: {name: value}}"""
+        result = {}
+        for key, name, value in db.session.query(cls.key, cls.name, cls.value).filter_by(scope=scope):
+            result.setdefault(key, {})[name] = value
+        return result
+    
+    @classmethod
+    def versions(cls, table):
+        """
+        Версия таблицы для дельта-синхронизации: (изменений, удалений, время
+        последнего изменения). Одна строка счётчиков, большие таблицы не читаются.
+        """
+        rows = db.session.query(cls.name, cls.value, cls.updated_at).filter_by(scope='version', key=table)
+        values = {name: (value, updated_at) for name, value, updated_at in rows}
+        changes, changed_at = values.get('changes', (0, None))
+        deletes, deleted_at = values.get('deletes', (0, None))
+        return changes, deletes, max(filter(None, (changed_at, deleted_at)), default=None)
+    
+    @classmethod
+    def version_deltas(cls, table, deleted=False):
+        """Увеличение версии таблицы (для массовых изменений мимо flush)"""
+        deltas = {('version', table, 'changes'): 1}
+        if deleted:
+            deltas[('version', table, 'deletes')] = 1
+        return deltas
+    
+    @classmethod
+    def tool_deltas(cls, tools):
+        """Изменения счётчиков для массово добавленных инструментов [(category, location, is_available)]"""
+        deltas = cls.version_deltas('tools')
+        for category, location, is_available in tools:
+            names = ['total_tools'] + (['available_tools'] if is_available else [])
+            for name in names:
+                for key in _tool_counter_keys(category, location, name):
+                    deltas[key] = deltas.get(key, 0) + 1
+        return deltas
+    
+    @classmethod
+    def user_deltas(cls, changes):
+        """
+        Изменения счётчиков для массово изменённых пользователей.
+        changes - пары (было, стало), где каждое - (department, is_active) или None.
+        """
+        deltas = cls.version_deltas('users')
+        for old, new in changes:
+            for state, sign in ((old, -1), (new, 1)):
+                if state is None:
+                    continue
+                department, is_active = state
+                names = ['total_users'] + (['active_users'] if is_active else [])
+                for name in names:
+                    for key in _user_counter_keys(department, name):
+                        deltas[key] = deltas.get(key, 0) + sign
+        return deltas
+    
+    @classmethod
+    def reconcile(cls):
+        """Пересчитать все счётчики с нуля по данным таблиц (версии таблиц не трогаем)"""
+        cls.query.filter(cls.scope != 'version').delete()
+        
+        deltas = {}
+        
+        def add(keys, value):
+            for key in keys:
+                deltas[key] = deltas.get(key, 0) + value
+        
+        tool_rows = db.session.query(
+            Tool.category, Tool.location, Tool.is_available, db.func.count(Tool.id)
+        ).group_by(Tool.category, Tool.location, Tool.is_available)
+        for category, location, is_available, count in tool_rows:
+            add(_tool_counter_keys(category, location, 'total_tools'), count)
+            if is_available:
+                add(_tool_counter_keys(category, location, 'available_tools'), count)
+        
+        user_rows = db.session.query(
+            User.department, User.is_active, db.func.count(User.id)
+        ).group_by(User.department, User.is_active)
+        for department, is_active, count in user_rows:
+            add(_user_counter_keys(department, 'total_users'), count)
+            if is_active:
+                add(_user_counter_keys(department, 'active_users'), count)
+        
+        request_rows = db.session.query(
+            Request.status, db.func.count(Request.id)
+        ).group_by(Request.status)
+        for status, count in request_rows:
+            add([('global', '', 'total_requests')], count)
+            if status in Request.ACTIVE_STATUSES:
+                add([('global', '', 'active_requests')], count)
+        
+        cls.apply(deltas)
+        db.session.commit()
+
+# Ключ session.info: изменения счётчиков текущей транзакции, ещё не записанные
+PENDING_COUNTERS_KEY = 'pending_counter_deltas'
+
+# Глобальные счётчики
+COUNTER_NAMES = (
+    'total_tools', 'available_tools',
+    'total_users', 'active_users',
+    'total_requests', 'active_requests',
+)
+
+def _tool_counter_keys(category, location, name):
+    """Ключи счётчиков инструмента: глобальный, по категории и по месту"""
+    keys = [('global', '', name)]
+    if category:
+        keys.append(('category', category, name))
+    if location:
+        keys.append(('location', location, name))
+    return keys
+
+def _user_counter_keys(department, name):
+    """Ключи счётчиков пользователя: глобальный и по отделу"""
+    keys = [('global', '', name)]
+    if department:
+        keys.append(('department', department, name))
+    return keys
+
+def _attr_value(obj, attr, old, default=None):
+    """Значение атрибута до (old=True) или после изменения в текущем flush"""
+    value = getattr(obj, attr)
+    if old:
+        history = inspect(obj).attrs[attr].history
+        if history.deleted:
+            value = history.deleted[0]
+    return default if value is None else value
+
+def _counter_contributions(obj, old):
+    """Вклад объекта в счётчики: {(scope, key, name): 1}"""
+    keys = []
+    
+    if isinstance(obj, Tool):
+        category = _attr_value(obj, 'category', old)
+        location = _attr_value(obj, 'location', old)
+        keys += _tool_counter_keys(category, location, 'total_tools')
+        if _attr_value(obj, 'is_available', old, default=True):
+            keys += _tool_counter_keys(category, location, 'available_tools')
+    
+    elif isinstance(obj, User):
+        department = _attr_value(obj, 'department', old)
+        keys += _user_counter_keys(department, 'total_users')
+        if _attr_value(obj, 'is_active', old, default=True):
+            keys += _user_counter_keys(department, 'active_users')
+    
+    elif isinstance(obj, Request):
+        keys.append(('global', '', 'total_requests'))
+        if _attr_value(obj, 'status', old, default=Request.STATUS_PENDING) in Request.ACTIVE_STATUSES:
+            keys.append(('global', '', 'active_requests'))
+    
+    return {key: 1 for key in keys}
+
+@event.listens_for(Session, 'after_flush')
+def _update_counters(session, flush_context):
+    """Пересчитываем счётчики по изменённым объектам в той же транзакции"""
+    deltas = {}
+    
+    def add(contributions, sign):
+        for key, value in contributions.items():
+            deltas[key] = deltas.get(key, 0) + sign * value
+    
+    for obj in session.new:
+        add(_counter_contributions(obj, old=False), 1)
+    
+    for obj in session.deleted:
+        add(_counter_contributions(obj, old=True), -1)
+    
+    for obj in session.dirty:
+        if obj in session.deleted or not session.is_modified(obj):
+            continue
+        add(_counter_contributions(obj, old=True), -1)
+        add(_counter_contributions(obj, old=False), 1)
+    
+    # Версии изменённых таблиц: +1 за flush, а не за каждую строку
+    versions = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, (Tool, User, Request)):
+            continue
+        deleted = obj in session.deleted
+        if obj in session.dirty and not deleted and not session.is_modified(obj):
+            continue
+        versions[obj.__tablename__] = versions.get(obj.__tablename__, False) or deleted
+    for table, deleted in versions.items():
+        deltas.update(InventoryCounter.version_deltas(table, deleted))
+    
+    if any(deltas.values()):
+        InventoryCounter.apply(deltas, session)
+
+@event.listens_for(Session, 'before_commit')
+def _write_pending_counters(session):
+    """
+    Записываем счётчики транзакции одним проходом в конце: выдача копит
+    изменения и в Tool.try_issue_many, и во flush, и если бы каждый вызов
+    писал сам, две транзакции могли бы взять одни и те же строки в разном
+    порядке. Заодно блокировки счётчиков держатся только до коммита.
+    """
+    session.flush()
+    deltas = session.info.pop(PENDING_COUNTERS_KEY, None)
+    if deltas and any(deltas.values()):
+        InventoryCounter.write(deltas, session.connection())
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_pending_counters(session, transaction):
+    """Откат или close() без коммита: несохранённые изменения счётчиков выбрасываем"""
+    if transaction.parent is None:
+        session.info.pop(PENDING_COUNTERS_KEY, None)
+
+def configure_sqlite(app):
+    """Применять PRAGMA из выбранного профиля SQLite к каждому новому соединению"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    
+    profile = app.config.get('SQLITE_PROFILE', 'default')
+    pragmas = app.config.get('SQLITE_PROFILES', {}).get(profile)
+    if pragmas is None:
+        raise ValueError(f'Неизвестный профиль SQLite: {profile}')
+    
+    if not pragmas:
+        return
+    
+    @event.listens_for(db.engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+def engine_options(config):
+    """
+    Параметры движка SQLAlchemy для выбранной базы.
+    Для PostgreSQL - пул соединений и таймаут запросов из Config,
+    для SQLite - настройки по умолчанию (PRAGMA задаются в configure_sqlite).
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if not uri.startswith('postgresql'):
+        return {}
+    
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'connect_args': {
+            'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}",
+        },
+    }
+
+def init_app(app):
+    """
+    Подключить базу к приложению. Соединений не открывает и ничего не пишет -
+    таблицы создаёт init_db (команда flask --app app init-db).
+    """
+    # Параметры пула соединений, если они не заданы явно
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in app.config:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    
     db.init_app(app)
     
     with app.app_context():
-        # Создаём все таблицы
-        db.create_all()
-        print("✅ База данных создана!")
-        
-        # Добавляем тестовые данные (только если база пустая)
-        add_initial_data()
+        # Настройки соединений SQLite (до первого запроса к базе)
+        configure_sqlite(app)
+
+def init_db():
+    """Создать таблицы и применить миграции (в контексте приложения)"""
+    # Файлу SQLite нужна существующая папка
+    if db.engine.dialect.name == 'sqlite' and db.engine.url.database not in (None, '', ':memory:'):
+        os.makedirs(os.path.dirname(os.path.abspath(db.engine.url.database)), exist_ok=True)
+    
+    # Создаём все таблицы
+    db.create_all()
+    print("✅ База данных создана!")
+    
+    # Применяем миграции к уже существующей базе
+    from migrations import run_migrations
+    run_migrations()
+    
+    # Для существующей базы без счётчиков считаем их один раз
+    if InventoryCounter.query.first() is None:
+        InventoryCounter.reconcile()
 
 def add_initial_data():
     """Добавление начальных данных в базу"""
@@ -327,7 +945,7 @@ def add_initial_data():
                     approval_time=datetime.utcnow() - timedelta(days=2),
                     expected_return_time=datetime.utcnow() + timedelta(days=5)
                 )
-                request1.tool.is_available = False
+                tool1.is_available = False
                 db.session.add(request1)
             
             if user2 and tool2:
@@ -364,7 +982,7 @@ def add_initial_data():
                     approval_time=moscow_now() - timedelta(days=2),
                     expected_return_time=moscow_now() + timedelta(days=5)
                 )
-                request1.tool.is_available = False
+                tool1.is_available = False
                 db.session.add(request1)
             
             if user2 and tool2:
@@ -0,0 +1,134 @@
+"""
+Дельта-синхронизация списков (инструменты, пользователи, заявки) в JSON.
+
+/api/sync/<таблица>?since=<курсор> отдаёт только строки, изменённые после
+курсора (по updated_at), страницами. Версия таблицы - счётчики изменений и
+удалений в inventory_counters, которые увеличиваются в той же транзакции,
+что и сами изменения. Из версии строятся ETag и Last-Modified: если она не
+изменилась, ответ 304 даётся после чтения одной строки счётчиков, без
+обращения к самой таблице.
+
+Удалённые строки по updated_at не найти, поэтому при изменении числа
+удалений клиент получает reset: true и весь список заново.
+"""
+from datetime import datetime, timedelta
+
+from database import db, Tool, User, Request
+
+# Строки чуть старше курсора перечитываются: транзакция, начатая раньше,
+# могла закоммитить их уже после прошлой синхронизации
+CURSOR_OVERLAP = timedelta(seconds=2)
+
+# Курсор пустой таблицы
+EPOCH = datetime(1970, 1, 1)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def tool_row(tool):
+    return {
+        'id': tool.id,
+        'name': tool.name,
+        'category': tool.category,
+        'location': tool.location,
+        'storage_place': tool.storage_place,
+        'manufacturer': tool.manufacturer,
+        'model': tool.model,
+        'serial_number': tool.serial_number,
+        'is_available': tool.is_available,
+        'qr_code': tool.qr_code_identifier,
+        'updated_at': _iso(tool.updated_at),
+    }
+
+
+def user_row(user):
+    return {
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'employee_id': user.employee_id,
+        'department': user.department,
+        'position': user.position,
+        'is_active': user.is_active,
+        'updated_at': _iso(user.updated_at),
+    }
+
+
+def request_row(req):
+    return {
+        'id': req.id,
+        'user_id': req.user_id,
+        'tool_id': req.tool_id,
+        'status': req.status,
+        'request_time': _iso(req.request_time),
+        'approval_time': _iso(req.approval_time),
+        'expected_return_time': _iso(req.expected_return_time),
+        'actual_return_time': _iso(req.actual_return_time),
+        'purpose': req.purpose,
+        'updated_at': _iso(req.updated_at),
+    }
+
+
+# Таблицы синхронизации: имя в URL (оно же ключ версии) -> (модель, строка JSON)
+SYNC_TABLES = {
+    'tools': (Tool, tool_row),
+    'users': (User, user_row),
+    'requests': (Request, request_row),
+}
+
+
+def encode_cursor(updated_at, row_id, deletes, changes=None):
+    """
+    Курсор: время изменения и id последней отданной строки, число удалений
+    и - только у последней страницы - версия таблицы, до которой клиент синхронизирован.
+    """
+    return f'{updated_at.isoformat()}_{row_id}_{deletes}_{"" if changes is None else changes}'
+
+
+def decode_cursor(cursor):
+    """Разбираем курсор; некорректный - None"""
+    try:
+        updated_at, row_id, deletes, changes = cursor.split('_')
+        return datetime.fromisoformat(updated_at), int(row_id), int(deletes), (int(changes) if changes else None)
+    except (AttributeError, ValueError):
+        return None
+
+
+def table_etag(table, changes, deletes):
+    return f'{table}-{changes}-{deletes}'
+
+
+def changed_rows(table, cursor, per_page, changes, deletes):
+    """
+    Строки после курсора, старые изменения первыми.
+    Возвращает (строки JSON, есть ли ещё страница, курсор следующего запроса).
+    """
+    model, serialize = SYNC_TABLES[table]
+    query = model.query.order_by(model.updated_at, model.id)
+
+    if cursor:
+        updated_at, row_id, _, synced_changes = cursor
+        if synced_changes is None:
+            # Следующая страница той же синхронизации - строго после последней строки
+            query = query.filter(db.or_(
+                model.updated_at > updated_at,
+                db.and_(model.updated_at == updated_at, model.id > row_id)
+            ))
+        else:
+            query = query.filter(model.updated_at >= updated_at - CURSOR_OVERLAP)
+
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if items:
+        last = items[-1]
+        next_cursor = encode_cursor(last.updated_at, last.id, deletes, None if has_more else changes)
+    elif cursor:
+        next_cursor = encode_cursor(cursor[0], cursor[1], deletes, changes)
+    else:
+        next_cursor = encode_cursor(EPOCH, 0, deletes, changes)
+
+    return [serialize(item) for item in items], has_more, next_cursor
@@ -0,0 +1,166 @@
+"""
+Выгрузка истории заявок в CSV/XLSX.
+
+Выгрузка строится на сервере одним запросом (заявки + пользователи +
+инструменты) и читается пачками (yield_per), а ответ отдаётся генератором.
+Поэтому расход памяти не зависит от числа строк - историю в миллион заявок
+можно выгрузить целиком, а не только строки, видимые на странице.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from bulk_import import parse_date
+from database import db, User, Tool, Request
+
+# Сколько строк читать из базы за раз
+EXPORT_BATCH_SIZE = 1000
+
+# Колонки выгрузки: (заголовок, колонка запроса)
+EXPORT_COLUMNS = (
+    ('ID', Request.id),
+    ('Фамилия', User.last_name),
+    ('Имя', User.first_name),
+    ('Табельный номер', User.employee_id),
+    ('Отдел', User.department),
+    ('Инструмент', Tool.name),
+    ('Категория', Tool.category),
+    ('Местоположение', Tool.location),
+    ('QR-код', Tool.qr_code_identifier),
+    ('Статус', Request.status),
+    ('Время заявки', Request.request_time),
+    ('Время выдачи', Request.approval_time),
+    ('Ожидаемый возврат', Request.expected_return_time),
+    ('Фактический возврат', Request.actual_return_time),
+    ('Цель', Request.purpose),
+    ('Состояние до', Request.condition_before),
+    ('Состояние после', Request.condition_after),
+    ('Заметки', Request.admin_notes),
+)
+
+STATUS_LABELS = {
+    Request.STATUS_PENDING: 'Ожидает',
+    Request.STATUS_APPROVED: 'Выдан',
+    Request.STATUS_REJECTED: 'Отклонён',
+    Request.STATUS_RETURNED: 'Возвращён',
+    Request.STATUS_OVERDUE: 'Просрочен',
+}
+
+EXPORT_FILTERS = ('date_from', 'date_to', 'date_by', 'status', 'department', 'category', 'q')
+
+
+def export_filters(args):
+    """Фильтры выгрузки из параметров запроса; даты проверяются сразу (ValueError)"""
+    filters = {name: (args.get(name) or '').strip() for name in EXPORT_FILTERS}
+    parse_date(filters['date_from'], 'Некорректная дата начала (ожидается ГГГГ-ММ-ДД)')
+    parse_date(filters['date_to'], 'Некорректная дата окончания (ожидается ГГГГ-ММ-ДД)')
+    return filters
+
+
+def build_export_query(filters):
+    """SELECT истории заявок с пользователем и инструментом, новые сначала"""
+    query = (
+        db.select(*(column for _, column in EXPORT_COLUMNS))
+        .select_from(Request)
+        .outerjoin(User, User.id == Request.user_id)
+        .outerjoin(Tool, Tool.id == Request.tool_id)
+    )
+
+    # Период - по дате заявки или, с date_by=return, по дате возврата
+    date_column = Request.actual_return_time if filters.get('date_by') == 'return' else Request.request_time
+    date_from = parse_date(filters.get('date_from'), 'Некорректная дата начала')
+    date_to = parse_date(filters.get('date_to'), 'Некорректная дата окончания')
+    if date_from:
+        query = query.where(date_column >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        # Дата окончания включительно
+        query = query.where(date_column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if filters.get('status'):
+        query = query.where(Request.status == filters['status'])
+    if filters.get('department'):
+        query = query.where(User.department == filters['department'])
+    if filters.get('category'):
+        query = query.where(Tool.category == filters['category'])
+    if filters.get('q'):
+        pattern = f"%{filters['q']}%"
+        query = query.where(db.or_(User.first_name.ilike(pattern), User.last_name.ilike(pattern)))
+
+    return query.order_by(Request.request_time.desc(), Request.id.desc())
+
+
+def iter_export_rows(filters, format_time):
+    """Строки выгрузки (списки значений), прочитанные из базы пачками"""
+    # yield_per: строки забираются из курсора по EXPORT_BATCH_SIZE,
+    # а на PostgreSQL включается серверный курсор (stream_results)
+    result = db.session.execute(
+        build_export_query(filters).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    status_index = [title for title, _ in EXPORT_COLUMNS].index('Статус')
+
+    for row in result:
+        values = []
+        for index, value in enumerate(row):
+            if index == status_index:
+                value = STATUS_LABELS.get(value, value)
+            elif isinstance(value, datetime):
+                value = format_time(value)
+            values.append('' if value is None else value)
+        yield values
+
+
+def iter_csv(rows, chunk_rows=EXPORT_BATCH_SIZE):
+    """CSV для Excel (UTF-8 с BOM, разделитель ';'), отдаваемый кусками по chunk_rows строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    buffer.write('\ufeff')  # BOM, чтобы Excel распознал UTF-8
+    writer.writerow([title for title, _ in EXPORT_COLUMNS])
+
+    count = 0
+    for values in rows:
+        writer.writerow(values)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_xlsx(rows, chunk_size=64 * 1024):
+    """
+    XLSX через write_only-режим openpyxl: строки сразу пишутся во временный
+    файл, а не держатся в памяти. Архив XLSX собирается только целиком,
+    поэтому клиенту он отдаётся после записи последней строки.
+    """
+    # Проверяем openpyxl до начала ответа, а не посреди потока
+    try:
+        from openpyxl import Workbook  # Нужно установить: pip install openpyxl
+    except ImportError:
+        raise ValueError('Для выгрузки XLSX установите openpyxl: pip install openpyxl')
+
+    return _iter_xlsx(Workbook, rows, chunk_size)
+
+
+def _iter_xlsx(Workbook, rows, chunk_size):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Заявки')
+    sheet.append([title for title, _ in EXPORT_COLUMNS])
+    for values in rows:
+        sheet.append(values)
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
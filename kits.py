@@ -0,0 +1,157 @@
+"""
+Комплекты: выдача и возврат нескольких инструментов одной операцией.
+
+Бригада, берущая комплект из 15 инструментов, сканирует один QR-код
+комплекта вместо 15 и получает одну транзакцию вместо 15 коммитов.
+
+Выдача - всё или ничего: инструменты комплекта помечаются выданными одним
+условным UPDATE (Tool.try_issue_many), который сам и есть проверка
+доступности. Если хоть один инструмент занят, транзакция откатывается и
+вызывающий получает KitConflict со списком занятых инструментов и тех, у
+кого они на руках. Возврат закрывает все выданные инструменты комплекта
+сразу; если часть из них числится за другим сотрудником, не возвращается
+ничего.
+"""
+from database import db, User, Tool, Request, kit_tools
+
+
+class KitConflict(Exception):
+    """Операцию с комплектом нельзя выполнить; tools - инструменты, которые мешают"""
+
+    def __init__(self, message, tools=()):
+        super().__init__(message)
+        self.message = message
+        self.tools = list(tools)
+
+
+def unavailable_tools(tool_ids):
+    """
+    Занятые инструменты из списка и у кого они на руках - одним запросом:
+    [{'id', 'name', 'qr_code', 'holder', 'expected_return_time'}]
+    """
+    rows = db.session.query(
+        Tool.id, Tool.name, Tool.qr_code_identifier,
+        User.first_name, User.last_name, Request.expected_return_time
+    ).select_from(Tool).outerjoin(Request, db.and_(
+        Request.tool_id == Tool.id, Request.status.in_(Request.ACTIVE_STATUSES)
+    )).outerjoin(User, User.id == Request.user_id).filter(
+        Tool.id.in_(tool_ids), Tool.is_available == False
+    ).order_by(Tool.name)
+
+    return [{
+        'id': tool_id,
+        'name': name,
+        'qr_code': qr_code,
+        'holder': f'{first_name} {last_name}' if first_name else None,
+        'expected_return_time': expected_return_time,
+    } for tool_id, name, qr_code, first_name, last_name, expected_return_time in rows]
+
+
+def checkout_kit(kit, user, purpose, now):
+    """
+    Выдать сотруднику все инструменты комплекта в одной транзакции.
+    Возвращает выданное (issued_items); если часть инструментов занята - KitConflict.
+    """
+    tools = list(kit.tools)
+    if not tools:
+        raise KitConflict(f'В комплекте "{kit.name}" нет инструментов')
+    tool_ids = [tool.id for tool in tools]
+    kit_name = kit.name
+
+    try:
+        if not Tool.try_issue_many(tool_ids):
+            # UPDATE мог успеть пометить часть инструментов - откатываем и его
+            db.session.rollback()
+            raise KitConflict(
+                f'Комплект "{kit_name}" нельзя выдать целиком: часть инструментов уже выдана',
+                unavailable_tools(tool_ids)
+            )
+
+        requests = [Request(
+            requester=user,
+            requested_tool=tool,
+            purpose=purpose,
+            status=Request.STATUS_APPROVED,
+            approval_time=now,
+            expected_return_time=now + Request.LOAN_PERIOD,
+        ) for tool in tools]
+        db.session.add_all(requests)
+        db.session.flush()
+        items = issued_items(requests)
+        db.session.commit()
+        return items
+    except KitConflict:
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def issued_items(requests):
+    """
+    Заявки для ответа: [{'request_id', 'tool_id', 'name'}]. Собирается до
+    коммита - после него объекты устаревают и перечитывались бы по одному.
+    """
+    return [{'request_id': req.id, 'tool_id': req.tool_id, 'name': req.requested_tool.name}
+            for req in requests]
+
+
+def return_kit(kit, first_name, last_name, employee_id, now, condition_after='', notes=''):
+    """
+    Вернуть все выданные инструменты комплекта в одной транзакции.
+    Инструменты, которые уже на месте, пропускаются. Если хоть один выданный
+    числится за другим сотрудником - KitConflict и ничего не возвращается.
+    Возвращает возвращённое (issued_items).
+    """
+    tool_ids = [tool.id for tool in kit.tools]
+    active = Request.query.options(*Request.load_options()).filter(
+        Request.tool_id.in_(tool_ids),
+        Request.status.in_(Request.ACTIVE_STATUSES)
+    ).with_for_update(of=Request).all() if tool_ids else []
+
+    if not active:
+        raise KitConflict(f'Инструменты комплекта "{kit.name}" не числятся выданными')
+
+    foreign = [req for req in active
+               if not req.requester or not req.requester.matches_identity(first_name, last_name, employee_id)]
+    if foreign:
+        tools = [{
+            'id': req.tool_id,
+            'name': req.requested_tool.name,
+            'qr_code': req.requested_tool.qr_code_identifier,
+            'holder': req.requester.full_name() if req.requester else None,
+            'expected_return_time': req.expected_return_time,
+        } for req in foreign]
+        # Снимаем блокировки заявок
+        db.session.rollback()
+        raise KitConflict(
+            'Часть инструментов комплекта выдана другому сотруднику - вернуть комплект целиком нельзя',
+            tools
+        )
+
+    try:
+        for req in active:
+            req.return_tool()
+            req.actual_return_time = now
+            if condition_after:
+                req.condition_after = condition_after
+            if notes:
+                req.admin_notes = notes
+        items = issued_items(active)
+        db.session.commit()
+        return items
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def kit_availability(kit_ids):
+    """Сколько инструментов в каждом комплекте и сколько из них свободно: {kit_id: (всего, свободно)}"""
+    rows = db.session.query(
+        kit_tools.c.kit_id,
+        db.func.count(Tool.id),
+        db.func.sum(db.case((Tool.is_available == True, 1), else_=0))
+    ).join(Tool, Tool.id == kit_tools.c.tool_id).filter(
+        kit_tools.c.kit_id.in_(kit_ids)
+    ).group_by(kit_tools.c.kit_id)
+    return {kit_id: (total, available or 0) for kit_id, total, available in rows}
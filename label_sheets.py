@@ -0,0 +1,330 @@
+"""
+Печать наклеек с QR-кодами в PDF.
+
+Каждая наклейка - QR-код со ссылкой на инструмент, название и место хранения.
+Раскладка листа (размер страницы, сетка наклеек, поля) задаётся в
+Config.LABEL_LAYOUTS. Листы рисуются пачками страниц в общем пуле процессов
+(кодирование QR и отрисовка - чистый Python и упираются в процессор),
+а готовые части склеиваются в один PDF.
+
+Состояние заданий на печать хранится файлами в LABEL_OUTPUT_DIR
+(<job_id>.json и <job_id>.pdf), а не в памяти: за опросом прогресса и за
+PDF браузер может прийти в другой воркер gunicorn.
+"""
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+# Сколько страниц рисует один процесс за раз
+PAGES_PER_CHUNK = 10
+
+# Шрифты с кириллицей, если Config.LABEL_FONT_PATH не задан
+FONT_CANDIDATES = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:/Windows/Fonts/arial.ttf',
+)
+
+FONT_NAME = 'LabelFont'
+
+# Белая рамка вокруг QR-кода в модулях (сканеру нужен отступ от текста и края)
+QR_QUIET_ZONE = 2
+
+# Маска QR-кода. Без неё qrcode строит код со всеми восемью масками и
+# выбирает лучшую по штрафам - это большая часть времени кодирования;
+# сканеры читают код с любой маской
+QR_MASK_PATTERN = 0
+
+# Пул процессов отрисовки, один на процесс приложения и общий для всех заданий
+_pool = None
+_pool_lock = threading.Lock()
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def find_font(font_path=None):
+    """Путь к TTF-шрифту с кириллицей (стандартные шрифты PDF её не содержат)"""
+    for path in ((font_path,) if font_path else FONT_CANDIDATES):
+        if path and os.path.exists(path):
+            return path
+    raise ValueError('Не найден шрифт с кириллицей, укажите путь в Config.LABEL_FONT_PATH')
+
+
+def tool_label(tool):
+    """Данные одной наклейки (простой dict - передаётся в другой процесс)"""
+    return {
+        'name': tool.name,
+        'storage_place': tool.storage_place or '',
+        'location': tool.location or '',
+        'qr_code': tool.qr_code_identifier,
+        'url': tool.qr_code_url,
+    }
+
+
+def render_labels_pdf(labels, layout, font_path, workers=None, progress=None):
+    """
+    Нарисовать наклейки в PDF и вернуть его содержимое (bytes).
+    progress(готово, всего) вызывается по мере готовности пачек.
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter  # Нужно установить: pip install reportlab pypdf qrcode
+        import reportlab  # noqa: F401
+        import qrcode  # noqa: F401
+    except ImportError:
+        raise ValueError('Для печати наклеек установите: pip install reportlab pypdf qrcode')
+
+    per_page = layout['columns'] * layout['rows']
+    chunk_size = per_page * PAGES_PER_CHUNK
+    chunks = [labels[start:start + chunk_size] for start in range(0, len(labels), chunk_size)]
+    total = len(labels)
+    done = 0
+    parts = [None] * len(chunks)
+
+    if progress:
+        progress(0, total)
+
+    if len(chunks) <= 1 or workers == 1:
+        # Маленькое задание быстрее нарисовать здесь, чем запускать процессы
+        for index, chunk in enumerate(chunks):
+            parts[index] = render_chunk(chunk, layout, font_path)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+    else:
+        pool = _get_pool(workers)
+        try:
+            futures = {
+                pool.submit(render_chunk, chunk, layout, font_path): index
+                for index, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                parts[index] = future.result()
+                done += len(chunks[index])
+                if progress:
+                    progress(done, total)
+        except BrokenProcessPool:
+            # Процесс пула упал - следующее задание создаст новый пул
+            _discard_pool(pool)
+            raise
+
+    # Склеиваем части в исходном порядке
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(PdfReader(io.BytesIO(part)))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def _get_pool(workers):
+    """Общий пул процессов; размер задаётся при первом обращении (None - по числу ядер)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_chunk(labels, layout, font_path):
+    """Нарисовать несколько страниц наклеек; выполняется в процессе пула"""
+    from reportlab import rl_config
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfgen import canvas
+
+    # Потоки страниц только сжимаем, без ASCII85: кодирование в нём идёт на
+    # чистом Python и заметно медленнее, а PDF получается больше
+    rl_config.useA85 = 0
+    _register_font(font_path)
+
+    page_width, page_height = layout['page']
+    label_width, label_height = layout['label']
+    margin_left, margin_top = layout['margin']
+    gap_x, gap_y = layout.get('gap', (0, 0))
+    padding = layout.get('padding', 2)
+    per_page = layout['columns'] * layout['rows']
+
+    qr_side = (label_height - 2 * padding) * mm
+    text_x_offset = padding * mm + qr_side
+    text_width = label_width * mm - text_x_offset - padding * mm
+    font_size = layout.get('font_size', 8)
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(page_width * mm, page_height * mm), pageCompression=1)
+
+    for index, label in enumerate(labels):
+        if index and index % per_page == 0:
+            pdf.showPage()
+
+        position = index % per_page
+        column = position % layout['columns']
+        row = position // layout['columns']
+        x = (margin_left + column * (label_width + gap_x)) * mm
+        # В PDF ось Y направлена вверх, наклейки считаем сверху
+        y = (page_height - margin_top - (row + 1) * label_height - row * gap_y) * mm
+
+        _draw_qr(pdf, label['url'], x + padding * mm, y + padding * mm, qr_side)
+
+        text_x = x + text_x_offset
+        text_y = y + label_height * mm - padding * mm - font_size
+        lines = simpleSplit(label['name'], FONT_NAME, font_size + 1, text_width)[:3]
+        details = [label['storage_place'], label['location'], label['qr_code']]
+        pdf.setFont(FONT_NAME, font_size + 1)
+        for line in lines:
+            pdf.drawString(text_x, text_y, _fit_line(line, font_size + 1, text_width))
+            text_y -= font_size + 2
+        pdf.setFont(FONT_NAME, font_size - 1)
+        for detail in details:
+            if detail and text_y > y + padding * mm:
+                pdf.drawString(text_x, text_y, _fit_line(detail, font_size - 1, text_width))
+                text_y -= font_size
+
+    pdf.save()
+    return buffer.getvalue()
+
+
+def _register_font(font_path):
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT_NAME, font_path))
+
+
+def _fit_line(text, font_size, width):
+    """Обрезать строку с многоточием, если она не помещается (длинные слова не переносятся)"""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    if stringWidth(text, FONT_NAME, font_size) <= width:
+        return text
+    while text and stringWidth(text + '…', FONT_NAME, font_size) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _draw_qr(pdf, data, x, y, side):
+    """
+    QR-код векторными прямоугольниками (соседние тёмные модули строки - одним).
+    Путь пишется готовыми операторами PDF в координатах модулей (целые числа):
+    через beginPath() reportlab форматировал бы сотни дробных координат на
+    каждый код, и это занимало больше времени, чем само кодирование.
+    """
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=QR_QUIET_ZONE,
+                       mask_pattern=QR_MASK_PATTERN)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    cell = side / len(matrix)
+
+    # Масштаб и сдвиг: один модуль - единица координат, (0, 0) - левый нижний угол кода
+    ops = [f'q {cell:.4f} 0 0 {cell:.4f} {x:.2f} {y:.2f} cm']
+    for row_index, row in enumerate(matrix):
+        row_y = len(matrix) - row_index - 1
+        start = None
+        for column, dark in enumerate(row + [False]):
+            if dark and start is None:
+                start = column
+            elif not dark and start is not None:
+                ops.append(f'{start} {row_y} {column - start} 1 re')
+                start = None
+    ops.append('f Q')
+    pdf.addLiteral('\n'.join(ops))
+
+
+# ====== ЗАДАНИЯ НА ПЕЧАТЬ ======
+def start_label_job(labels, layout, font_path, output_dir, workers=None, keep_seconds=None):
+    """
+    Запустить печать в фоновом потоке; возвращает job_id для опроса прогресса.
+    Заодно удаляет задания и PDF старше keep_seconds.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if keep_seconds:
+        prune_label_jobs(output_dir, keep_seconds)
+
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'status': 'running',
+        'done': 0,
+        'total': len(labels),
+        'error': None,
+        'created_at': datetime.utcnow().isoformat(),
+    }
+    _save_job(output_dir, job)
+
+    def progress(done, total):
+        job['done'] = done
+        _save_job(output_dir, job)
+
+    def run():
+        try:
+            content = render_labels_pdf(labels, layout, font_path, workers=workers, progress=progress)
+            path = label_job_pdf_path(output_dir, job_id)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(content)
+            os.replace(path + '.tmp', path)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        _save_job(output_dir, job)
+
+    threading.Thread(target=run, name=f'labels-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+
+def get_label_job(output_dir, job_id):
+    """Состояние задания из файла или None (задания нет, удалено или job_id некорректен)"""
+    if not _JOB_ID.match(job_id):
+        return None
+    try:
+        with open(os.path.join(output_dir, f'{job_id}.json'), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def label_job_pdf_path(output_dir, job_id):
+    return os.path.join(output_dir, f'{job_id}.pdf')
+
+
+def prune_label_jobs(output_dir, keep_seconds):
+    """Удалить файлы заданий и PDF, не менявшиеся дольше keep_seconds"""
+    deadline = time.time() - keep_seconds
+    for entry in os.scandir(output_dir):
+        job_id = entry.name.split('.', 1)[0]
+        if not _JOB_ID.match(job_id):
+            continue
+        try:
+            if entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+        except OSError:
+            pass  # Файл уже удалил другой воркер
+
+
+def _save_job(output_dir, job):
+    """Записать состояние атомарно: читатель из другого процесса не увидит половину файла"""
+    path = os.path.join(output_dir, f"{job['id']}.json")
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(job, file)
+    os.replace(temp_path, path)
@@ -0,0 +1,277 @@
+"""
+Живые обновления страниц администратора через Server-Sent Events.
+
+Источник изменений - строки 'version' в inventory_counters, общие для всех
+процессов: их увеличивает любой коммит, будь то воркер сервера, cron
+(flask mark-overdue) или команды import-tools и sync-users. В каждом
+процессе сервера, пока открыта хоть одна вкладка, фоновый поток
+VersionWatcher раз в poll_seconds сверяет версии одним маленьким запросом
+(коммит в этом же процессе будит его сразу). При расхождении изменённые
+заявки, инструменты и пользователи находятся по updated_at (с запасом
+CURSOR_OVERLAP, как в delta_sync и qr_lookup) и уходят подписчикам одним
+SSE-сообщением 'changes' вместе с текущими глобальными счётчиками. Удаления
+по updated_at не найти - о них, как и о слишком большом числе изменений,
+сообщает событие bulk.
+
+Каждый подписчик получает свою очередь. Последние сообщения хранятся,
+чтобы переподключившийся браузер (заголовок Last-Event-ID) получил
+пропущенное; если пропущено больше, чем хранится, или браузер попал в
+другой процесс сервера - ему отправляется 'reload' и страница перезагружается.
+
+Каждое открытое соединение занимает поток на всё время, пока открыта
+вкладка, поэтому сервер должен быть многопоточным (app.run(threaded=True),
+gunicorn -k gthread), а потоков должно хватать и на вкладки, и на запросы.
+"""
+import json
+import queue
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import db, Tool, User, Request, InventoryCounter
+from delta_sync import CURSOR_OVERLAP
+
+# Больше стольких изменённых строк за одну проверку (массовый импорт) не
+# перечисляем, а отправляем одно событие bulk - страница просто обновит счётчики
+MAX_EVENTS_PER_COMMIT = 200
+
+# Таблицы, за версиями которых следит дашборд
+WATCHED_TABLES = ('requests', 'tools', 'users')
+
+
+class EventBroker:
+    """Рассылка событий подписчикам текущего процесса"""
+
+    def __init__(self, history_size=256, queue_size=256):
+        # Номера сообщений начинаются заново в каждом процессе - эпоха их различает
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history_size)
+        self._last_id = 0
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Новая очередь сообщений. С last_event_id в очередь сразу попадают
+        пропущенные сообщения или, если их уже нет, команда reload.
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            missed = self._missed_since(last_event_id)
+            if missed is None:
+                subscriber.put_nowait(format_message('reload', {}))
+            else:
+                for message in missed[-self.queue_size:]:
+                    subscriber.put_nowait(message)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, payload):
+        """Разослать одно сообщение 'changes' всем подписчикам"""
+        with self._lock:
+            self._last_id += 1
+            event_id = self._last_id
+            message = format_message('changes', payload, f'{self.epoch}-{event_id}')
+            self._history.append((event_id, message))
+
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Вкладка не успевает читать - пусть перезагрузится целиком
+                    self._subscribers.discard(subscriber)
+                    _replace_with_reload(subscriber)
+
+    def _missed_since(self, last_event_id):
+        """Сообщения после last_event_id; None - если восстановить пропущенное нельзя"""
+        if not last_event_id:
+            return []
+        epoch, _, number = last_event_id.partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        number = int(number)
+        if number == self._last_id:
+            return []
+        if not self._history or number < self._history[0][0] - 1 or number > self._last_id:
+            return None
+        return [message for event_id, message in self._history if event_id > number]
+
+
+class VersionWatcher:
+    """
+    Фоновый поток процесса: по версиям таблиц находит изменения, сделанные
+    любым процессом, и публикует их через broker. Пока подписчиков нет,
+    база не опрашивается.
+    """
+
+    def __init__(self, broker, poll_seconds=2):
+        self.broker = broker
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._versions = None
+        self._synced_at = None
+        # (таблица, id) -> updated_at строк, уже отправленных прошлой проверкой:
+        # окно CURSOR_OVERLAP захватывает их снова, повторно не шлём
+        self._sent = {}
+
+    def start(self, app):
+        """Запустить поток (один на процесс) при первой подписке"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), name='live-events', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Проверить версии сейчас, не дожидаясь poll_seconds"""
+        self._wake.set()
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                if not self.broker.has_subscribers():
+                    # Без подписчиков не опрашиваем; следующий подписчик начнёт с новых версий
+                    self._versions = self._synced_at = None
+                    self._sent = {}
+                    continue
+                try:
+                    payload = self.check()
+                except Exception as e:
+                    print(f"⚠️  Ошибка проверки изменений для живых обновлений: {e}")
+                    payload = None
+                finally:
+                    db.session.remove()
+                if payload:
+                    self.broker.publish(payload)
+
+    def check(self):
+        """
+        Сверить версии таблиц; вернуть сообщение для подписчиков или None,
+        если ничего не изменилось. Первая проверка только запоминает версии.
+        """
+        checked_at = datetime.utcnow()
+        rows = db.session.query(InventoryCounter.key, InventoryCounter.name, InventoryCounter.value).filter(
+            InventoryCounter.scope == 'version', InventoryCounter.key.in_(WATCHED_TABLES)
+        )
+        values = {(key, name): value for key, name, value in rows}
+        versions = {table: (values.get((table, 'changes'), 0), values.get((table, 'deletes'), 0))
+                    for table in WATCHED_TABLES}
+
+        if self._versions is None:
+            self._versions = versions
+            self._synced_at = checked_at
+            return None
+        if versions == self._versions:
+            return None
+
+        since = self._synced_at - CURSOR_OVERLAP
+        changed = [table for table in WATCHED_TABLES if versions[table] != self._versions[table]]
+        deleted = any(versions[table][1] != self._versions[table][1] for table in WATCHED_TABLES)
+        events, sent, overflow = self._changed_rows(changed, since)
+
+        if deleted or overflow:
+            events = [{'type': 'bulk'}]
+
+        self._versions = versions
+        self._synced_at = max(self._synced_at, checked_at)
+        self._sent = sent
+        if not events:
+            # Изменения уже отправлены прошлой проверкой - счётчики те же
+            return None
+        return {'events': events, 'counters': InventoryCounter.totals()}
+
+    def _changed_rows(self, tables, since):
+        """События по строкам изменённых таблиц с updated_at >= since"""
+        queries = {
+            'requests': db.session.query(Request.id, Request.updated_at, Request.status, Request.tool_id,
+                                         Request.user_id, Request.request_time)
+                        .filter(Request.updated_at >= since),
+            'tools': db.session.query(Tool.id, Tool.updated_at, Tool.is_available, Tool.name)
+                     .filter(Tool.updated_at >= since),
+            'users': db.session.query(User.id, User.updated_at, User.is_active)
+                     .filter(User.updated_at >= since),
+        }
+        events, sent, overdue = [], {}, 0
+        for table in tables:
+            for row in queries[table].limit(MAX_EVENTS_PER_COMMIT + 1):
+                sent[(table, row.id)] = row.updated_at
+                if self._sent.get((table, row.id)) == row.updated_at:
+                    continue
+                if table == 'requests':
+                    action = 'created' if row.request_time >= since else 'updated'
+                    events.append({'type': 'request', 'action': action, 'id': row.id, 'status': row.status,
+                                   'tool_id': row.tool_id, 'user_id': row.user_id})
+                    overdue += row.status == Request.STATUS_OVERDUE
+                elif table == 'tools':
+                    events.append({'type': 'tool', 'action': 'updated', 'id': row.id,
+                                   'is_available': row.is_available, 'name': row.name})
+                else:
+                    events.append({'type': 'user', 'action': 'updated', 'id': row.id, 'is_active': row.is_active})
+        if overdue:
+            events.append({'type': 'overdue', 'count': overdue})
+        return events, sent, len(sent) > MAX_EVENTS_PER_COMMIT
+
+
+def _replace_with_reload(subscriber):
+    while True:
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            break
+    subscriber.put_nowait(format_message('reload', {}))
+
+
+def format_message(name, data, event_id=None):
+    """Сообщение в формате text/event-stream"""
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {name}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(subscriber, broker, heartbeat=15):
+    """
+    Генератор ответа SSE. Пустой комментарий раз в heartbeat секунд держит
+    соединение открытым через прокси и позволяет заметить закрытую вкладку.
+    """
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            yield message
+            if message.startswith('event: reload'):
+                return
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+broker = EventBroker()
+watcher = VersionWatcher(broker)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_watcher(session):
+    # Коммит этого процесса виден сразу; коммиты других процессов - через poll_seconds
+    if broker.has_subscribers():
+        watcher.wake()
@@ -0,0 +1,189 @@
+"""
+Версионированные миграции схемы базы данных.
+
+db.create_all() создаёт только отсутствующие таблицы и не трогает
+существующие, поэтому новые индексы и колонки для уже работающей базы
+добавляются здесь. Каждая миграция выполняется один раз, номер
+применённой миграции записывается в таблицу schema_migrations.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from database import db
+from tool_search import create_search_index
+
+
+def add_column_if_missing(connection, table, column, ddl):
+    """Добавить колонку, если её ещё нет (в новой базе её уже создал create_all)"""
+    columns = {col['name'] for col in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def backfill_user_lookup_keys(connection):
+    """Заполнить ключи поиска для существующих пользователей (SQLite lower() не знает кириллицу)"""
+    from database import normalize_key
+    
+    rows = connection.execute(text('SELECT id, first_name, last_name, employee_id FROM users')).fetchall()
+    if rows:
+        connection.execute(
+            text('UPDATE users SET first_name_key = :first_name_key, last_name_key = :last_name_key, '
+                 'employee_id_key = :employee_id_key WHERE id = :id'),
+            [{
+                'id': row.id,
+                'first_name_key': normalize_key(row.first_name),
+                'last_name_key': normalize_key(row.last_name),
+                'employee_id_key': normalize_key(row.employee_id),
+            } for row in rows]
+        )
+
+
+def employee_id_key_collisions(connection):
+    """
+    Табельные номера, совпадающие без учёта регистра и пробелов:
+    {ключ: [(id, табельный номер), ...]}
+    """
+    rows = connection.execute(text(
+        'SELECT id, employee_id, employee_id_key FROM users WHERE employee_id_key IN ('
+        'SELECT employee_id_key FROM users WHERE employee_id_key IS NOT NULL '
+        'GROUP BY employee_id_key HAVING COUNT(*) > 1) '
+        'ORDER BY employee_id_key, id'
+    ))
+    collisions = {}
+    for row in rows:
+        collisions.setdefault(row.employee_id_key, []).append((row.id, row.employee_id))
+    return collisions
+
+
+def report_employee_id_collisions(collisions):
+    print(f"⚠️  Табельные номера совпадают без учёта регистра ({len(collisions)}), "
+          f"индекс ix_users_employee_id_key пока неуникальный. Исправьте номера и запустите "
+          f"flask --app app migrate:")
+    for users in collisions.values():
+        print('   ' + ', '.join(f'id {user_id}: {employee_id!r}' for user_id, employee_id in users))
+
+
+def create_employee_id_key_index(connection):
+    """
+    Уникальный индекс ключей табельных номеров. Если в базе уже есть номера,
+    отличающиеся только регистром (AB-12 и ab-12), уникальный индекс не
+    создать - тогда создаём обычный, чтобы поиск оставался быстрым.
+    Совпадения перечисляет, а после исправления делает индекс уникальным
+    ensure_unique_employee_id_key (запускается после миграций).
+    """
+    if employee_id_key_collisions(connection):
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_users_employee_id_key ON users (employee_id_key)'))
+    else:
+        connection.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_users_employee_id_key ON users (employee_id_key)'
+        ))
+
+
+def ensure_unique_employee_id_key(connection):
+    """Пересоздать индекс уникальным, если он был создан обычным и совпадений больше нет"""
+    indexes = {index['name']: index for index in inspect(connection).get_indexes('users')}
+    index = indexes.get('ix_users_employee_id_key')
+    if not index or index['unique']:
+        return
+    
+    collisions = employee_id_key_collisions(connection)
+    if collisions:
+        report_employee_id_collisions(collisions)
+        return
+    
+    connection.execute(text('DROP INDEX ix_users_employee_id_key'))
+    connection.execute(text('CREATE UNIQUE INDEX ix_users_employee_id_key ON users (employee_id_key)'))
+    print("✅ Индекс ix_users_employee_id_key теперь уникальный")
+
+
+# Список миграций: (номер, описание, шаги).
+# Шаг - SQL-строка или функция, принимающая соединение.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Составные индексы для выборок заявок', [
+        'CREATE INDEX IF NOT EXISTS ix_requests_tool_status ON requests (tool_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_requests_status_request_time ON requests (status, request_time)',
+        'CREATE INDEX IF NOT EXISTS ix_requests_request_time ON requests (request_time)',
+        'CREATE INDEX IF NOT EXISTS ix_requests_user_id ON requests (user_id)',
+    ]),
+    (2, 'Нормализованные ключи поиска пользователей', [
+        lambda connection: add_column_if_missing(connection, 'users', 'first_name_key', 'VARCHAR(50)'),
+        lambda connection: add_column_if_missing(connection, 'users', 'last_name_key', 'VARCHAR(50)'),
+        lambda connection: add_column_if_missing(connection, 'users', 'employee_id_key', 'VARCHAR(20)'),
+        backfill_user_lookup_keys,
+        'CREATE INDEX IF NOT EXISTS ix_users_name_key ON users (last_name_key, first_name_key)',
+        create_employee_id_key_index,
+    ]),
+    (3, 'Полнотекстовый поиск инструментов', [
+        create_search_index,
+    ]),
+    (4, 'Индекс изменений пользователей для справочника сотрудников', [
+        'CREATE INDEX IF NOT EXISTS ix_users_updated_at ON users (updated_at)',
+    ]),
+    (5, 'Индекс истории возвратов', [
+        'CREATE INDEX IF NOT EXISTS ix_requests_status_returned '
+        'ON requests (status, actual_return_time, approval_time, request_time, tool_id, user_id)',
+    ]),
+    (6, 'Индекс просроченных заявок', [
+        'CREATE INDEX IF NOT EXISTS ix_requests_status_expected_return '
+        'ON requests (status, expected_return_time)',
+    ]),
+    (7, 'Дельта-синхронизация списков: время изменения и версии таблиц', [
+        lambda connection: add_column_if_missing(connection, 'requests', 'updated_at', 'TIMESTAMP'),
+        'UPDATE requests SET updated_at = COALESCE(actual_return_time, approval_time, request_time) '
+        'WHERE updated_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS ix_requests_updated_at ON requests (updated_at)',
+        'UPDATE tools SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL',
+        'UPDATE users SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS ix_tools_updated_at ON tools (updated_at)',
+        lambda connection: add_column_if_missing(connection, 'inventory_counters', 'updated_at', 'TIMESTAMP'),
+    ]),
+    (8, 'Индекс истории возвратов в порядке страницы (дата возврата, id)', [
+        'DROP INDEX IF EXISTS ix_requests_status_returned',
+        'CREATE INDEX ix_requests_status_returned '
+        'ON requests (status, actual_return_time, id, approval_time, request_time, tool_id, user_id)',
+    ]),
+]
+
+
+def run_migrations():
+    """Применить все ещё не применённые миграции (вызывается внутри app_context)"""
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, '
+            'description VARCHAR(200) NOT NULL, '
+            'applied_at TIMESTAMP NOT NULL)'
+        ))
+        applied = {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+    
+    for version, description, steps in MIGRATIONS:
+        if version in applied:
+            continue
+        
+        # Каждая миграция - в своей транзакции
+        with db.engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        
+        print(f"✅ Миграция {version}: {description}")
+    
+    # Уникальность табельных номеров, отложенная миграцией 2 из-за совпадений
+    with db.engine.begin() as connection:
+        ensure_unique_employee_id_key(connection)
+
+
+def current_version():
+    """Номер последней применённой миграции"""
+    with db.engine.connect() as connection:
+        return connection.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
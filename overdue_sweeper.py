@@ -0,0 +1,60 @@
+"""
+Пометка просроченных заявок.
+
+Выданные заявки с истёкшим expected_return_time переводятся в статус
+overdue одним UPDATE (Request.mark_overdue), поэтому дашборд читает
+готовый статус по индексу, а не сравнивает даты всех выданных заявок.
+
+На сервере это делает cron командой flask --app app mark-overdue.
+Фоновый поток (раз в Config.OVERDUE_SWEEP_SECONDS) запускается в каждом
+процессе отдельно, поэтому он для запуска в одном процессе (python app.py):
+под gunicorn с четырьмя воркерами было бы четыре прохода за период.
+"""
+import threading
+import time
+
+from database import db, Request
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def sweep_overdue(now):
+    """Пометить просроченные заявки и закоммитить; возвращает их число"""
+    try:
+        count = Request.mark_overdue(now)
+        db.session.commit()
+        return count
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def start_overdue_sweeper(app, interval, clock):
+    """
+    Запустить фоновый поток пометки просрочек (один на процесс).
+    clock() - текущее время в том же поясе, что и expected_return_time.
+    interval <= 0 или None - поток не запускается.
+    """
+    global _sweeper
+    if not interval or interval <= 0:
+        return None
+
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return _sweeper
+
+        def run():
+            while True:
+                with app.app_context():
+                    try:
+                        count = sweep_overdue(clock())
+                        if count:
+                            print(f"⏰ Помечено просроченных заявок: {count}")
+                    except Exception as e:
+                        print(f"❌ Ошибка при пометке просроченных заявок: {e}")
+                time.sleep(interval)
+
+        _sweeper = threading.Thread(target=run, name='overdue-sweeper', daemon=True)
+        _sweeper.start()
+        return _sweeper
@@ -0,0 +1,81 @@
+"""
+Картинки QR-кодов инструментов (PNG/SVG) с дисковым кэшем.
+
+Имя файла в кэше - хэш от содержимого QR-кода (URL инструмента) и настроек
+картинки, поэтому одна и та же картинка рисуется один раз, а при смене
+Config.SITE_URL или идентификатора инструмента автоматически получается
+новый ключ. Этот же ключ служит сильным ETag.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+QR_ERROR_LEVELS = ('L', 'M', 'Q', 'H')
+
+# Ширина белой рамки в модулях (минимум по стандарту - 4)
+QR_BORDER = 4
+
+# Меняется при изменении способа отрисовки, чтобы не отдавать старые файлы
+QR_RENDER_VERSION = 1
+
+
+def qr_cache_key(data, image_format, size, error_level):
+    """Ключ кэша и ETag: хэш от содержимого и настроек картинки"""
+    source = f'{QR_RENDER_VERSION}|{data}|{image_format}|{size}|{error_level}|{QR_BORDER}'
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def render_qr(data, image_format, size, error_level):
+    """Нарисовать QR-код; size - примерная ширина картинки в пикселях"""
+    try:
+        import qrcode  # Нужно установить: pip install qrcode[pil]
+        import qrcode.image.svg
+    except ImportError:
+        raise RuntimeError('Для картинок QR-кодов установите qrcode: pip install qrcode[pil]')
+
+    qr = qrcode.QRCode(
+        error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{error_level}'),
+        border=QR_BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    # Размер модуля подбираем так, чтобы картинка была не больше size
+    qr.box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+
+    buffer = io.BytesIO()
+    if image_format == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+        # SVG масштабируется по viewBox; размер задаём в пикселях вместо мм
+        pixels = qr.box_size * (qr.modules_count + 2 * QR_BORDER)
+        return re.sub(rb'width="[^"]*" height="[^"]*"',
+                      f'width="{pixels}" height="{pixels}"'.encode(), buffer.getvalue(), count=1)
+
+    qr.make_image().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def get_qr_image(cache_dir, data, image_format, size, error_level):
+    """
+    Путь к картинке в дисковом кэше и её ETag. Картинка рисуется только
+    если её ещё нет в кэше; запись атомарная (временный файл + rename),
+    поэтому параллельные запросы не увидят недописанный файл.
+    """
+    key = qr_cache_key(data, image_format, size, error_level)
+    path = os.path.join(cache_dir, key[:2], f'{key}.{image_format}')
+
+    if not os.path.exists(path):
+        content = render_qr(data, image_format, size, error_level)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    return path, key
@@ -0,0 +1,207 @@
+"""
+Кэш сканирований QR-кодов (/tool/<qr_code>).
+
+По идентификатору QR хранится снимок инструмента и его активной выдачи
+(вместе с тем, кто взял инструмент) - простые объекты без привязки к сессии
+SQLAlchemy, поэтому их можно отдавать из разных потоков. Кэш ограничен по
+размеру (вытесняются давно не сканированные) и по времени жизни записи.
+
+Согласованность:
+- изменения в этом процессе (выдача, возврат, правка, удаление) сбрасывают
+  записи затронутых инструментов сразу после коммита;
+- изменения из других процессов видны по версиям таблиц tools и requests
+  (строки 'version' в inventory_counters): не чаще раза в check_seconds
+  версии сверяются одним маленьким запросом, и при расхождении по updated_at
+  находятся и сбрасываются только изменённые инструменты. Если что-то
+  удалялось - кэш очищается целиком.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import db, Tool, User, Request, InventoryCounter
+from delta_sync import CURSOR_OVERLAP
+
+# Ключ session.info: инструменты, изменённые в текущей транзакции
+PENDING_KEY = 'qr_lookup_changes'
+
+
+class ToolSnapshot(SimpleNamespace):
+    """Колонки инструмента; qr_code_url считается так же, как у Tool"""
+    qr_code_url = Tool.qr_code_url
+
+
+class UserSnapshot(SimpleNamespace):
+    full_name = User.full_name
+
+
+def _columns(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def load_snapshot(qr_code):
+    """Инструмент и его активная заявка из базы: (ToolSnapshot, SimpleNamespace) или (None, None)"""
+    tool = Tool.query.filter_by(qr_code_identifier=qr_code).first()
+    if not tool:
+        return None, None
+
+    active_request = None
+    if not tool.is_available:
+        req = Request.query.options(*Request.load_options()).filter(
+            Request.tool_id == tool.id,
+            Request.status.in_(Request.ACTIVE_STATUSES)
+        ).first()
+        if req:
+            active_request = SimpleNamespace(
+                **_columns(req),
+                requester=UserSnapshot(**_columns(req.requester)) if req.requester else None,
+            )
+
+    return ToolSnapshot(**_columns(tool)), active_request
+
+
+class QRLookupCache:
+    """LRU + TTL кэш снимков по идентификатору QR, общий для потоков процесса"""
+
+    def __init__(self, max_size=1024, ttl_seconds=60, check_seconds=1):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        # Сверка версий: одна на процесс за раз, остальные потоки её не ждут
+        self._refresh_lock = threading.Lock()
+        self._entries = OrderedDict()  # qr_code -> (истекает, tool, active_request)
+        self._qr_by_tool_id = {}
+        # Растёт при каждом сбросе: снимок, загруженный до сброса, не сохраняем
+        self._generation = 0
+        self._versions = None
+        self._synced_at = None
+        self._checked_at = None
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'cleared': 0}
+
+    def get(self, qr_code, loader=load_snapshot):
+        """(инструмент, активная заявка) из кэша или через loader(qr_code)"""
+        self._check_versions()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(qr_code)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(qr_code)
+                self._stats['hits'] += 1
+                return entry[1], entry[2]
+            self._stats['misses'] += 1
+            generation = self._generation
+
+        tool, active_request = loader(qr_code)
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[qr_code] = (now + self.ttl_seconds, tool, active_request)
+                self._entries.move_to_end(qr_code)
+                if tool:
+                    self._qr_by_tool_id[tool.id] = qr_code
+                while len(self._entries) > self.max_size:
+                    _, (_, old_tool, _) = self._entries.popitem(last=False)
+                    if old_tool:
+                        self._qr_by_tool_id.pop(old_tool.id, None)
+        return tool, active_request
+
+    def invalidate(self, tool_ids=(), qr_codes=()):
+        """Сбросить записи инструментов (по id или идентификатору QR)"""
+        with self._lock:
+            self._generation += 1
+            keys = set(qr_codes) | {self._qr_by_tool_id.pop(tool_id, None) for tool_id in tool_ids}
+            for key in keys:
+                if key is not None and self._entries.pop(key, None) is not None:
+                    self._stats['invalidated'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._qr_by_tool_id.clear()
+            self._stats['cleared'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_size=self.max_size)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def _check_versions(self):
+        """
+        Сверить версии таблиц и сбросить то, что изменили другие процессы.
+        Если сверку уже выполняет другой поток, не ждём его - как и при
+        проверке не чаще раза в check_seconds, запись может устареть на эти мгновения.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            self._sync_versions()
+        finally:
+            self._refresh_lock.release()
+
+    def _sync_versions(self):
+        """Сама сверка; вызывается только под _refresh_lock"""
+        checked_at = datetime.utcnow()
+        rows = db.session.query(InventoryCounter.key, InventoryCounter.name, InventoryCounter.value).filter(
+            InventoryCounter.scope == 'version', InventoryCounter.key.in_(('tools', 'requests'))
+        )
+        values = {(key, name): value for key, name, value in rows}
+        versions = tuple(values.get(key, 0) for key in (
+            ('tools', 'changes'), ('tools', 'deletes'), ('requests', 'changes'), ('requests', 'deletes')
+        ))
+
+        if self._versions is None or versions[1] != self._versions[1] or versions[3] != self._versions[3]:
+            # Первая проверка или были удаления - по updated_at их не найти
+            if self._versions is not None:
+                self.clear()
+        elif versions != self._versions:
+            since = self._synced_at - CURSOR_OVERLAP
+            changed = db.session.query(Tool.id, Tool.qr_code_identifier).filter(Tool.updated_at >= since).all()
+            changed_tool_ids = db.session.query(Request.tool_id).filter(Request.updated_at >= since).all()
+            self.invalidate(
+                tool_ids=[tool_id for tool_id, _ in changed] + [tool_id for tool_id, in changed_tool_ids],
+                qr_codes=[qr_code for _, qr_code in changed],
+            )
+
+        self._versions = versions
+        # Отметка только растёт: иначе следующая сверка взяла бы лишнее или пропустила изменения
+        self._synced_at = checked_at if self._synced_at is None else max(self._synced_at, checked_at)
+
+
+qr_lookup = QRLookupCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_tools(session, flush_context):
+    changes = session.info.setdefault(PENDING_KEY, (set(), set()))
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Tool):
+            changes[0].add(obj.id)
+            changes[1].add(obj.qr_code_identifier)
+        elif isinstance(obj, Request):
+            changes[0].add(obj.tool_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes and (changes[0] or changes[1]):
+        qr_lookup.invalidate(tool_ids=changes[0], qr_codes=changes[1])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop(PENDING_KEY, None)
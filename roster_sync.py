@@ -0,0 +1,184 @@
+"""
+Синхронизация сотрудников с кадровым списком (HR).
+
+Список сотрудников - источник истины: сотрудники сопоставляются по
+табельному номеру (без учёта регистра, см. normalize_key), новые
+добавляются, изменившиеся обновляются, а все активные пользователи,
+которых нет в списке, деактивируются (is_active=False).
+
+Разница считается в памяти по одному SELECT, а изменения применяются
+несколькими INSERT/UPDATE с набором параметров (executemany) в одной
+транзакции - ночная синхронизация десятков тысяч сотрудников занимает секунды.
+"""
+from datetime import datetime
+
+from database import db, User, InventoryCounter, normalize_key
+
+# Заголовки колонок файла: поле модели и русские варианты названий
+USER_COLUMN_ALIASES = {
+    'employee_id': ('employee_id', 'табельный номер', 'таб. номер', 'таб номер'),
+    'first_name': ('first_name', 'имя'),
+    'last_name': ('last_name', 'фамилия'),
+    'email': ('email', 'e-mail', 'почта'),
+    'department': ('department', 'отдел', 'подразделение'),
+    'phone': ('phone', 'телефон'),
+    'position': ('position', 'должность'),
+}
+
+USER_HEADER_TO_FIELD = {
+    alias: field for field, aliases in USER_COLUMN_ALIASES.items() for alias in aliases
+}
+
+# Поля, которые синхронизируются из кадрового списка
+SYNC_FIELDS = ('first_name', 'last_name', 'email', 'department', 'phone', 'position')
+
+# Размер пачки для UPDATE ... WHERE id IN (...)
+CHUNK_SIZE = 500
+
+
+def _clean(value):
+    """Строковое значение без пробелов по краям; числа из Excel без '.0'"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def sync_users(rows, dry_run=False):
+    """
+    Синхронизировать пользователей со списком rows - итератор пар
+    (номер строки, {поле: значение}), как из bulk_import.read_rows.
+    Возвращает отчёт о различиях; при dry_run ничего не меняет.
+    """
+    report = {
+        'created': [],
+        'updated': [],
+        'reactivated': [],
+        'deactivated': [],
+        'unchanged': 0,
+        'errors': [],
+        'dry_run': dry_run,
+    }
+    
+    # 1. Разбираем список сотрудников
+    roster = {}
+    for row_number, data in rows:
+        values = {field: _clean(data.get(field)) for field in ('employee_id',) + SYNC_FIELDS}
+        
+        if not values['employee_id']:
+            report['errors'].append({'row': row_number, 'message': 'Не указан табельный номер'})
+            continue
+        if not (values['first_name'] and values['last_name']):
+            report['errors'].append({'row': row_number, 'message': 'Имя и фамилия обязательны для заполнения'})
+            continue
+        
+        key = normalize_key(values['employee_id'])
+        if key in roster:
+            report['errors'].append({
+                'row': row_number,
+                'message': f"Табельный номер {values['employee_id']} повторяется в списке"
+            })
+            continue
+        roster[key] = values
+    
+    # 2. Текущее состояние - одним запросом
+    columns = [User.id, User.employee_id_key, User.is_active] + [getattr(User, f) for f in SYNC_FIELDS]
+    existing = {}
+    active_without_roster = []
+    email_owner = {}
+    for row in db.session.query(*columns):
+        if row.email:
+            email_owner[row.email.lower()] = row.id
+        if row.employee_id_key and row.employee_id_key in roster:
+            existing[row.employee_id_key] = row
+        elif row.is_active:
+            active_without_roster.append(row)
+    
+    # 3. Считаем разницу
+    inserts, updates, counter_changes = [], [], []
+    now = datetime.utcnow()
+    
+    for key, values in roster.items():
+        row = existing.get(key)
+        owner = email_owner.get(values['email'].lower()) if values['email'] else None
+        if owner is not None and (row is None or owner != row.id):
+            report['errors'].append({
+                'employee_id': values['employee_id'],
+                'message': f"Email {values['email']} уже занят другим пользователем, email не изменён"
+            })
+            values['email'] = row.email if row is not None else None
+        elif values['email']:
+            email_owner[values['email'].lower()] = row.id if row is not None else key
+        
+        if row is None:
+            inserts.append({
+                **values,
+                'first_name_key': normalize_key(values['first_name']),
+                'last_name_key': normalize_key(values['last_name']),
+                'employee_id_key': key,
+                'is_active': True,
+                'created_at': now,
+                'updated_at': now,
+            })
+            counter_changes.append((None, (values['department'], True)))
+            report['created'].append(values['employee_id'])
+            continue
+        
+        changed = {f: values[f] for f in SYNC_FIELDS if getattr(row, f) != values[f]}
+        if not changed and row.is_active:
+            report['unchanged'] += 1
+            continue
+        
+        if 'first_name' in changed:
+            changed['first_name_key'] = normalize_key(changed['first_name'])
+        if 'last_name' in changed:
+            changed['last_name_key'] = normalize_key(changed['last_name'])
+        updates.append({'id': row.id, 'is_active': True, 'updated_at': now, **changed})
+        counter_changes.append(((row.department, row.is_active), (values['department'], True)))
+        
+        if not row.is_active:
+            report['reactivated'].append(values['employee_id'])
+        else:
+            report['updated'].append(values['employee_id'])
+    
+    deactivate_ids = [row.id for row in active_without_roster]
+    for row in active_without_roster:
+        counter_changes.append(((row.department, True), (row.department, False)))
+        report['deactivated'].append({
+            'id': row.id,
+            'full_name': f'{row.first_name} {row.last_name}',
+        })
+    
+    if dry_run:
+        return report
+    
+    # 4. Применяем изменения в одной транзакции
+    try:
+        if inserts:
+            db.session.execute(db.insert(User), inserts)
+        
+        # UPDATE по первичному ключу с набором параметров; строки группируем
+        # по набору изменённых колонок, чтобы каждая группа была одним executemany
+        groups = {}
+        for values in updates:
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+        for group in groups.values():
+            db.session.execute(db.update(User), group)
+        
+        for start in range(0, len(deactivate_ids), CHUNK_SIZE):
+            chunk = deactivate_ids[start:start + CHUNK_SIZE]
+            db.session.execute(
+                db.update(User).where(User.id.in_(chunk)).values(is_active=False, updated_at=now),
+                execution_options={'synchronize_session': False}
+            )
+        
+        # Массовые изменения идут мимо flush, поэтому счётчики обновляем явно
+        InventoryCounter.apply(InventoryCounter.user_deltas(counter_changes))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    return report
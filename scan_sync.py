@@ -0,0 +1,265 @@
+"""
+Пакетная синхронизация офлайн-сканеров.
+
+Сканер без связи копит события выдачи и возврата у себя и отправляет их
+одним запросом на /api/scans/batch. Каждое событие несёт ключ
+идемпотентности key (уникальную строку, которую сканер генерирует сам) и
+время сканирования на устройстве client_time.
+
+События применяются по порядку в одной транзакции на пачку: выдача и
+возврат одного инструмента в одной пачке видят друг друга. Событие, которое
+нельзя применить (инструмент уже выдан, нет активной выдачи, неизвестный
+сотрудник), не ломает пачку - оно получает статус conflict с кодом причины.
+Результат каждого события сохраняется в scan_events, поэтому повторная
+отправка той же пачки (ответ не дошёл до сканера) ничего не применит
+второй раз, а вернёт прежние результаты с duplicate: true.
+
+Инструменты, их активные заявки и сотрудники по id читаются заранее
+несколькими запросами на всю пачку, а не по запросу на событие, и все
+изменения пишутся одним flush - счётчики тоже обновляются один раз на
+пачку. Поэтому выдача здесь не идёт через Tool.try_issue: вместо условного
+UPDATE на каждое событие после flush одним запросом проверяется, что никто
+не выдал те же инструменты параллельно (киоск, другой сканер). Если выдал -
+пачка откатывается целиком (BatchRetry), и сканер отправляет её повторно.
+"""
+from datetime import datetime
+
+from database import db, User, Tool, Request, ScanEvent
+
+EVENT_TYPES = ('checkout', 'return')
+
+MAX_KEY_LENGTH = 64
+
+
+class ScanConflict(Exception):
+    """Событие нельзя применить; code - причина для сканера"""
+
+    def __init__(self, code, message, status=ScanEvent.STATUS_CONFLICT):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def parse_client_time(value, now, timezone):
+    """Время сканирования с устройства; часы сканера, ушедшие вперёд, обрезаются до now"""
+    if not value:
+        return now
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ScanConflict('bad_time', f'Некорректное время события: {value}', ScanEvent.STATUS_INVALID)
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone).replace(tzinfo=None)
+    return min(moment, now)
+
+
+class BatchRetry(Exception):
+    """Пачку обогнал параллельный запрос - её нужно отправить ещё раз"""
+
+
+class ScanBatch:
+    """Инструменты, активные заявки и сотрудники пачки, загруженные заранее"""
+
+    def __init__(self, events):
+        events = [event for event in events if isinstance(event, dict)]
+        qr_codes = {str(event['qr_code']) for event in events if event.get('qr_code')}
+        tool_ids = {event['tool_id'] for event in events if isinstance(event.get('tool_id'), int)}
+        user_ids = {(event.get('user') or {}).get('user_id') for event in events
+                    if isinstance(event.get('user'), dict)}
+        user_ids = {user_id for user_id in user_ids if isinstance(user_id, int)}
+
+        tools = Tool.query.filter(db.or_(
+            Tool.qr_code_identifier.in_(qr_codes), Tool.id.in_(tool_ids)
+        )).all() if qr_codes or tool_ids else []
+        self.tools_by_qr = {tool.qr_code_identifier: tool for tool in tools}
+        self.tools_by_id = {tool.id: tool for tool in tools}
+
+        active = Request.query.options(*Request.load_options()).filter(
+            Request.tool_id.in_(self.tools_by_id),
+            Request.status.in_(Request.ACTIVE_STATUSES)
+        ).all() if tools else []
+        self.active_by_tool = {req.tool_id: req for req in active}
+        self.issued_tool_ids = set()
+
+        # Сотрудники по id попадают в identity map сессии - db.session.get их не перечитает
+        if user_ids:
+            User.query.filter(User.id.in_(user_ids)).all()
+        self._users = {}
+
+    def tool(self, event):
+        tool = None
+        if event.get('qr_code'):
+            tool = self.tools_by_qr.get(str(event['qr_code']))
+        elif isinstance(event.get('tool_id'), int):
+            tool = self.tools_by_id.get(event['tool_id'])
+        if not tool:
+            raise ScanConflict('tool_not_found', 'Инструмент не найден')
+        return tool
+
+    def user(self, data):
+        """Сотрудник по user_id и/или имени, фамилии и табельному номеру"""
+        if not isinstance(data, dict):
+            raise ScanConflict('no_user', 'Не указан сотрудник', ScanEvent.STATUS_INVALID)
+        first_name = (data.get('first_name') or '').strip()
+        last_name = (data.get('last_name') or '').strip()
+        employee_id = (data.get('employee_id') or '').strip()
+        user_id = data.get('user_id')
+
+        cache_key = (user_id, first_name, last_name, employee_id)
+        if cache_key not in self._users:
+            if first_name and last_name:
+                user = User.resolve_identity(first_name, last_name, employee_id, user_id)
+            elif isinstance(user_id, int):
+                user = db.session.get(User, user_id)
+            else:
+                raise ScanConflict('no_user', 'Не указан сотрудник', ScanEvent.STATUS_INVALID)
+            self._users[cache_key] = user
+
+        user = self._users[cache_key]
+        if not user:
+            raise ScanConflict('user_not_found', 'Сотрудник не найден')
+        if not user.is_active:
+            raise ScanConflict('user_inactive', 'Пользователь не активен')
+        return user
+
+    def checkout(self, event, client_time):
+        tool = self.tool(event)
+        user = self.user(event.get('user'))
+
+        holder = self.active_by_tool.get(tool.id)
+        if holder or not tool.is_available:
+            who = holder.requester.full_name() if holder and holder.requester else 'другим сотрудником'
+            raise ScanConflict('tool_taken', f'Инструмент "{tool.name}" уже выдан ({who})')
+
+        tool.is_available = False
+        self.issued_tool_ids.add(tool.id)
+
+        new_request = Request(
+            requester=user,
+            requested_tool=tool,
+            purpose=(event.get('purpose') or '').strip(),
+            status=Request.STATUS_APPROVED,
+            approval_time=client_time,
+            expected_return_time=client_time + Request.LOAN_PERIOD,
+        )
+        db.session.add(new_request)
+        self.active_by_tool[tool.id] = new_request
+        return new_request, f'Инструмент "{tool.name}" выдан {user.full_name()}'
+
+    def return_tool(self, event, client_time):
+        tool = self.tool(event)
+        request_obj = self.active_by_tool.get(tool.id)
+        if not request_obj:
+            raise ScanConflict('not_issued', f'Инструмент "{tool.name}" не числится выданным')
+
+        # Сотрудник необязателен, но если указан - должен совпасть с тем, кто брал
+        data = event.get('user')
+        if isinstance(data, dict) and data.get('first_name') and data.get('last_name'):
+            holder = request_obj.requester
+            if holder and not holder.matches_identity(data['first_name'], data['last_name'],
+                                                      (data.get('employee_id') or '').strip()):
+                raise ScanConflict('holder_mismatch', 'Данные не совпадают с пользователем, взявшим инструмент')
+
+        request_obj.return_tool()
+        # Часы сканера могли отставать - возврат не раньше выдачи
+        request_obj.actual_return_time = max(client_time, request_obj.approval_time or client_time)
+        if event.get('condition_after'):
+            request_obj.condition_after = str(event['condition_after']).strip()
+        if event.get('notes'):
+            request_obj.admin_notes = str(event['notes']).strip()
+        del self.active_by_tool[tool.id]
+        return request_obj, f'Инструмент "{tool.name}" возвращён'
+
+    def check_issued(self):
+        """После flush: у каждого выданного пачкой инструмента ровно одна активная заявка"""
+        if not self.issued_tool_ids:
+            return
+        doubled = db.session.query(Request.tool_id).filter(
+            Request.tool_id.in_(self.issued_tool_ids),
+            Request.status.in_(Request.ACTIVE_STATUSES)
+        ).group_by(Request.tool_id).having(db.func.count() > 1).first()
+        if doubled:
+            raise BatchRetry(f'Инструмент {doubled.tool_id} выдан параллельно с пачкой')
+
+
+def apply_scan_events(events, device_id, now, timezone):
+    """
+    Применить события пачки по порядку в одной транзакции.
+    Возвращает список результатов в порядке событий.
+    """
+    keys = [event.get('key') for event in events if isinstance(event, dict)]
+    keys = [key for key in keys if _valid_key(key)]
+    processed = {
+        record.idempotency_key: record
+        for record in ScanEvent.query.filter(ScanEvent.idempotency_key.in_(keys))
+    } if keys else {}
+
+    batch = ScanBatch(events)
+    results = []
+    applied = []
+
+    try:
+        # Запросы внутри цикла (поиск сотрудника по имени) не должны сбрасывать изменения по одному
+        with db.session.no_autoflush:
+            for event in events:
+                key = event.get('key') if isinstance(event, dict) else None
+                if not _valid_key(key):
+                    # Без ключа событие нельзя сохранить для повторов - только сообщаем об ошибке
+                    results.append({
+                        'key': key, 'status': ScanEvent.STATUS_INVALID, 'code': 'bad_key',
+                        'message': f'Нужен idempotency key (строка до {MAX_KEY_LENGTH} символов)',
+                        'request_id': None, 'duplicate': False,
+                    })
+                    continue
+
+                if key in processed:
+                    results.append((processed[key], True))
+                    continue
+
+                record = ScanEvent(idempotency_key=key, device_id=device_id, event_type=event.get('type'))
+                request_obj = _apply_event(batch, event, record, now, timezone)
+                if request_obj:
+                    applied.append((record, request_obj))
+                db.session.add(record)
+                processed[key] = record
+                results.append((record, False))
+
+        # id новых заявок появляются после flush
+        db.session.flush()
+        batch.check_issued()
+        for record, request_obj in applied:
+            record.request_id = request_obj.id
+            record.tool_id = request_obj.tool_id
+        # Ответ собираем до коммита: после него объекты устаревают и перечитывались бы по одному
+        results = [
+            result[0].result(duplicate=result[1]) if isinstance(result, tuple) else result
+            for result in results
+        ]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return results
+
+
+def _valid_key(key):
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def _apply_event(batch, event, record, now, timezone):
+    """Применить одно событие и записать исход в record; возвращает заявку или None"""
+    try:
+        if event.get('type') not in EVENT_TYPES:
+            raise ScanConflict('bad_type', 'Тип события: checkout или return', ScanEvent.STATUS_INVALID)
+        record.client_time = parse_client_time(event.get('client_time'), now, timezone)
+        handler = batch.checkout if event['type'] == 'checkout' else batch.return_tool
+        request_obj, record.message = handler(event, record.client_time)
+        record.status = ScanEvent.STATUS_APPLIED
+        return request_obj
+    except ScanConflict as conflict:
+        record.status = conflict.status
+        record.code = conflict.code
+        record.message = conflict.message
+        return None
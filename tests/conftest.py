@@ -0,0 +1,73 @@
+"""
+Общие фикстуры тестов.
+
+База берётся из DATABASE_URL, например PostgreSQL:
+    DATABASE_URL=postgresql+psycopg2://postgres@localhost/tool_tracker_test python -m pytest
+без неё - временный файл SQLite. Схема создаётся один раз на запуск через
+init_db() (create_all + миграции), между тестами таблицы очищаются.
+"""
+import os
+
+import pytest
+from sqlalchemy import text
+
+from app import create_app
+from database import db, init_db
+from qr_lookup import qr_lookup
+from user_directory import user_directory
+
+
+def _drop_schema():
+    db.drop_all()
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS schema_migrations'))
+
+
+@pytest.fixture(scope='session')
+def database_url(tmp_path_factory):
+    return os.environ.get('DATABASE_URL') or 'sqlite:///' + str(tmp_path_factory.mktemp('db') / 'test.db')
+
+
+@pytest.fixture(scope='session')
+def app(database_url, tmp_path_factory):
+    files = tmp_path_factory.mktemp('files')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'TESTING': True,
+        # Фоновый поток пометки просроченных заявок в тестах не нужен
+        'OVERDUE_SWEEP_SECONDS': 0,
+        'QR_CACHE_DIR': str(files / 'qr_cache'),
+        'LABEL_OUTPUT_DIR': str(files / 'labels'),
+    })
+    with app.app_context():
+        _drop_schema()
+        init_db()
+    yield app
+    with app.app_context():
+        _drop_schema()
+        db.engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def app_context(app):
+    with app.app_context():
+        yield
+        db.session.remove()
+        with db.engine.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                connection.execute(table.delete())
+        # Кэши процесса помнят строки удалённых таблиц
+        qr_lookup.clear()
+        qr_lookup._versions = qr_lookup._synced_at = qr_lookup._checked_at = None
+        user_directory._synced_at = user_directory._checked_at = None
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def sqlite_only():
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('проверка только для SQLite')
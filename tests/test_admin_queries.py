@@ -0,0 +1,49 @@
+"""Число SQL-запросов страниц админки не зависит от числа строк (нет N+1)"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from database import db, Request, Tool, User
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_tools(count, start):
+    """count инструментов, каждый второй выдан своему сотруднику"""
+    for i in range(start, start + count):
+        tool = Tool(name=f'Инструмент {i}', qr_code_identifier=f'ADM{i:05d}',
+                    category=f'Категория {i % 3}', location=f'Склад {i % 2}')
+        db.session.add(tool)
+        if i % 2:
+            tool.is_available = False
+            user = User(first_name=f'Имя{i}', last_name='Фамилия', employee_id=f'A{i}')
+            db.session.add(Request(requester=user, requested_tool=tool, status=Request.STATUS_APPROVED))
+    db.session.commit()
+
+
+def test_admin_tools_statement_count_does_not_grow(client):
+    add_tools(5, start=0)
+    client.get('/admin/tools')  # первый запрос прогревает кэши процесса
+
+    with count_statements() as small:
+        assert client.get('/admin/tools').status_code == 200
+
+    add_tools(45, start=5)
+    with count_statements() as large:
+        response = client.get('/admin/tools')
+    assert response.status_code == 200
+    assert 'Инструмент 49' in response.get_data(as_text=True)
+
+    assert len(large) == len(small), large
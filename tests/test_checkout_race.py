@@ -0,0 +1,41 @@
+"""Гонка выдачи: много киосков одновременно берут один и тот же инструмент"""
+import threading
+from collections import Counter
+
+from database import db, Request, Tool, User
+
+THREADS = 32
+REQUESTS_PER_THREAD = 10
+
+
+def test_concurrent_checkout_issues_tool_once(app):
+    users = [User(first_name=f'Сотрудник{i}', last_name='Тестов', employee_id=f'R{i}') for i in range(THREADS)]
+    tool = Tool(name='Перфоратор', qr_code_identifier='RACE0001')
+    db.session.add_all(users + [tool])
+    db.session.commit()
+    user_ids = [user.id for user in users]
+    tool_id = tool.id
+
+    start = threading.Barrier(THREADS)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def kiosk(user_id):
+        client = app.test_client()
+        start.wait()
+        for _ in range(REQUESTS_PER_THREAD):
+            response = client.post('/api/create-request', json={'user_id': user_id, 'tool_id': tool_id})
+            with lock:
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=kiosk, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Инструмент в сессии теста загружен до гонки
+    db.session.expire_all()
+    assert statuses == {200: 1, 409: THREADS * REQUESTS_PER_THREAD - 1}
+    assert Request.query.filter_by(tool_id=tool_id, status=Request.STATUS_APPROVED).count() == 1
+    assert not db.session.get(Tool, tool_id).is_available
@@ -0,0 +1,59 @@
+"""Выдача комплекта: все инструменты одной транзакцией или ни одного"""
+from sqlalchemy import event
+
+from database import db, Kit, Request, Tool, User
+
+
+def make_kit():
+    user = User(first_name='Иван', last_name='Петров', employee_id='K1')
+    tools = [Tool(name=f'Ключ {i}', qr_code_identifier=f'KIT{i:05d}') for i in range(3)]
+    kit = Kit(name='Монтажный комплект', tools=tools)
+    db.session.add_all([user, kit])
+    db.session.commit()
+    return kit.id, user.id, [tool.id for tool in tools]
+
+
+def test_kit_checkout_issues_all_tools_for_loan_period(client):
+    kit_id, user_id, tool_ids = make_kit()
+
+    response = client.post(f'/api/kits/{kit_id}/checkout', json={'user_id': user_id})
+    assert response.status_code == 200, response.get_json()
+
+    loans = Request.query.filter(Request.tool_id.in_(tool_ids)).all()
+    assert len(loans) == 3
+    for loan in loans:
+        assert loan.status == Request.STATUS_APPROVED
+        assert loan.expected_return_time - loan.approval_time == Request.LOAN_PERIOD
+
+
+def test_kit_checkout_is_all_or_nothing(client):
+    kit_id, user_id, tool_ids = make_kit()
+    response = client.post('/api/create-request', json={'user_id': user_id, 'tool_id': tool_ids[1]})
+    assert response.status_code == 200
+
+    response = client.post(f'/api/kits/{kit_id}/checkout', json={'user_id': user_id})
+    assert response.status_code == 409
+    assert [tool['id'] for tool in response.get_json()['tools']] == [tool_ids[1]]
+
+    db.session.expire_all()
+    assert Request.query.count() == 1
+    assert [tool.is_available for tool in Tool.query.order_by(Tool.id)] == [True, False, True]
+
+
+def test_kit_checkout_reads_tools_once(client):
+    kit_id, user_id, tool_ids = make_kit()
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM tools' in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', collect)
+    try:
+        assert Tool.try_issue_many(tool_ids)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', collect)
+    db.session.rollback()
+
+    # Счётчики доступности: категории и места всех инструментов одним SELECT, а не по одному
+    assert len(statements) == 1
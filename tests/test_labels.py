@@ -0,0 +1,62 @@
+"""Задания на печать наклеек: состояние и PDF лежат файлами в LABEL_OUTPUT_DIR"""
+import os
+import time
+
+import pytest
+
+from database import db, Tool
+from label_sheets import get_label_job, prune_label_jobs
+
+pytest.importorskip('reportlab')
+pytest.importorskip('pypdf')
+pytest.importorskip('qrcode')
+
+
+def wait_for_job(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = client.get(status_url).get_json()
+        if data['status'] != 'running':
+            return data
+        time.sleep(0.05)
+    raise AssertionError('задание на печать не завершилось')
+
+
+def test_label_job_state_and_pdf_are_on_disk(app, client):
+    db.session.add_all(Tool(name=f'Ключ {i}', qr_code_identifier=f'LBL{i:05d}', location='Склад')
+                       for i in range(30))
+    db.session.commit()
+
+    response = client.post('/admin/labels', json={'location': 'Склад'})
+    assert response.status_code == 202
+    started = response.get_json()
+
+    data = wait_for_job(client, started['status_url'])
+    assert data['status'] == 'done', data['message']
+    assert data['done'] == data['total'] == 30
+
+    # Другой воркер видит то же задание: состояние читается из файла, а не из памяти
+    output_dir = app.config['LABEL_OUTPUT_DIR']
+    assert get_label_job(output_dir, started['job_id'])['status'] == 'done'
+
+    pdf = client.get(data['pdf_url'])
+    assert pdf.status_code == 200
+    assert pdf.data.startswith(b'%PDF')
+
+
+def test_unknown_or_malformed_job_id(client):
+    assert client.get('/admin/labels/' + '0' * 32).status_code == 404
+    assert client.get('/admin/labels/..%2F..%2Fconfig').status_code == 404
+
+
+def test_prune_removes_old_jobs_only(tmp_path):
+    old_id, new_id = 'a' * 32, 'b' * 32
+    for name in (f'{old_id}.json', f'{old_id}.pdf', f'{new_id}.json', 'notes.txt'):
+        (tmp_path / name).write_text('{}')
+    hour_ago = time.time() - 3600
+    for name in (f'{old_id}.json', f'{old_id}.pdf', 'notes.txt'):
+        os.utime(tmp_path / name, (hour_ago, hour_ago))
+
+    prune_label_jobs(str(tmp_path), keep_seconds=60)
+
+    assert sorted(os.listdir(tmp_path)) == [f'{new_id}.json', 'notes.txt']
@@ -0,0 +1,58 @@
+"""Живые обновления дашборда: изменения других процессов видны по версиям таблиц"""
+import json
+import time
+from datetime import datetime, timedelta
+
+from database import db, InventoryCounter, Request, Tool, User
+from live_events import EventBroker, VersionWatcher
+
+
+def _payload(message):
+    return json.loads(message.split('data: ', 1)[1])
+
+
+def test_sees_commits_of_other_processes(app):
+    user = User(first_name='Иван', last_name='Петров', employee_id='L1')
+    tool = Tool(name='Дрель', qr_code_identifier='LIVE0001')
+    db.session.add(Request(requester=user, requested_tool=tool, status=Request.STATUS_APPROVED,
+                           expected_return_time=datetime.now() - timedelta(days=1)))
+    db.session.commit()
+    watcher = VersionWatcher(EventBroker())
+    assert watcher.check() is None
+
+    # Другой воркер выдал инструмент: своё соединение, в этом процессе нет ни flush, ни коммита сессии
+    with db.engine.begin() as connection:
+        connection.execute(db.update(Tool).where(Tool.id == tool.id).values(is_available=False))
+        InventoryCounter.write(InventoryCounter.version_deltas('tools'), connection)
+    payload = watcher.check()
+    assert {'type': 'tool', 'action': 'updated', 'id': tool.id, 'is_available': False, 'name': 'Дрель'} \
+        in payload['events']
+    assert payload['counters'] is not None
+    assert watcher.check() is None
+
+    # Команда cron
+    result = app.test_cli_runner().invoke(args=['mark-overdue'])
+    assert result.exit_code == 0, result.output
+    events = watcher.check()['events']
+    assert {'type': 'overdue', 'count': 1} in events
+    assert [event['status'] for event in events if event['type'] == 'request'] == [Request.STATUS_OVERDUE]
+
+
+def test_thread_publishes_to_subscribers(app):
+    broker = EventBroker()
+    watcher = VersionWatcher(broker, poll_seconds=0.05)
+    subscriber = broker.subscribe()
+    watcher.start(app)
+    watcher.wake()
+
+    # Ждём, пока поток запомнит исходные версии
+    for _ in range(100):
+        if watcher._versions is not None:
+            break
+        time.sleep(0.05)
+    db.session.add(User(first_name='Анна', last_name='Смирнова', employee_id='L2'))
+    db.session.commit()
+
+    payload = _payload(subscriber.get(timeout=5))
+    assert [event['type'] for event in payload['events']] == ['user']
+    broker.unsubscribe(subscriber)
@@ -0,0 +1,42 @@
+"""Миграции схемы на базе с уже существующими данными"""
+from sqlalchemy import inspect, text
+
+from database import db, User
+from migrations import create_employee_id_key_index, employee_id_key_collisions, run_migrations
+
+
+def employee_id_index_is_unique():
+    indexes = {index['name']: index for index in inspect(db.engine).get_indexes('users')}
+    return bool(indexes['ix_users_employee_id_key']['unique'])
+
+
+def test_colliding_employee_ids_keep_index_non_unique_until_fixed(capsys):
+    # Как в базе до миграции 2: номера, различающиеся только регистром, уже есть
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP INDEX ix_users_employee_id_key'))
+    first = User(first_name='Иван', last_name='Петров', employee_id='AB-12')
+    second = User(first_name='Анна', last_name='Сидорова', employee_id='ab-12')
+    db.session.add_all([first, second, User(first_name='Пётр', last_name='Иванов', employee_id='XY-1')])
+    db.session.commit()
+
+    try:
+        with db.engine.begin() as connection:
+            assert employee_id_key_collisions(connection) == {'ab-12': [(first.id, 'AB-12'), (second.id, 'ab-12')]}
+            create_employee_id_key_index(connection)
+        assert not employee_id_index_is_unique()
+
+
+        # Пока совпадения не исправлены, migrate только напоминает о них
+        run_migrations()
+        assert not employee_id_index_is_unique()
+        assert f"id {second.id}: 'ab-12'" in capsys.readouterr().out
+
+        second.employee_id = 'AB-13'
+        db.session.commit()
+        run_migrations()
+        assert employee_id_index_is_unique()
+    finally:
+        db.session.rollback()
+        User.query.delete()
+        db.session.commit()
+        run_migrations()
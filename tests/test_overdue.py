@@ -0,0 +1,25 @@
+"""Пометка просроченных заявок командой mark-overdue (cron)"""
+from datetime import datetime, timedelta
+
+from database import db, Request, Tool, User
+
+
+def test_mark_overdue_command(app):
+    user = User(first_name='Иван', last_name='Петров', employee_id='O1')
+    late, on_time = Tool(name='Дрель', qr_code_identifier='OVER0001'), Tool(name='Пила', qr_code_identifier='OVER0002')
+    now = datetime.now()
+    db.session.add_all([
+        Request(requester=user, requested_tool=late, status=Request.STATUS_APPROVED,
+                expected_return_time=now - timedelta(days=1)),
+        Request(requester=user, requested_tool=on_time, status=Request.STATUS_APPROVED,
+                expected_return_time=now + timedelta(days=1)),
+    ])
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['mark-overdue'])
+    assert result.exit_code == 0, result.output
+    assert 'Помечено просроченных заявок: 1' in result.output
+
+    db.session.expire_all()
+    statuses = dict(db.session.query(Request.tool_id, Request.status))
+    assert statuses == {late.id: Request.STATUS_OVERDUE, on_time.id: Request.STATUS_APPROVED}
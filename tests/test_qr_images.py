@@ -0,0 +1,31 @@
+"""Картинки QR-кодов и их дисковый кэш"""
+import os
+
+import pytest
+
+from database import db, Tool
+
+pytest.importorskip('qrcode')
+
+
+def cached_files(app):
+    return [name for _, _, files in os.walk(app.config['QR_CACHE_DIR']) for name in files]
+
+
+def test_sizes_are_rounded_to_configured_steps(app, client):
+    db.session.add(Tool(name='Уровень', qr_code_identifier='QRIMG001'))
+    db.session.commit()
+    before = len(cached_files(app))
+
+    def etag(size):
+        response = client.get(f'/tool/QRIMG001/qr.png?size={size}')
+        assert response.status_code == 200
+        return response.headers['ETag']
+
+    # 250, 280 и 300 округляются до 300, 1 - до 120: два файла в кэше, а не четыре
+    assert etag(250) == etag(280) == etag(300) != etag(1)
+    assert len(cached_files(app)) - before == 2
+
+    huge = client.get('/tool/QRIMG001/qr.png?size=100000')
+    biggest = client.get(f"/tool/QRIMG001/qr.png?size={app.config['QR_IMAGE_SIZES'][-1]}")
+    assert huge.headers['ETag'] == biggest.headers['ETag']
@@ -0,0 +1,48 @@
+"""Кэш сканирований QR-кодов: сверка версий таблиц из нескольких потоков"""
+import threading
+
+from sqlalchemy import event
+
+from database import db
+from qr_lookup import qr_lookup
+
+
+def _not_found(qr_code):
+    return None, None
+
+
+def test_scan_does_not_start_second_version_check(app):
+    statements = []
+    started, release = threading.Event(), threading.Event()
+
+    def hold_first_check(conn, cursor, statement, parameters, context, executemany):
+        if 'inventory_counters' in statement:
+            statements.append(threading.get_ident())
+            if len(statements) == 1:
+                started.set()
+                release.wait(5)
+
+    def scan():
+        with app.app_context():
+            try:
+                qr_lookup.get('NOPE0001', loader=_not_found)
+            finally:
+                db.session.remove()
+
+    qr_lookup.check_seconds = 0
+    event.listen(db.engine, 'before_cursor_execute', hold_first_check)
+    try:
+        first = threading.Thread(target=scan)
+        first.start()
+        assert started.wait(5)
+        # Первая сверка ещё идёт - второй скан не запускает свою и не ждёт первую
+        qr_lookup.get('NOPE0002', loader=_not_found)
+        release.set()
+        first.join()
+    finally:
+        release.set()
+        event.remove(db.engine, 'before_cursor_execute', hold_first_check)
+        qr_lookup.check_seconds = app.config['QR_LOOKUP_CHECK_SECONDS']
+
+    assert statements == [first.ident]
+    assert qr_lookup._synced_at is not None
@@ -0,0 +1,107 @@
+"""
+Горячие запросы к заявкам идут по индексам (EXPLAIN QUERY PLAN, SQLite).
+
+Запросы не переписываются в тесте, а перехватываются у самих страниц и API:
+если код или схема изменятся так, что запрос начнёт читать всю таблицу,
+тест это увидит.
+"""
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from database import db, Request, Tool, User
+
+FULL_SCAN = re.compile(r'^SCAN (requests|users)( AS \w+)?$')
+
+
+def capture_plans(action):
+    """Выполнить action() и вернуть [(SQL, [строки плана])] для всех его SELECT и UPDATE"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        action()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    connection = db.session.connection()
+    return [(statement, [row[3] for row in connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, parameters
+    )]) for statement, parameters in statements]
+
+
+@pytest.fixture
+def loans(sqlite_only):
+    """Немного сотрудников, инструментов и заявок во всех статусах"""
+    now = datetime.utcnow()
+    users = [User(first_name=f'Имя{i}', last_name=f'Фамилия{i}', employee_id=f'P{i}') for i in range(3)]
+    tools = [Tool(name=f'Инструмент {i}', qr_code_identifier=f'PLAN{i:04d}') for i in range(4)]
+    db.session.add_all(users + tools)
+    statuses = [Request.STATUS_APPROVED, Request.STATUS_OVERDUE, Request.STATUS_RETURNED, Request.STATUS_RETURNED]
+    for i, (tool, status) in enumerate(zip(tools, statuses)):
+        tool.is_available = status == Request.STATUS_RETURNED
+        db.session.add(Request(
+            requester=users[i % len(users)], requested_tool=tool, status=status,
+            request_time=now - timedelta(days=10), approval_time=now - timedelta(days=10),
+            expected_return_time=now - timedelta(days=3),
+            actual_return_time=now - timedelta(days=1) if status == Request.STATUS_RETURNED else None,
+        ))
+    db.session.commit()
+    return {'tool_id': tools[0].id, 'user': users[0]}
+
+
+def assert_uses_index(plans, table, index):
+    touching = [(statement, plan) for statement, plan in plans if re.search(rf'\b{table}\b', statement)]
+    assert touching, f'ни одного запроса к {table}'
+    for statement, plan in touching:
+        assert not any(FULL_SCAN.match(line) for line in plan), f'{plan}\n{statement}'
+    assert any(index in line for _, plan in touching for line in plan), [plan for _, plan in touching]
+
+
+def test_active_loan_lookup(client, loans):
+    plans = capture_plans(lambda: client.post('/api/verify-return', json={
+        'first_name': 'Имя0', 'last_name': 'Фамилия0', 'tool_id': loans['tool_id']
+    }))
+    assert_uses_index(plans, 'requests', 'ix_requests_tool_status')
+
+
+def test_dashboard(client, loans):
+    plans = capture_plans(lambda: client.get('/admin/').get_data())
+    assert_uses_index(plans, 'requests', 'ix_requests_request_time')
+    assert_uses_index(plans, 'requests', 'ix_requests_status_expected_return')
+
+    plans = capture_plans(lambda: client.get('/admin/?status=approved').get_data())
+    assert_uses_index(plans, 'requests', 'ix_requests_status_request_time')
+
+
+def test_overdue_sweep(loans):
+    plans = capture_plans(lambda: Request.mark_overdue(datetime.utcnow()))
+    db.session.rollback()
+    assert_uses_index(plans, 'requests', 'ix_requests_status_expected_return')
+
+
+def test_per_user_request_counts(client, loans):
+    plans = capture_plans(lambda: client.get('/admin/users'))
+    assert_uses_index(plans, 'requests', 'ix_requests_user_id')
+
+
+def test_user_lookup_by_name(client, loans):
+    plans = capture_plans(lambda: client.post('/api/check-user', json={
+        'first_name': 'Имя0', 'last_name': 'Фамилия0'
+    }))
+    assert_uses_index(plans, 'users', 'ix_users_name_key')
+
+
+def test_return_history_page_is_read_in_index_order(client, loans):
+    plans = capture_plans(lambda: client.get('/admin/history'))
+    assert_uses_index(plans, 'requests', 'ix_requests_status_returned')
+
+    page = [plan for statement, plan in plans if 'ORDER BY requests.actual_return_time DESC' in statement]
+    assert page
+    assert not any('TEMP B-TREE' in line for plan in page for line in plan), page
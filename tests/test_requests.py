@@ -0,0 +1,57 @@
+"""Выдача и возврат инструмента через киоск"""
+from database import db, InventoryCounter, Request, Tool, User
+
+
+def make_user_and_tool():
+    user = User(first_name='Иван', last_name='Петров', employee_id='E1', department='Цех 1')
+    tool = Tool(name='Дрель', qr_code_identifier='QR000001', category='Электроинструмент', location='Склад')
+    db.session.add_all([user, tool])
+    db.session.commit()
+    return user.id, tool.id
+
+
+def test_checkout_and_return(client):
+    user_id, tool_id = make_user_and_tool()
+
+    response = client.post('/api/create-request', json={'user_id': user_id, 'tool_id': tool_id, 'purpose': 'ремонт'})
+    assert response.status_code == 200
+    request_id = response.get_json()['request_id']
+
+    response = client.post('/api/create-request', json={'user_id': user_id, 'tool_id': tool_id})
+    assert response.status_code == 409
+
+    response = client.post('/api/return-tool', json={'request_id': request_id, 'condition_after': 'исправна'})
+    assert response.status_code == 200, response.get_json()['message']
+
+    response = client.post('/api/return-tool', json={'request_id': request_id})
+    assert response.status_code == 400
+
+    request_obj = db.session.get(Request, request_id)
+    assert request_obj.status == Request.STATUS_RETURNED
+    assert request_obj.condition_after == 'исправна'
+    assert db.session.get(Tool, tool_id).is_available
+
+
+def test_counters_match_reconcile(client):
+    user_id, tool_id = make_user_and_tool()
+    response = client.post('/api/create-request', json={'user_id': user_id, 'tool_id': tool_id})
+    assert response.status_code == 200
+
+    counters = InventoryCounter.totals()
+    assert counters['available_tools'] == 0
+    assert counters['active_requests'] == 1
+
+    InventoryCounter.reconcile()
+    assert InventoryCounter.totals() == counters
+
+
+def test_rolled_back_counters_are_discarded(client):
+    make_user_and_tool()
+    before = InventoryCounter.totals()
+
+    db.session.add(Tool(name='Лишний', qr_code_identifier='QR000002'))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+
+    assert InventoryCounter.totals() == before
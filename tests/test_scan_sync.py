@@ -0,0 +1,22 @@
+"""Пачки событий офлайн-сканеров (/api/scans/batch)"""
+from datetime import datetime
+
+from database import db, Request, Tool, User
+
+
+def test_batch_checkout_uses_loan_period(client):
+    user = User(first_name='Иван', last_name='Петров', employee_id='S1')
+    tool = Tool(name='Болгарка', qr_code_identifier='SCAN0001')
+    db.session.add_all([user, tool])
+    db.session.commit()
+
+    scanned_at = datetime(2026, 3, 2, 8, 30)
+    response = client.post('/api/scans/batch', json={'device_id': 'scanner-1', 'events': [{
+        'key': 'scanner-1:1', 'type': 'checkout', 'qr_code': 'SCAN0001',
+        'user': {'user_id': user.id}, 'client_time': scanned_at.isoformat(),
+    }]})
+    assert response.status_code == 200, response.get_json()
+
+    loan = Request.query.filter_by(tool_id=tool.id).one()
+    assert loan.status == Request.STATUS_APPROVED
+    assert loan.expected_return_time == scanned_at + Request.LOAN_PERIOD
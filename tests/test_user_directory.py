@@ -0,0 +1,25 @@
+"""Справочник сотрудников для подсказок в киоске"""
+from datetime import timedelta
+
+from database import db, normalize_key, User
+from user_directory import user_directory
+
+
+def test_sees_change_committed_after_sync_with_earlier_timestamp():
+    user = User(first_name='Иван', last_name='Петров', employee_id='D1')
+    db.session.add(user)
+    db.session.commit()
+    user_directory.refresh(force=True)
+    assert [found['id'] for found in user_directory.search('петров')] == [user.id]
+
+    # Транзакция, начатая до синхронизации, закоммитила переименование после неё:
+    # updated_at меньше отметки справочника, число активных не изменилось
+    db.session.execute(db.update(User).where(User.id == user.id).values(
+        last_name='Сидоров', last_name_key=normalize_key('Сидоров'),
+        updated_at=user_directory._synced_at - timedelta(seconds=1),
+    ))
+    db.session.commit()
+    user_directory.refresh(force=True)
+
+    assert [found['id'] for found in user_directory.search('сидоров')] == [user.id]
+    assert user_directory.search('петров') == []
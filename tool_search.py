@@ -0,0 +1,195 @@
+"""
+Полнотекстовый поиск инструментов.
+
+SQLite: таблица FTS5 tools_fts (rowid = tools.id), которую заполняют
+триггеры на tools - поэтому индекс актуален при любых изменениях, в том
+числе при массовом импорте мимо ORM. PostgreSQL: GIN-индекс по
+to_tsvector('russian', ...). Если ни то ни другое недоступно - поиск
+через ILIKE по тем же полям.
+
+Русский текст: регистр складывает токенизатор, ё заменяется на е, а у слов
+запроса отрезается окончание и ищется префикс - "дрели" найдёт "дрель",
+"перфораторы" - "перфоратор".
+"""
+import re
+
+from sqlalchemy import text
+
+from database import db, Tool, normalize_key
+
+# Поля поиска и их вес в ранжировании (bm25 / ts_rank)
+SEARCH_FIELDS = (
+    ('name', 10.0),
+    ('model', 5.0),
+    ('manufacturer', 3.0),
+    ('serial_number', 5.0),
+    ('storage_place', 2.0),
+    ('description', 1.0),
+)
+
+# Окончания русских слов, которые отрезаются у слов запроса (длинные - первыми)
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов', 'ев',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+
+# Короче этого основу слова не обрезаем
+MIN_STEM_LENGTH = 4
+
+_CYRILLIC = re.compile('[а-я]')
+
+# Какой поиск доступен для базы: url -> 'fts5' | 'postgresql' | 'like'
+_backends = {}
+
+
+def _fold_sql(column):
+    """SQL-выражение: значение колонки с ё, заменённой на е (регистр сложит FTS5)"""
+    return f"replace(replace(coalesce({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _pg_document():
+    """Документ для PostgreSQL; должен совпадать с выражением GIN-индекса"""
+    parts = " || ' ' || ".join(f"coalesce({field}, '')" for field, _ in SEARCH_FIELDS)
+    return f"to_tsvector('russian', translate({parts}, 'ёЁ', 'еЕ'))"
+
+
+_FTS_COLUMNS = ', '.join(field for field, _ in SEARCH_FIELDS)
+
+
+def _fts_values(prefix):
+    return ', '.join(_fold_sql(f'{prefix}.{field}') for field, _ in SEARCH_FIELDS)
+
+
+def create_search_index(connection):
+    """Шаг миграции: индекс полнотекстового поиска и его первичное заполнение"""
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_tools_search ON tools USING GIN (({_pg_document()}))'
+        ))
+        return
+
+    if dialect != 'sqlite' or not _sqlite_has_fts5(connection):
+        print("⚠️  FTS5 недоступен, поиск инструментов будет работать через LIKE")
+        return
+
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS tools_fts USING fts5({_FTS_COLUMNS}, "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS tools_fts_insert AFTER INSERT ON tools BEGIN "
+        f"INSERT INTO tools_fts (rowid, {_FTS_COLUMNS}) VALUES (new.id, {_fts_values('new')}); END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tools_fts_delete AFTER DELETE ON tools BEGIN "
+        "DELETE FROM tools_fts WHERE rowid = old.id; END"
+    ))
+    # Только при изменении полей поиска - выдача и возврат (is_available) индекс не трогают
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS tools_fts_update AFTER UPDATE OF {_FTS_COLUMNS} ON tools BEGIN "
+        f"DELETE FROM tools_fts WHERE rowid = old.id; "
+        f"INSERT INTO tools_fts (rowid, {_FTS_COLUMNS}) VALUES (new.id, {_fts_values('new')}); END"
+    ))
+    connection.execute(text('DELETE FROM tools_fts'))
+    connection.execute(text(
+        f"INSERT INTO tools_fts (rowid, {_FTS_COLUMNS}) SELECT id, {_fts_values('tools')} FROM tools"
+    ))
+
+
+def _sqlite_has_fts5(connection):
+    options = {row[0] for row in connection.execute(text('PRAGMA compile_options'))}
+    return 'ENABLE_FTS5' in options
+
+
+def search_backend():
+    """Какой поиск доступен в текущей базе (проверяется один раз)"""
+    url = str(db.engine.url)
+    if url not in _backends:
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            _backends[url] = 'postgresql'
+        elif dialect == 'sqlite' and db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tools_fts'")).first():
+            _backends[url] = 'fts5'
+        else:
+            _backends[url] = 'like'
+    return _backends[url]
+
+
+def query_terms(query):
+    """Слова запроса: нижний регистр, ё -> е, у русских слов отрезано окончание"""
+    terms = []
+    for word in re.findall(r'\w+', normalize_key(query) or ''):
+        if _CYRILLIC.search(word):
+            for ending in RUSSIAN_ENDINGS:
+                if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                    word = word[:-len(ending)]
+                    break
+        terms.append(word)
+    return terms
+
+
+def _fts_match(terms):
+    # Каждое слово - префикс в кавычках, слова объединяются через AND
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _pg_tsquery(terms):
+    """Условие совпадения и выражение ранга для PostgreSQL"""
+    document = db.literal_column(_pg_document())
+    tsquery = db.func.to_tsquery('russian', ' & '.join(f'{term}:*' for term in terms))
+    return document.op('@@')(tsquery), db.func.ts_rank(document, tsquery)
+
+
+def search_condition(query):
+    """Условие WHERE для Tool.query: инструменты, подходящие под запрос"""
+    terms = query_terms(query)
+    if not terms:
+        return db.true()
+
+    backend = search_backend()
+    if backend == 'fts5':
+        return Tool.id.in_(
+            text('SELECT rowid FROM tools_fts WHERE tools_fts MATCH :fts_query')
+            .bindparams(fts_query=_fts_match(terms))
+            .columns(db.column('rowid', db.Integer))
+        )
+    if backend == 'postgresql':
+        return _pg_tsquery(terms)[0]
+
+    return db.and_(*(
+        db.or_(*(getattr(Tool, field).ilike(f'%{term}%') for field, _ in SEARCH_FIELDS))
+        for term in terms
+    ))
+
+
+def search_tools(query, offset=0, limit=20):
+    """
+    Инструменты по запросу, самые релевантные первыми.
+    Возвращает список Tool (не больше limit) начиная с offset.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    backend = search_backend()
+    if backend == 'fts5':
+        weights = ', '.join(str(weight) for _, weight in SEARCH_FIELDS)
+        ids = db.session.execute(
+            text(f'SELECT rowid FROM tools_fts WHERE tools_fts MATCH :fts_query '
+                 f'ORDER BY bm25(tools_fts, {weights}), rowid LIMIT :limit OFFSET :offset'),
+            {'fts_query': _fts_match(terms), 'limit': limit, 'offset': offset}
+        ).scalars().all()
+        tools = {tool.id: tool for tool in Tool.query.filter(Tool.id.in_(ids))} if ids else {}
+        return [tools[tool_id] for tool_id in ids if tool_id in tools]
+
+    if backend == 'postgresql':
+        order = (_pg_tsquery(terms)[1].desc(), Tool.id)
+    else:
+        order = (Tool.name, Tool.id)
+
+    return Tool.query.filter(search_condition(query)).order_by(*order).offset(offset).limit(limit).all()
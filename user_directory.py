@@ -0,0 +1,154 @@
+"""
+Справочник активных сотрудников в памяти для подсказок при вводе (typeahead).
+
+Ключи поиска (фамилия, имя, табельный номер в виде normalize_key) лежат в
+отсортированном списке, поэтому поиск по префиксу - это bisect и короткий
+проход вперёд, без обращения к базе.
+
+Справочник обновляется инкрементально: не чаще раза в refresh_seconds
+читаются только пользователи с updated_at не раньше последней синхронизации
+(минус CURSOR_OVERLAP, как в delta_sync).
+Удаления и изменения из других процессов, которые не видны по updated_at,
+ловятся сверкой числа активных пользователей - при расхождении справочник
+перестраивается целиком.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from database import db, User, normalize_key
+from delta_sync import CURSOR_OVERLAP
+
+# Больше стольких кандидатов по одному префиксу не перебираем
+MAX_CANDIDATES = 2000
+
+
+class UserDirectory:
+    """Отсортированный массив ключей (ключ, id) и карточки активных сотрудников"""
+
+    def __init__(self, refresh_seconds=5):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._keys = []
+        self._users = {}
+        self._synced_at = None
+        self._checked_at = None
+
+    def search(self, query, limit=10):
+        """Сотрудники, у которых каждое слово запроса - начало фамилии, имени или табельного номера"""
+        tokens = re.findall(r'[\w-]+', normalize_key(query) or '')
+        if not tokens:
+            return []
+
+        self.refresh()
+
+        with self._lock:
+            # Кандидатов перебираем по самому длинному (обычно самому избирательному)
+            # слову в порядке ключей - первые limit подходящих уже отсортированы
+            found = []
+            for user_id in self._prefix_ids(max(tokens, key=len)):
+                entry = self._users[user_id]
+                if all(any(key.startswith(token) for key in entry['keys']) for token in tokens):
+                    found.append(entry['user'])
+                    if len(found) == limit:
+                        break
+            return found
+
+    def refresh(self, force=False):
+        """Подтянуть изменения из базы, если с прошлой проверки прошло refresh_seconds"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return
+
+            if self._synced_at is None:
+                self._rebuild()
+            else:
+                self._apply_changes()
+            self._checked_at = now
+
+    def _columns(self):
+        return db.session.query(
+            User.id, User.first_name, User.last_name, User.employee_id, User.department,
+            User.first_name_key, User.last_name_key, User.employee_id_key,
+            User.is_active, User.updated_at
+        )
+
+    def _rebuild(self):
+        self._keys = []
+        self._users = {}
+        self._synced_at = None
+        for row in self._columns().filter(User.is_active == True):
+            self._add(row)
+        self._keys.sort()
+        self._synced_at = db.session.query(db.func.max(User.updated_at)).scalar()
+
+    def _apply_changes(self):
+        # Окно перекрытия: строку с отметкой времени чуть раньше прошлой
+        # синхронизации могли закоммитить уже после неё. Перечитанные повторно
+        # строки просто заменяются
+        rows = self._columns().filter(User.updated_at >= self._synced_at - CURSOR_OVERLAP).all()
+        for row in rows:
+            self._remove(row.id)
+            if row.is_active:
+                self._add(row, keep_sorted=True)
+            if row.updated_at > self._synced_at:
+                self._synced_at = row.updated_at
+
+        active = db.session.query(db.func.count(User.id)).filter(User.is_active == True).scalar()
+        if active != len(self._users):
+            self._rebuild()
+
+    def _add(self, row, keep_sorted=False):
+        (user_id, first_name, last_name, employee_id, department,
+         first_name_key, last_name_key, employee_id_key) = row[:8]
+        keys = tuple(key for key in (
+            last_name_key or normalize_key(last_name),
+            first_name_key or normalize_key(first_name),
+            employee_id_key or normalize_key(employee_id),
+        ) if key)
+        self._users[user_id] = {
+            'keys': keys,
+            'user': {
+                'id': user_id,
+                'first_name': first_name,
+                'last_name': last_name,
+                'employee_id': employee_id,
+                'department': department,
+            },
+        }
+        for key in keys:
+            if keep_sorted:
+                insort(self._keys, (key, user_id))
+            else:
+                self._keys.append((key, user_id))
+
+    def _remove(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if not entry:
+            return
+        for key in entry['keys']:
+            index = bisect_left(self._keys, (key, user_id))
+            if index < len(self._keys) and self._keys[index] == (key, user_id):
+                del self._keys[index]
+
+    def _prefix_ids(self, prefix):
+        """id сотрудников, у которых есть ключ с этим префиксом, в порядке ключей"""
+        seen = set()
+        index = bisect_left(self._keys, (prefix,))
+        end = min(len(self._keys), index + MAX_CANDIDATES)
+        while index < end:
+            key, user_id = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+            index += 1
+
+
+user_directory = UserDirectory()
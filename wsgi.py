@@ -0,0 +1,16 @@
+"""
+Точка входа WSGI для сервера приложений, например:
+
+    gunicorn -w 4 -k gthread --threads 8 wsgi:app
+
+Импорт не трогает базу: перед первым запуском (и после обновления)
+выполните flask --app app init-db, для демо-данных - flask --app app seed.
+Просроченные заявки помечает cron (flask --app app mark-overdue), а не
+воркеры: OVERDUE_SWEEP_SECONDS по умолчанию 0.
+
+Каждая открытая вкладка дашборда занимает поток воркера на соединение
+/admin/events - закладывайте их в --threads.
+"""
+from app import create_app
+
+app = create_app()